@@ -5,6 +5,11 @@ tsqr_cxx.py
 ===========
 
 Submit the C++ version of tsqr to the hadoop streaming system.
+
+With -trace yes, the launch and finish time of each stage is written
+to <output>/_trace.driver.tsqr_cxx.json, and with -trace <dir>, to a
+local directory.  Merge it with the traces of other jobs with
+dumbo/tasktrace.py.
 """
 __author__ = 'David F. Gleich'
 
@@ -28,6 +33,12 @@ import subprocess
 
 import hadoopy
 
+# the trace is shared with the dumbo code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..','dumbo'))
+import checkpoint
+import tasktrace
+
 def get_args(argv):
     args = {}
     for i,arg in enumerate(argv):
@@ -89,6 +100,11 @@ if __name__=='__main__':
     steps = schedule.split(',')
     steps = [int(s) for s in steps]
     
+    trace = args.get('trace','no')
+    timeline = None
+    if trace != 'no':
+        timeline = tasktrace.timeline('tsqr_cxx')
+    
     for i,step in enumerate(steps):
         cur_args = [arg for arg in hadoop_args]
         
@@ -123,6 +139,16 @@ if __name__=='__main__':
             print "Removing %s"%(curoutput)
             hadoopy.rm(curoutput)
 
+        if timeline is not None:
+            timeline.launch('%i (%i)'%(i+1,step))
         subprocess.check_call(' '.join(cmd),shell=True)
+        if timeline is not None:
+            timeline.finish()
+            
+    if timeline is not None:
+        if trace == 'yes':
+            timeline.save(checkpoint.HadoopFS(),output)
+        else:
+            timeline.save(checkpoint.LocalFS(),trace)
 
 
@@ -7,7 +7,23 @@ Cholesky.py
 Implement a Cholesky QR algorithm using dumbo and numpy.
 
 Assumes that matrix is stored as a typedbytes vector and that
-the user knows how many columns are in the matrix.
+the user knows how many columns are in the matrix.  The matrix
+can also be stored as packed blocks of rows, see rowblock.py.
+
+The driver skips the stages of -reduce_schedule that are current from
+the last run, like tsqr.py, unless the schedule has a spray stage,
+s<int>.  Use -checkpoint no to run every stage.
+
+With -memstats yes or -memstats <dir>, each task reports its peak
+memory and the peak size of its buffer, see memstats.py.
+
+With -profile cprofile or -profile sample, each task runs under a
+profiler, and with -trace yes or -trace <dir>, each task records a
+timeline, see tsqr.py, taskprof.py, and tasktrace.py.
+
+With -reducestats yes, the default with -hadoop, each reducer measures
+its input, and the driver prints the skew of the reducers of each
+stage, see tsqr.py and reducestats.py.
 """
 
 import sys
@@ -20,6 +36,9 @@ import numpy
 import numpy.linalg
 
 import util
+import rowblock
+import memstats
+import tasktrace
 
 import dumbo
 import dumbo.backends.common
@@ -61,10 +80,13 @@ class AtA(dumbo.backends.common.MapRedBase):
         self.first_key = None
         self.isreducer=isreducer
         self.nrows = 0
+        self.nbuffered = 0
         self.data = []
         self.ncols = ncols
         self.A_curr = None
         self.row = None
+        self.ncompress = 0
+        self.memstats = memstats.MemStats('AtA')
     
     def _firstkey(self, i):
         if isinstance(self.first_key, (list,tuple)):
@@ -74,26 +96,34 @@ class AtA(dumbo.backends.common.MapRedBase):
     
     def array2list(self,row):
         return [float(val) for val in row]
+        
+    def counter(self,group,name,value):
+        self.counters[name] += value
 
     def compress(self):
         # Compute AtA on the data accumulated so far
         if self.ncols is None:
             return
-        if len(self.data) < self.ncols:
+        if self.nbuffered < self.ncols:
             return
             
+        tasktrace.since('read')
+        self.memstats.buffer('compression buffer',self.data)
         t0 = time.time()
-        A_mat = numpy.mat(self.data)
+        A_mat = numpy.mat(numpy.vstack(self.data))
+        self.ncompress += 1
         A_flush = A_mat.T*A_mat
         dt = time.time() - t0
         self.counters['numpy time (millisecs)'] += int(1000*dt)
 
         # reset data and add flushed update to local copy
         self.data = []
-        if self.A_curr == None:
+        self.nbuffered = 0
+        if self.A_curr is None:
             self.A_curr = A_flush
         else:
             self.A_curr = self.A_curr + A_flush
+        tasktrace.since('compress')
 
     
     def collect(self,key,value):
@@ -112,20 +142,35 @@ class AtA(dumbo.backends.common.MapRedBase):
                 return
         
         self.data.append(value)
-        self.nrows += 1
+        self._buffered(1)
         
-        if len(self.data)>self.blocksize*self.ncols:
+    def collect_block(self,key,block):
+        """ Collect a 2d array of rows at once. """
+        if self.nbuffered == 0:
+            self.first_key = key
+        if block.shape[1] != self.ncols:
+            return
+        self.data.append(block)
+        self._buffered(block.shape[0])
+        
+    def _buffered(self,nrows):
+        """ Update the counts after nrows were added to the buffer. """
+        # write status updates so Hadoop doesn't complain
+        if (self.nrows+nrows)/50000 > self.nrows/50000:
+            self.counters['rows processed'] += \
+                50000*((self.nrows+nrows)/50000 - self.nrows/50000)
+        self.nbuffered += nrows
+        self.nrows += nrows
+        
+        if self.nbuffered>self.blocksize*self.ncols:
             self.counters['AtA Compressions'] += 1
             # compress the data
             self.compress()
-            
-        # write status updates so Hadoop doesn't complain
-        if self.nrows%50000 == 0:
-            self.counters['rows processed'] += 50000
 
     def close(self):
         self.counters['rows processed'] += self.nrows%50000
         self.compress()
+        self.memstats.finish(self.counter)
         for ind, row in enumerate(self.A_curr.getA()):
             r = self.array2list(row)
             yield ind, struct.pack('d'*len(r),*r)
@@ -135,6 +180,10 @@ class AtA(dumbo.backends.common.MapRedBase):
         if self.isreducer == False:
             # map job
             for key,value in data:
+                if len(value) != 8*self.ncols and rowblock.isblock(value):
+                    # a packed block of rows, see rowblock.py
+                    self.collect_block(key,rowblock.unpack(value))
+                    continue
                 value = list(struct.unpack('d'*self.ncols, value))
                 self.collect(key,value)
 
@@ -142,7 +191,7 @@ class AtA(dumbo.backends.common.MapRedBase):
             for key,values in data:
                 for value in values:
                     val = list(struct.unpack('d'*self.ncols, value))
-                    if self.row == None:
+                    if self.row is None:
                         self.row = numpy.array(val)
                     else:
                         self.row = self.row + numpy.array(val)                        
@@ -153,6 +202,16 @@ class AtA(dumbo.backends.common.MapRedBase):
             for key,val in self.close():
                 yield key, val
     
+def spray_stages(schedule):
+    return [part for part in schedule if part.startswith('s')]
+
+def job_params():
+    """ The parameters of the stages in their manifests, see
+    util.GlobalOptions.first_stage. """
+    return {'script': 'CholeskyQR.py',
+        'blocksize': gopts.getintkey('blocksize'),
+        'ncols': gopts.getintkey('ncols')}
+    
 def runner(job):
     blocksize = gopts.getintkey('blocksize')
     schedule = gopts.getstrkey('reduce_schedule')
@@ -161,13 +220,22 @@ def runner(job):
        sys.exit('ncols must be a positive integer')
     
     schedule = schedule.split(',')
+    # the stages before first are current, see starter, but a spray
+    # stage runs two iterations, so then there are no checkpoints
+    first = gopts.getintkey('first_stage',0)
+    staged = not spray_stages(schedule)
     for i,part in enumerate(schedule):
+        premapper = gopts.premapper('cholesky','%i (%s)'%(i+1,part))
+        if staged:
+            premapper = gopts.staged(premapper,i,schedule,job_params())
+        if i < first:
+            continue
         if part.startswith('s'):
             nreducers = int(part[1:])
             # these tasks should just spray data and compress
             job.additer(mapper="org.apache.hadoop.mapred.lib.IdentityMapper",
                 reducer="org.apache.hadoop.mapred.lib.IdentityReducer",
-                opts=[('numreducetasks',str(nreducers))])
+                opts=[('numreducetasks',str(nreducers))],premapper=premapper)
             job.additer(mapper, reducer, opts=[('numreducetasks',str(nreducers))])
             
         else:
@@ -178,7 +246,14 @@ def runner(job):
             else:
                 mapper = 'org.apache.hadoop.mapred.lib.IdentityMapper'
                 reducer = Cholesky(ncols=ncols)
-            job.additer(mapper=mapper, reducer=reducer, opts=[('numreducetasks',str(nreducers))])
+            if i==0:
+                mapper = gopts.instrument(mapper,'AtA-%i-map'%(i+1))
+                reducer = gopts.instrument(reducer,'AtA-%i-reduce'%(i+1))
+            else:
+                reducer = gopts.instrument(reducer,'cholesky-%i-reduce'%(i+1))
+            # report the reducers of the last stage in the driver
+            job.additer(mapper=mapper, reducer=reducer, opts=[('numreducetasks',str(nreducers))],
+                premapper=premapper)
     
 
 def starter(prog):
@@ -204,6 +279,13 @@ def starter(prog):
         prog.addopt('libegg', 'numpy')
         
     prog.addopt('file',os.path.join(mypath,'util.py'))
+    prog.addopt('file',os.path.join(mypath,'rowblock.py'))
+    prog.addopt('file',os.path.join(mypath,'memstats.py'))
+    prog.addopt('file',os.path.join(mypath,'taskprof.py'))
+    prog.addopt('file',os.path.join(mypath,'tasktrace.py'))
+    prog.addopt('file',os.path.join(mypath,'reducestats.py'))
+    prog.addopt('file',os.path.join(mypath,'checkpoint.py'))
+    prog.addopt('file',os.path.join(mypath,'local_util.py'))
 
 
     numreps = prog.delopt('replication')
@@ -218,10 +300,24 @@ def starter(prog):
     gopts.getintkey('blocksize',3)
     gopts.getstrkey('reduce_schedule','1')
     gopts.getintkey('ncols', -1)
+    gopts.getstrkey('memstats','no')
+    gopts.getintkey('tracemalloc',0)
+    try:
+        gopts.getprofile()
+    except ValueError, msg:
+        return str(msg)
+    gopts.gettrace()
     
     output = prog.getopt('output')
     if not output:
-        prog.addopt('output','%s-chol-qrr%s'%(matname,matext))
+        output = '%s-chol-qrr%s'%(matname,matext)
+        prog.addopt('output',output)
+    gopts.setjob(output,prog.getopt('hadoop'))
+    
+    # skip the stages that are current from the last run
+    schedule = gopts.getstrkey('reduce_schedule').split(',')
+    if not spray_stages(schedule):
+        gopts.first_stage([mat]*int(numreps),schedule,job_params())
         
     splitsize = prog.delopt('split_size')
     if splitsize is not None:
@@ -0,0 +1,255 @@
+#!/usr/bin/env dumbo
+
+"""
+backward_error.py
+=================
+
+Compute the backward error of an R factor from a TSQR,
+
+    ||A'*A - R'*R||/||A||^2
+
+in the 2-norm and the Frobenius norm, in one pass over the matrix A.
+The mappers compute A'*A for their rows and a single reducer sums them.
+The R factor is copied to the local machine before the job starts and
+shipped to the reducer, which compares A'*A with R'*R.
+
+With -test_problem yes, the reducer also checks R against the exact R
+factor of a problem from generate_test_problems.py, like
+check_test_problem.py.  The default -tol grows with the number of
+columns, see check_test_problem.default_tol.
+
+Usage
+-----
+
+    dumbo start backward_error.py -mat <A path> -qrr <R path> \\
+        [-output <path> -blocksize <int> -test_problem yes -tol <float>]
+
+      -output <path> : the output with the errors, the default is
+        <R path>-error.  See the errors with dumbo cat <path>/part-00000
+
+      -blocksize <int> : each mapper computes A'*A in blocks of
+        blocksize*ncols rows.  The default is 3.
+
+History
+-------
+:2011-03-15: Initial coding
+"""
+
+import sys
+import os
+import time
+
+import numpy
+import numpy.linalg
+
+import util
+import rowblock
+import textrows
+import check_test_problem
+
+import dumbo
+import dumbo.util
+import dumbo.backends.common
+
+# create the global options structure
+gopts = util.GlobalOptions()
+
+class RConverter:
+    """ Convert an R factor from Hadoop typed bytes to a local .npy file """
+    def __init__(self,filename):
+        self.filename = filename
+    def __call__(self,data):
+        R = check_test_problem.read_R(data)
+        numpy.save(self.filename, R)
+
+def setup_backward_error(backend, fs, opts):
+    """ Copy the R factor to the local machine and ship it to the job.
+
+    This function is called by the host python command right
+    before starting the map-reduce iteration.
+    """
+    qrr = gopts.getstrkey('qrr')
+    localR = gopts.getstrkey('R_filename')
+
+    print >>sys.stderr
+    print >>sys.stderr, "Copying %s to %s"%(qrr,localR)
+    print >>sys.stderr
+
+    fs.convert(qrr, opts, RConverter(localR))
+
+    opts.append(('file',localR))
+
+class Gram(dumbo.backends.common.MapRedBase):
+    """ Compute A'*A for the rows of A in a mapper. """
+    def __init__(self,blocksize=3):
+        self.blocksize = blocksize
+        self.ncols = None
+        self.G = None
+        self.block = None
+        self.nbuffered = 0
+        self.nrows = 0
+        self.lines = textrows.LineBatch()
+
+    def compress(self):
+        if self.nbuffered == 0:
+            return
+        t0 = time.time()
+        B = self.block[:self.nbuffered]
+        self.G += numpy.dot(B.T,B)
+        dt = time.time() - t0
+        self.counters['numpy time (millisecs)'] += int(1000*dt)
+        self.counters['rows processed'] += self.nbuffered
+        self.nbuffered = 0
+
+    def collect_block(self,block):
+        if self.ncols is None:
+            self.ncols = block.shape[1]
+            print >>sys.stderr, "Matrix size: %i columns"%(self.ncols)
+            self.G = numpy.zeros((self.ncols,self.ncols))
+            self.block = numpy.empty((self.blocksize*self.ncols,self.ncols))
+        elif block.shape[1] != self.ncols:
+            raise ValueError("row %i has %i cols but row 1 had %i cols"%(
+                self.nrows+1, block.shape[1], self.ncols))
+
+        while block.shape[0] > 0:
+            k = min(block.shape[0],self.block.shape[0]-self.nbuffered)
+            self.block[self.nbuffered:self.nbuffered+k] = block[:k]
+            self.nbuffered += k
+            self.nrows += k
+            block = block[k:]
+            if self.nbuffered == self.block.shape[0]:
+                self.compress()
+
+    def collect_lines(self):
+        """ Parse the batch of lines of text and collect the rows. """
+        keys,A,nbad = self.lines.parse(self.ncols)
+        if nbad > 0:
+            self.counters['malformed lines'] += nbad
+        if len(keys) > 0:
+            self.collect_block(A)
+
+    def __call__(self,data):
+        for key,value in data:
+            if rowblock.isblock(value):
+                block = rowblock.unpack(value)
+            elif isinstance(value, str):
+                # parse lines of text in batches
+                if self.lines.append(key,value):
+                    self.collect_lines()
+                continue
+            else:
+                block = numpy.asarray(value,dtype=float)
+                block = block.reshape(1,len(block))
+            self.collect_block(block)
+
+        self.collect_lines()
+        self.compress()
+        if self.G is not None:
+            for i,row in enumerate(self.G):
+                yield i, util.array2list(row)
+
+def sum_rows(key,values):
+    """ Sum the partial rows of A'*A. """
+    total = None
+    for value in values:
+        if total is None:
+            total = numpy.array(value,dtype=float)
+        else:
+            total += value
+    yield key, util.array2list(total)
+
+class BackwardError(dumbo.backends.common.MapRedBase):
+    """ Sum A'*A and compare it with R'*R in the reducer. """
+    def __init__(self,Rfilename,test_problem=False,tol=None):
+        self.Rfilename = Rfilename
+        self.test_problem = test_problem
+        self.tol = tol
+
+    def __call__(self,data):
+        rows = {}
+        for key,values in data:
+            for _,row in sum_rows(key,values):
+                rows[key] = row
+        if len(rows) == 0:
+            return
+
+        R = numpy.load(self.Rfilename)
+        n = R.shape[1]
+        if len(rows) != n:
+            raise ValueError("A has %i columns but R has %i columns"%(
+                len(rows),n))
+        G = numpy.empty((n,n))
+        for i,row in rows.iteritems():
+            G[i] = row
+
+        E = G - numpy.dot(R.T,R)
+        normA2 = numpy.linalg.norm(G,2)
+        normAfro2 = numpy.trace(G)
+        yield 'norm(A)^2', float(normA2)
+        yield 'backward error', float(numpy.linalg.norm(E,2)/normA2)
+        yield 'backward error (fro)', float(numpy.linalg.norm(E)/normAfro2)
+
+        if self.test_problem:
+            errors,diff,maxerr,relerr = check_test_problem.check_R(R,self.tol)
+            check_test_problem.report_errors(errors,diff)
+            yield 'max error', float(maxerr)
+            yield 'relative error', float(relerr)
+            yield 'incorrect entries', len(errors)
+
+def runner(job):
+    blocksize = gopts.getintkey('blocksize')
+    Rfile = gopts.getstrkey('R_filename')
+    test_problem = gopts.getintkey('test_problem')
+    tol = gopts.getstrkey('tol')
+    tol = float(tol) if tol else None
+
+    job.additer(mapper=Gram(blocksize=blocksize),
+        reducer=BackwardError(Rfile,test_problem=test_problem,tol=tol),
+        combiner=sum_rows,
+        premapper=setup_backward_error,
+        opts=[('numreducetasks','1')])
+
+def starter(prog):
+    mypath = os.path.dirname(__file__)
+
+    # set the global opts
+    gopts.prog = prog
+
+    mat = prog.delopt('mat')
+    if not mat:
+        return "'mat' not specified'"
+    qrr = gopts.getstrkey('qrr','')
+    if not qrr:
+        return "'qrr' not specified'"
+
+    prog.addopt('memlimit','4g')
+    prog.addopt('libegg','numpy')
+    prog.addopt('file',os.path.join(mypath,'util.py'))
+    prog.addopt('file',os.path.join(mypath,'rowblock.py'))
+    prog.addopt('file',os.path.join(mypath,'textrows.py'))
+    prog.addopt('file',os.path.join(mypath,'tbio.py'))
+    prog.addopt('file',os.path.join(mypath,'seqfile.py'))
+    prog.addopt('file',os.path.join(mypath,'local_util.py'))
+    prog.addopt('file',os.path.join(mypath,'check_test_problem.py'))
+
+    prog.addopt('input',mat)
+
+    gopts.getintkey('blocksize',3)
+    test_problem = prog.delopt('test_problem')
+    gopts.setkey('test_problem',int(test_problem == 'yes'))
+    # the default tolerance grows with n, see check_test_problem.py
+    gopts.getstrkey('tol','')
+
+    output = prog.getopt('output')
+    if not output:
+        prog.addopt('output','%s-error'%(qrr.rstrip('/')))
+
+    prog.addopt('overwrite','yes')
+
+    qrrname = os.path.splitext(os.path.split(qrr.rstrip('/'))[1])[0]
+    gopts.setkey('R_filename',qrrname+'-R.npy')
+
+    gopts.save_params()
+
+if __name__ == '__main__':
+    dumbo.main(runner, starter)
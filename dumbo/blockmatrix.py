@@ -0,0 +1,216 @@
+#!/usr/bin/env dumbo
+
+"""
+blockmatrix.py
+==============
+
+Convert a matrix between one row per record and packed blocks of rows.
+
+In the blocked format, each record holds k consecutive rows of the
+matrix as a packed array with a small header for the type and the
+number of columns, see rowblock.py.  The key of each block is the row
+offset of its first row when the rows have consecutive integer keys.
+The rows of a text file only have the byte offsets of their lines, and
+rows with keys that aren't consecutive have no row offset, so those
+blocks are keyed by the tuple (key of the first row,), see
+rowblock.tuple_key, or by the key of the first row if it isn't an
+integer.  The blocked
+format has much less framing, key, and
+sort overhead than one row per record, and tsqr.py, svd.py,
+CholeskyQR.py and hadoopy/normal.py read it directly.
+
+This is a map-only job, so each block has rows from a single split.
+
+Usage
+-----
+
+    dumbo start blockmatrix.py -mat <path> [-output <path> \\
+        -format blocks|rows -rows_per_block <int> -use_system_numpy]
+
+      -format blocks|rows : convert rows to blocks (the default), or
+        blocks back to rows.  In the rows from a block with an integer
+        key k, the rows have keys k, k+1, ...  In the rows from a block
+        with a tuple key, e.g. (byte offset,), they have keys
+        (byte offset, i), see rowblock.row_keys.
+
+      -output <path> : the default is <mat>-blocks or <mat>-rows with
+        the extension of mat.
+
+      -rows_per_block <int> : the number of rows in each block.
+        The default is 1000.
+
+History
+-------
+:2011-03-16: Initial coding
+"""
+
+import sys
+import os
+
+import numpy
+
+import util
+import rowblock
+import textrows
+
+import dumbo
+import dumbo.backends.common
+
+# create the global options structure
+gopts = util.GlobalOptions()
+
+class ToBlocks(dumbo.backends.common.MapRedBase):
+    """ Pack consecutive rows into blocks of rows_per_block rows. """
+    def __init__(self,rows_per_block=1000):
+        self.rows_per_block = rows_per_block
+        self.block = None
+        self.first_key = None
+        self.next_key = None
+        self.nbuffered = 0
+        self.lines = textrows.LineBatch()
+
+    def output(self):
+        if self.nbuffered == 0:
+            return
+        key = self.first_key
+        if self.next_key is None and isinstance(key,(int,long)):
+            key = rowblock.tuple_key(key)
+        yield key, rowblock.pack(self.block[:self.nbuffered])
+        self.counters['blocks output'] += 1
+        self.nbuffered = 0
+
+    def collect_block(self,key,block,linekeys=None):
+        """ Add rows to the blocks.
+
+        @param key the key of the first row, the rows of a block with an
+        integer key have the keys key, key+1, ...
+        @param linekeys for rows from text, the byte offset of the line
+        of each row instead of key
+        """
+        if self.block is None:
+            self.block = numpy.empty((self.rows_per_block,block.shape[1]))
+        elif block.shape[1] != self.block.shape[1]:
+            raise ValueError("a row with %i cols but row 1 had %i cols"%(
+                block.shape[1], self.block.shape[1]))
+        self.counters['rows processed'] += block.shape[0]
+        start = 0
+        while start < block.shape[0]:
+            if linekeys is not None:
+                key = linekeys[start]
+            # a block has a row offset only if its keys are consecutive
+            # row offsets, the byte offsets of lines never are
+            rowkey = isinstance(key,(int,long)) and linekeys is None
+            if self.nbuffered == 0:
+                self.first_key = key
+                self.next_key = key if rowkey else None
+            elif not rowkey or self.next_key != key:
+                self.next_key = None
+            k = min(block.shape[0]-start,self.rows_per_block-self.nbuffered)
+            self.block[self.nbuffered:self.nbuffered+k] = block[start:start+k]
+            self.nbuffered += k
+            start += k
+            if rowkey:
+                key += k
+            if self.next_key is not None:
+                self.next_key += k
+            if self.nbuffered == self.rows_per_block:
+                for out in self.output():
+                    yield out
+
+    def collect_lines(self):
+        """ Parse the batch of lines of text and collect the rows. """
+        ncols = None
+        if self.block is not None:
+            ncols = self.block.shape[1]
+        keys,A,nbad = self.lines.parse(ncols)
+        if nbad > 0:
+            self.counters['malformed lines'] += nbad
+        if len(keys) > 0:
+            for out in self.collect_block(keys[0],A,keys):
+                yield out
+
+    def __call__(self,data):
+        for key,value in data:
+            if isinstance(value, str) and not rowblock.isblock(value):
+                # parse lines of text in batches
+                if self.lines.append(key,value):
+                    for out in self.collect_lines():
+                        yield out
+                continue
+            # keep the rows in order
+            for out in self.collect_lines():
+                yield out
+            if rowblock.isblock(value):
+                block = rowblock.unpack(value)
+            else:
+                block = numpy.array([value],dtype=float)
+            for out in self.collect_block(key,block):
+                yield out
+        for out in self.collect_lines():
+            yield out
+        for out in self.output():
+            yield out
+
+class ToRows(dumbo.backends.common.MapRedBase):
+    """ Unpack blocks of rows into one row per record. """
+    def __call__(self,data):
+        for key,value in data:
+            if not rowblock.isblock(value):
+                yield key, value
+                continue
+            block = rowblock.unpack(value)
+            self.counters['blocks processed'] += 1
+            for rowkey,row in zip(rowblock.row_keys(key,len(block)),block):
+                yield rowkey, util.array2list(row)
+
+def runner(job):
+    format = gopts.getstrkey('format')
+    rows_per_block = gopts.getintkey('rows_per_block')
+
+    if format == 'blocks':
+        mapper = ToBlocks(rows_per_block)
+    else:
+        mapper = ToRows()
+    job.additer(mapper,"org.apache.hadoop.mapred.lib.IdentityReducer",
+        opts=[('numreducetasks','0')])
+
+def starter(prog):
+    mypath = os.path.dirname(__file__)
+
+    # set the global opts
+    gopts.prog = prog
+
+    mat = prog.delopt('mat')
+    if not mat:
+        return "'mat' not specified'"
+
+    nonumpy = prog.delopt('use_system_numpy')
+    if nonumpy is None:
+        prog.addopt('libegg','numpy')
+
+    prog.addopt('file',os.path.join(mypath,'util.py'))
+    prog.addopt('file',os.path.join(mypath,'rowblock.py'))
+    prog.addopt('file',os.path.join(mypath,'textrows.py'))
+    prog.addopt('file',os.path.join(mypath,'tbio.py'))
+    prog.addopt('file',os.path.join(mypath,'seqfile.py'))
+    prog.addopt('file',os.path.join(mypath,'local_util.py'))
+
+    prog.addopt('input',mat)
+    matname,matext = os.path.splitext(mat)
+
+    format = gopts.getstrkey('format','blocks')
+    if format not in ('rows','blocks'):
+        return "'format' must be rows or blocks"
+    gopts.getintkey('rows_per_block',1000)
+
+    output = prog.getopt('output')
+    if not output:
+        prog.addopt('output','%s-%s%s'%(matname,format,matext))
+
+    prog.addopt('overwrite','yes')
+    prog.addopt('jobconf','mapred.output.compress=true')
+
+    gopts.save_params()
+
+if __name__ == '__main__':
+    dumbo.main(runner, starter)
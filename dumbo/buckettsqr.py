@@ -0,0 +1,223 @@
+#!/usr/bin/env dumbo
+
+"""
+buckettsqr.py
+=============
+
+Compute one R factor for each bucket of rows of a matrix, so the R
+factor of any range of rows is a merge of a few small R factors, see
+rindex.py.
+
+The rows of the matrix are ordered by their keys, e.g. the row index,
+the byte offset of the row in a text file, or a time stamp.  The bucket
+of a row with key k is floor(k/bucketsize).  A packed block of rows
+must be keyed by the row offset of its first row, see rowblock.py, and
+the row i of the block has the key offset+i.  A block with a tuple key,
+e.g. from matrix2seqfile.py -format blocks or blockmatrix.py on text,
+has no row offset and is an error, so convert the text rows with
+-format rows instead.  Each
+mapper compresses the rows of each bucket with tsqr.SerialTSQR, and the
+reducer for a bucket merges the R factors of the mappers.  So the
+output has one record for each bucket with the key
+  bucket
+and the value
+  (bucketsize, number of rows, R as a packed block of rows)
+
+Usage
+-----
+
+    dumbo start buckettsqr.py -mat <path> -bucketsize <int> \\
+        [-output <path> -blocksize <int> -maxbuckets <int>]
+
+      -bucketsize <int> : the range of keys in each bucket.
+
+      -output <path> : the default is <mat>-buckets with the extension
+        of mat.
+
+      -maxbuckets <int> : the largest number of buckets that a mapper
+        keeps at once.  After that, the mapper outputs the R factor of
+        the bucket it saw first.  The default is 100.
+
+    python rindex.py -build <output> -index <dir>
+
+History
+-------
+:2011-03-22: Initial coding
+"""
+
+import sys
+import os
+import time
+
+import numpy
+
+import util
+import rowblock
+import textrows
+import tsqr
+import tasktrace
+
+import dumbo
+import dumbo.backends.common
+
+# create the global options structure
+gopts = util.GlobalOptions()
+
+class BucketTSQR(dumbo.backends.common.MapRedBase):
+    """ Compress the rows of each bucket into an R factor.
+
+    @param bucketsize the range of keys in each bucket
+    @param blocksize the blocksize for each tsqr.SerialTSQR
+    @param maxbuckets the number of buckets to keep at once
+    @param isreducer if True, the values are the outputs of the mappers
+    """
+    def __init__(self,bucketsize,blocksize=3,maxbuckets=100,isreducer=False):
+        self.bucketsize = bucketsize
+        self.blocksize = blocksize
+        self.maxbuckets = maxbuckets
+        self.isreducer = isreducer
+        self.buckets = {}
+        self.counts = {}
+        self.order = []
+        self.lines = textrows.LineBatch()
+        self.ncols = None
+
+    def add(self,bucket,block,count):
+        """ Add a block of rows, or of R factors of count rows, to a
+        bucket. """
+        if bucket not in self.buckets:
+            self.buckets[bucket] = tsqr.SerialTSQR(blocksize=self.blocksize)
+            self.counts[bucket] = 0
+            self.order.append(bucket)
+        self.buckets[bucket].collect_block(bucket,block)
+        self.counts[bucket] += count
+
+    def output(self,bucket):
+        """ Output the R factor of a bucket and forget the bucket. """
+        R = self.buckets.pop(bucket).result()
+        self.order.remove(bucket)
+        self.counters['buckets output'] += 1
+        return bucket, (self.bucketsize, self.counts.pop(bucket),
+            rowblock.pack(R))
+
+    def evict(self):
+        """ Output the oldest buckets until there are maxbuckets. """
+        while len(self.buckets) > self.maxbuckets:
+            t0 = time.time()
+            yield self.output(self.order[0])
+            tasktrace.span('spill',t0)
+
+    def collect_rows(self,keys,A):
+        """ Add the rows of A with the keys in an array to their buckets. """
+        if self.ncols is None:
+            self.ncols = A.shape[1]
+        buckets = numpy.floor_divide(keys,self.bucketsize).astype(int)
+        # the keys are usually in order, so split the rows where the
+        # bucket changes
+        bounds = [0] + list(numpy.flatnonzero(numpy.diff(buckets))+1) + \
+            [len(buckets)]
+        for start,end in zip(bounds[:-1],bounds[1:]):
+            self.add(int(buckets[start]),A[start:end],end-start)
+        for out in self.evict():
+            yield out
+
+    def collect_lines(self):
+        """ Parse the batch of lines of text and add their rows. """
+        keys,A,nbad = self.lines.parse(self.ncols)
+        if nbad > 0:
+            self.counters['malformed lines'] += nbad
+        if len(keys) > 0:
+            for out in self.collect_rows(numpy.array(keys),A):
+                yield out
+
+    def __call__(self,data):
+        if self.isreducer == False:
+            for key,value in data:
+                if isinstance(value,str) and not rowblock.isblock(value):
+                    if self.lines.append(key,value):
+                        for out in self.collect_lines():
+                            yield out
+                    continue
+                if rowblock.isblock(value):
+                    # the rows of a block have consecutive row offsets
+                    A = rowblock.unpack(value)
+                    keys = rowblock.row_offset(key) + \
+                        numpy.arange(A.shape[0])
+                else:
+                    if not isinstance(key,(int,long,float)):
+                        raise ValueError(
+                            "the key %s is not a number"%(str(key)))
+                    A = numpy.array([value],dtype=float)
+                    keys = numpy.array([key])
+                for out in self.collect_rows(keys,A):
+                    yield out
+            for out in self.collect_lines():
+                yield out
+        else:
+            for bucket,values in data:
+                for bucketsize,count,R in values:
+                    if bucketsize != self.bucketsize:
+                        raise ValueError("bucket %i has a bucketsize of %i"%(
+                            bucket, bucketsize))
+                    self.add(bucket,rowblock.unpack(R),count)
+                for out in self.evict():
+                    yield out
+        for bucket in list(self.order):
+            yield self.output(bucket)
+
+def runner(job):
+    bucketsize = gopts.getintkey('bucketsize')
+    blocksize = gopts.getintkey('blocksize')
+    maxbuckets = gopts.getintkey('maxbuckets')
+    job.additer(mapper=BucketTSQR(bucketsize,blocksize,maxbuckets),
+        reducer=BucketTSQR(bucketsize,blocksize,maxbuckets,isreducer=True))
+
+def starter(prog):
+    mypath = os.path.dirname(__file__)
+
+    # set the global opts
+    gopts.prog = prog
+
+    mat = prog.delopt('mat')
+    if not mat:
+        return "'mat' not specified'"
+
+    prog.addopt('memlimit','4g')
+
+    nonumpy = prog.delopt('use_system_numpy')
+    if nonumpy is None:
+        prog.addopt('libegg','numpy')
+
+    prog.addopt('file',os.path.join(mypath,'util.py'))
+    prog.addopt('file',os.path.join(mypath,'tsqr.py'))
+    prog.addopt('file',os.path.join(mypath,'rowblock.py'))
+    prog.addopt('file',os.path.join(mypath,'tsqrlib.py'))
+    prog.addopt('file',os.path.join(mypath,'memstats.py'))
+    prog.addopt('file',os.path.join(mypath,'tasktrace.py'))
+    prog.addopt('file',os.path.join(mypath,'rrqr.py'))
+    prog.addopt('file',os.path.join(mypath,'textrows.py'))
+    prog.addopt('file',os.path.join(mypath,'tbio.py'))
+    prog.addopt('file',os.path.join(mypath,'seqfile.py'))
+    prog.addopt('file',os.path.join(mypath,'local_util.py'))
+    prog.addopt('file',os.path.join(mypath,'checkpoint.py'))
+    prog.addopt('file',os.path.join(mypath,'rcache.py'))
+
+    prog.addopt('input',mat)
+    matname,matext = os.path.splitext(mat)
+
+    if gopts.getintkey('bucketsize',0) <= 0:
+        return "'bucketsize' must be a positive integer"
+    gopts.getintkey('blocksize',3)
+    gopts.getintkey('maxbuckets',100)
+
+    output = prog.getopt('output')
+    if not output:
+        prog.addopt('output','%s-buckets%s'%(matname,matext))
+
+    prog.addopt('overwrite','yes')
+    prog.addopt('jobconf','mapred.output.compress=true')
+
+    gopts.save_params()
+
+if __name__ == '__main__':
+    dumbo.main(runner, starter)
@@ -1,60 +1,158 @@
 #!/usr/bin/env dumbo
 
 """
+check_test_problem.py
+=====================
 
+Check the R factor of a test problem from generate_test_problems.py.
+
+The R factor of these problems is the upper triangle of the all ones
+matrix, up to the sign of each row.  This program reads the rows of R,
+or packed blocks of rows, into one array and checks all the entries at
+once.  It reports the entries that differ from the exact R by more
+than tol, the maximum error, and the relative error in the Frobenius norm.
+
+Usage
+-----
+
+    dumbo convert check_test_problem.py <R path>
+    python check_test_problem.py <R path> [-tol <float>]
+
+      -tol <float> : the largest acceptable error in each entry.
+        The default is n*eps*||R||_F, where ||R||_F = sqrt(n*(n+1)/2)
+        is the norm of the exact R, see default_tol.  The error of
+        a backward stable QR grows with the size and the norm of the
+        problem, so a fixed tolerance like 10*eps fails correct runs.
+
+If <R path> is a local copy of the output, from hadoop fs -get, then
+it is read with seqfile.py and Hadoop is not needed.
+
+See backward_error.py to also compute ||A'*A - R'*R||/||A||^2 against
+the original matrix.
 """
 
 import sys
 import math
 import numpy
-    
+
+import rowblock
+
+def read_R(data):
+    """ Read the rows of an R factor into an array.
+
+    @param data an iterator over key, value pairs where each value is
+    a row or a packed block of rows.  The column mean record from a
+    centered TSQR is skipped.
+    @return the array with all the rows in the order they were read.
+    """
+    R = None
+    nrows = 0
+    for key,value in data:
+        if key == 'column mean':
+            continue
+        if rowblock.isblock(value):
+            block = rowblock.unpack(value)
+        else:
+            block = numpy.asarray(value,dtype=float)
+            block = block.reshape(1,len(block))
+
+        if R is None:
+            # an R factor is usually square, so preallocate that
+            ncols = block.shape[1]
+            R = numpy.empty((max(ncols,block.shape[0]),ncols))
+        if block.shape[1] != R.shape[1]:
+            raise ValueError("row %i has %i cols but row 1 had %i cols"%(
+                nrows+1, block.shape[1], R.shape[1]))
+        while nrows + block.shape[0] > R.shape[0]:
+            R = numpy.vstack((R,numpy.empty(R.shape)))
+
+        R[nrows:nrows+block.shape[0]] = block
+        nrows += block.shape[0]
+
+    if R is None:
+        return numpy.zeros((0,0))
+    return R[:nrows]
+
+def default_tol(n):
+    """ The default tolerance for each entry of an n-by-n R factor,
+    n*eps times the Frobenius norm of the exact R. """
+    return n*numpy.finfo('float').eps*math.sqrt(n*(n+1)/2.)
+
+def check_R(R,tol=None):
+    """ Compare an R factor with the upper triangle of the all ones matrix.
+
+    Each row of R is first scaled by the sign of its diagonal element.
+    The default tol is default_tol(n).
+
+    @return a tuple (errors, diff, maxerr, relerr) where errors is an
+    array with the (i,j) index of each entry with error larger than tol,
+    diff is the error in each of those entries, maxerr is the largest
+    error, and relerr is the error relative to the exact R in the
+    Frobenius norm.
+    """
+    if tol is None:
+        tol = default_tol(R.shape[1])
+    signs = numpy.sign(numpy.diag(R))
+    signs[signs == 0] = 1.
+    S = R*signs[:,numpy.newaxis]
+    S -= numpy.triu(numpy.ones(R.shape))
+    S = abs(S)
+    bad = S > tol
+    errors = numpy.transpose(numpy.nonzero(bad))
+    diff = S[bad]
+    maxerr = S.max()
+    n = R.shape[0]
+    relerr = numpy.sqrt((S**2).sum())/math.sqrt(n*(n+1)/2.)
+    return errors, diff, maxerr, relerr
+
+def report_errors(errors,diff,nprint=10):
+    """ Print the first few incorrect entries from check_R """
+    for k,(i,j) in enumerate(errors[:nprint]):
+        print >> sys.stderr, \
+            "[%2i] INCORRECT entry (%i,%i) diff=%18.16e"%(
+            k+1, i+1, j+1, diff[k])
+    if len(errors) > nprint:
+        print >> sys.stderr, \
+            "  ... skipping further errors ... "
+
 class Converter:
     def __init__(self,opts):
-        self.rows = []
+        self.tol = None
+        for key,value in opts:
+            if key == 'tol':
+                self.tol = float(value)
+
     def __call__(self,data):
-        item = 0
-        for key,value in data:
-            self.rows.append(value)
-        if len(self.rows) == 0:
+        try:
+            R = read_R(data)
+        except ValueError, e:
+            print >>sys.stderr, "ERROR: %s"%(str(e))
+            sys.exit(-1)
+
+        if R.size == 0:
             print >>sys.stderr, "ERROR: the file is empty."
             sys.exit(-1)
-            
-        ncols = len(self.rows[0])
-        eps = numpy.finfo('float').eps
-        nerrs = 0
-        
-        for i,row in enumerate(self.rows):
-            if len(row) != ncols:
-                print >>sys.stderr, \
-                    "ERROR: row %i has %i cols but row 1 had %i cols"%(
-                    i+1, len(row), ncols)
-                sys.exit(-1)
-            
-            r = numpy.array(row)
-            r = r*numpy.sign(r[i]) # scale by the sign of the diagonal
-            
-            for j in xrange(i,ncols):
-                if abs(r[i]-1.) > 10*eps:
-                    nerrs += 1
-                    if nerrs <= 10:
-                        print >> sys.stderr, \
-                            "[%2i] INCORRECT entry (%i,%i) diff=%18.16e"%(
-                            nerrs, i+1, j+1, abs(r[i]-1.))
-                        if nerrs == 10:
-                            print >> sys.stderr, \
-                                "  ... skipping further errors ... "
-        if nerrs > 0:
-            print "INCORRECT: total incorrect entries %i\n"%(nerrs)
+        if R.shape[0] != R.shape[1]:
+            print >>sys.stderr, "ERROR: R is %i-by-%i, not square"%(
+                R.shape[0], R.shape[1])
+            sys.exit(-1)
+
+        errors,diff,maxerr,relerr = check_R(R,self.tol)
+        report_errors(errors,diff)
+
+        print "max error = %18.16e"%(maxerr)
+        print "relative error = %18.16e"%(relerr)
+        if len(errors) > 0:
+            print "INCORRECT: total incorrect entries %i\n"%(len(errors))
             sys.exit(1)
         else:
             print "CORRECT"
             sys.exit(0)
-        
-    
+
+
 if __name__ == '__main__':
-    import dumbo.cmd
-    import dumbo.util
-    dumbo.cmd.convert(__file__, sys.argv[1], dumbo.util.parseargs(sys.argv[2:]))
+    import seqfile
+    seqfile.convert(__file__, Converter, sys.argv[1], sys.argv[2:])
+
 
 
-    
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+"""
+checkpoint.py
+=============
+
+Manifests for the stages of a multi-stage job, so a driver can skip
+the stages that are already done.
+
+After a stage finishes, the driver writes a manifest into the stage
+output as the file _manifest.  Hadoop skips files that start with _ in
+the input of the next stage.  The manifest has the parameters of the
+stage, the fingerprint of its input and its output, and the number of
+output records.  A fingerprint is the list of (path, size, mtime) for
+each file in a path.
+
+When the driver runs again, a stage is current if its manifest
+exists, the parameters are the same, and its input and its output
+have the same fingerprints.  The driver skips the current stages and
+resumes from the first stale stage.  The output of a stage is the
+input of the next one, so rerunning a stage makes every later stage
+stale too.
+
+The hadoopy drivers run one job for each stage, so they check and save
+the manifests between the jobs.  dumbo runs all the stages of a job
+from one starter, so the dumbo drivers check the manifests in the
+starter and write the manifest of a stage in the premapper of the
+next one, see util.GlobalOptions.first_stage.  The last stage of a
+dumbo job has no manifest and always runs.
+
+The file systems here are a local one and HDFS through the hadoop
+command, without dumbo or hadoopy.
+
+History
+-------
+:2011-03-19: Initial coding
+"""
+
+import os
+import re
+import glob
+import time
+import json
+import shutil
+import tempfile
+import subprocess
+
+manifest_name = '_manifest'
+manifest_version = 1
+
+def _hidden(root,path):
+    """ Test if a file under root is hidden from Hadoop input formats. """
+    if path.startswith(root):
+        rel = path[len(root):]
+    else:
+        rel = os.path.basename(path)
+    parts = [p for p in rel.split('/') if p]
+    if '_logs' in path.split('/'):
+        return True
+    for p in parts:
+        if p.startswith('_') or p.startswith('.'):
+            return True
+    return False
+
+class LocalFS:
+    """ The local file system. """
+    def ls(self,path,hidden=False):
+        """ List the files under a path.
+
+        @param hidden also list the files that Hadoop input formats skip
+        @return a list of (path, size, mtime) for each file
+        """
+        files = []
+        for root in sorted(glob.glob(os.path.abspath(path))):
+            if os.path.isfile(root):
+                candidates = [root]
+            else:
+                candidates = []
+                for dirpath,dirnames,filenames in os.walk(root):
+                    for name in filenames:
+                        candidates.append(os.path.join(dirpath,name))
+            for name in candidates:
+                if not hidden and _hidden(root,name):
+                    continue
+                st = os.stat(name)
+                files.append((name, st.st_size, int(st.st_mtime)))
+        return files
+
+    def exists(self,path):
+        return os.path.exists(path)
+
+    def cat(self,path):
+        """ Return the contents of the files that match a path. """
+        return ''.join(open(f,'rb').read() for f in sorted(glob.glob(path))
+            if os.path.isfile(f))
+
+    def write(self,path,data):
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        f = open(path,'wb')
+        f.write(data)
+        f.close()
+
+    def rm(self,path):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+class HadoopFS:
+    """ HDFS through the hadoop command.
+
+    @param hadoop the hadoop command, the default is
+    $HADOOP_HOME/bin/hadoop, or hadoop if HADOOP_HOME is not set.
+    """
+    def __init__(self,hadoop=None):
+        if hadoop is None:
+            home = os.getenv('HADOOP_HOME')
+            if home:
+                hadoop = os.path.join(home,'bin','hadoop')
+            else:
+                hadoop = 'hadoop'
+        self.hadoop = hadoop
+
+    def _run(self,*args):
+        p = subprocess.Popen([self.hadoop,'fs']+list(args),
+            stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        out,err = p.communicate()
+        return p.returncode, out
+
+    def ls(self,path,hidden=False):
+        """ List the files under a path with hadoop fs -lsr.
+
+        @param hidden also list the files that Hadoop input formats skip
+        @return a list of (path, size, mtime) for each file
+        """
+        rval,out = self._run('-lsr',path)
+        if rval != 0:
+            return []
+        files = []
+        root = path.rstrip('/')
+        for line in out.splitlines():
+            parts = line.split(None,7)
+            if len(parts) < 8 or parts[0].startswith('d'):
+                continue
+            name = parts[7]
+            if not hidden and _hidden(root,name):
+                continue
+            files.append((name, int(parts[4]), parts[5]+' '+parts[6]))
+        return files
+
+    def exists(self,path):
+        return self._run('-test','-e',path)[0] == 0
+
+    def cat(self,path):
+        """ Return the contents of the files that match a path. """
+        rval,out = self._run('-cat',path)
+        if rval != 0:
+            return ''
+        return out
+
+    def write(self,path,data,overwrite=True):
+        """ Write data to a file on HDFS.
+
+        @param overwrite if false, the path must be new, and the write
+        is a single hadoop fs -put
+        """
+        fd,filename = tempfile.mkstemp()
+        try:
+            os.write(fd,data)
+            os.close(fd)
+            if overwrite and self.exists(path):
+                self._run('-rm',path)
+            rval,out = self._run('-put',filename,path)
+            if rval != 0:
+                raise IOError("cannot write %s to hdfs"%(path))
+        finally:
+            os.remove(filename)
+
+    def rm(self,path):
+        if self.exists(path):
+            self._run('-rmr',path)
+
+def write_task_file(name,data,dirname=''):
+    """ Write a file from a task next to the output of the task.
+
+    Without dirname, the file goes to the work output directory of the
+    task, so Hadoop moves it into the output of the job when the task
+    succeeds.  A name that starts with _ is hidden from the next stage.
+    The work output directory is new for each attempt of a task, so the
+    file is written with one hadoop command.  Without either, e.g. in
+    the local mode of dumbo, the file goes to the current directory.
+
+    @param dirname a local directory for the file instead
+    @return the path of the file
+    """
+    workdir = os.getenv('mapred_work_output_dir')
+    if dirname:
+        path = os.path.join(dirname,name)
+        LocalFS().write(path,data)
+    elif workdir:
+        path = workdir.rstrip('/') + '/' + name
+        HadoopFS().write(path,data,overwrite=False)
+    else:
+        path = name
+        LocalFS().write(path,data)
+    return path
+
+def fingerprint(fs,paths):
+    """ Compute the fingerprint of a list of paths.
+
+    @return a sorted list of [path, size, mtime] for each file
+    """
+    files = []
+    for path in paths:
+        files.extend([list(f) for f in fs.ls(path)])
+    files.sort()
+    return files
+
+_output_records = re.compile(
+    r'\[\(REDUCE_OUTPUT_RECORDS\)\(Reduce output records\)\((\d+)\)\]')
+
+def output_records(fs,output):
+    """ Find the number of output records of the job that wrote output.
+
+    The count comes from the job history that Hadoop writes into
+    output/_logs/history.
+
+    @return the number of records, or None if there is no job history
+    """
+    count = None
+    for line in fs.cat(output.rstrip('/')+'/_logs/history/*').splitlines():
+        if line.startswith('Job ') and 'COUNTERS=' in line:
+            m = _output_records.search(line)
+            if m:
+                count = int(m.group(1))
+    return count
+
+def manifest_path(output):
+    return output.rstrip('/')+'/'+manifest_name
+
+def read_manifest(fs,output):
+    """ Read the manifest of a stage output, or return None. """
+    data = fs.cat(manifest_path(output))
+    if not data:
+        return None
+    try:
+        manifest = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(manifest,dict) or \
+            manifest.get('version') != manifest_version:
+        return None
+    return manifest
+
+def _same(a,b):
+    """ Compare two values from json, where lists and tuples are equal. """
+    return json.loads(json.dumps(a)) == json.loads(json.dumps(b))
+
+class Checkpoints:
+    """ Check and save the manifests of the stages of a job.
+
+    @param fs the file system, e.g. LocalFS() or HadoopFS()
+    @param params a dictionary with the parameters of the whole job
+    @param enabled if False, no stage is current, but the manifests
+    are still written.
+    """
+    def __init__(self,fs,params,enabled=True):
+        self.fs = fs
+        self.params = params
+        self.enabled = enabled
+
+    def _params(self,stage,params):
+        allparams = dict(self.params)
+        allparams.update(params)
+        allparams['stage'] = stage
+        return allparams
+
+    def current(self,stage,inputs,output,params={}):
+        """ Test if a stage with the manifest in output is done.
+
+        @param stage the index of the stage
+        @param inputs the list of input paths for the stage
+        @param output the output path of the stage
+        @param params a dictionary with the parameters of the stage
+        """
+        if not self.enabled:
+            return False
+        manifest = read_manifest(self.fs,output)
+        if manifest is None:
+            return False
+        if not _same(manifest.get('params'),self._params(stage,params)):
+            return False
+        if not _same(manifest.get('input'),fingerprint(self.fs,inputs)):
+            return False
+        return _same(manifest.get('output'),fingerprint(self.fs,[output]))
+
+    def save(self,stage,inputs,output,params={}):
+        """ Write the manifest after a stage finished.
+
+        @return the manifest, or None if the output has no files, e.g.
+        if the stage failed.
+        """
+        files = fingerprint(self.fs,[output])
+        if len(files) == 0:
+            return None
+        manifest = {
+            'version': manifest_version,
+            'params': self._params(stage,params),
+            'input': fingerprint(self.fs,inputs),
+            'output': files,
+            'records': output_records(self.fs,output),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        self.fs.write(manifest_path(output),json.dumps(manifest,indent=1))
+        return manifest
@@ -1,23 +1,35 @@
 #!/usr/bin/env dumbo
-""" Generate TSQR test problems. 
+""" Generate TSQR test problems.
 
 These problem use a constant R factor.  R is just the upper triangle
 of the all ones matrix.
 
-The output of this script is a Hadoop distributed sequence file, 
-where each key is a random number, and each value is a row of
-the matrix.
+The output of this script is a Hadoop distributed sequence file,
+where each key is the index of a row, and each value is a row of
+the matrix.  With -format blocks, each key is the index of the first
+row in a block and each value is a packed block of rows (see rowblock.py).
 
+The matrix is generated in a single map-only pass.  Each map task
+generates maprows rows from its own seed, in blocks of maxlocal rows,
+see testmat.py for the details.  The same rows can be written to local
+files with testmat.py.
+
+Usage
+-----
+
+    dumbo start generate_test_problems.py -output <hdfspath> \\
+        -nrows <int> -ncols <int> [-maprows <int> -maxlocal <int> \\
+        -seed <int> -format rows|blocks -rows_per_block <int>]
 
 History
 -------
 :2011-01-26: Initial coding
 :2011-01-27: Added maprows to let mappers handle more than ncols of data.
+:2011-03-14: Single pass generation with per-task seeds.
 """
 
 __author__ = 'David F. Gleich'
 
-
 import sys
 import os
 import re
@@ -30,160 +42,102 @@ import dumbo.lib
 import numpy
 
 import util
+import testmat
 
 # create the global options structure
 gopts = util.GlobalOptions()
 
-
-def first_mapper(data):
-    """ This mapper doesn't take any input, and generates the R factor. """
+def mapper(data):
+    """ This mapper doesn't take any input, and generates a set of rows. """
     hostname = os.uname()[1]
     print >>sys.stderr, hostname, "is a mapper"
-    
-    # suck up all the data so Hadoop doesn't complain
+
+    # the NullInputFormat gives each mapper one record with the
+    # key dummy-split-<task>
+    tasks = []
     for key,val in data:
-        pass
-    
+        tasks.append(int(key.split('-')[-1]))
+
     n = gopts.getintkey('ncols')
-    m = int(os.getenv('nrows'))
-    k = int(os.getenv('maprows'))/n
-    s = float(m)/float(n)
-    util.setstatus(
-        "generating %i-by-%i R matrix with scale factor %i/%i=%s"%(
-        n, n, m, n, s))
-    
-    R = numpy.triu(numpy.ones((n,n)))/math.sqrt(s)
-    
-    for i in xrange(k):
+    m = gopts.getintkey('nrows')
+    maprows = gopts.getintkey('maprows')
+    local = gopts.getintkey('maxlocal')
+    seed = gopts.getintkey('seed')
+    format = gopts.getstrkey('format')
+    rows_per_block = gopts.getintkey('rows_per_block')
+
+    for task in tasks:
         util.setstatus(
-            'step %i/%i: generating local %i-by-%i Q matrix'%(i+1,k,n,n))
-        
-        Q = numpy.linalg.qr(numpy.random.randn(n,n))[0] # just the Q factor
-        util.setstatus('step %i/%i: multiplying local matrix'%(i+1,k))
-        A = Q.dot(R)
-        util.setstatus('step %i/%i: outputting %i rows'%(i+1,k,A.shape[0]))
-        for row in A:
-            key = random.randint(0, 4000000000)
-            yield key, util.array2list(row)
-            
-def localQoutput(rows):
-    
-    util.setstatus('converting to numpy array')
-    A = numpy.array(rows)
-    localm = A.shape[0]
-    
-    util.setstatus('generating local Q of size %i-by-%i'%(localm,localm))
-    Q = numpy.linalg.qr(numpy.random.randn(localm,localm))[0] # just the Q factor
-    util.setstatus(
-        'multiplying %i-by-%i A by %i-by-%i Q'%(localm,A.shape[1],localm,localm))
-    A = Q.dot(A)
-    
-    util.setstatus('outputting')
-    for row in A:
-        yield util.array2list(row)
-                
-        
-def second_mapper(data):
-    
-    n = gopts.getintkey('ncols')
-    m = int(os.getenv('nrows'))
-    maxlocal = int(os.getenv('maxlocal'))
-    
-    totalrows = 0
-    totalouts = 0
-    rows = []
-    util.setstatus('acquiring data with ncols=%i'%(n))
-    
-    for key,value in data:
-        assert(len(value) == n)
-        
-        rows.append(value)
-        totalrows += 1
-        
-        if len(rows) >= maxlocal:
-            dumbo.util.incrcounter('Program','rows acquired',len(rows))
-            totalouts += 1
-            
-            for row in localQoutput(rows):
-                key = random.randint(0, 4000000000)
-                yield key, row
-            
-            # reset rows, status
-            rows = []
-            util.setstatus('acquiring data with ncols=%i'%(n))
-            
-            
-    if len(rows) > 0:
-        for row in localQoutput(rows):
-            key = random.randint(0, 4000000000)
-            yield key, row
-    
+            "generating rows %i to %i of a %i-by-%i matrix"%(
+            task*maprows, (task+1)*maprows, m, n))
+        blocks = testmat.task_blocks(task,m,n,maprows,local,seed,
+            status=util.setstatus)
+        for key,value in testmat.records(blocks,format,rows_per_block):
+            if format == 'rows':
+                value = value.tolist()
+            yield key, value
+        dumbo.util.incrcounter('Program','rows generated',maprows)
 
 def starter(prog):
     """ Start the program with a null input. """
     # get options
-    
+
     # set the global opts
     gopts.prog = prog
-    
+
     prog.addopt('memlimit','4g')
     prog.addopt('file','util.py')
+    prog.addopt('file','testmat.py')
+    prog.addopt('file','rowblock.py')
+    prog.addopt('file','tbio.py')
+    prog.addopt('file','seqfile.py')
+    prog.addopt('file','local_util.py')
     prog.addopt('libegg','numpy')
-    
-    
+
     m = gopts.getintkey('nrows',None) # error with no key
     n = gopts.getintkey('ncols',None) # error with no key
-    
-    
+
     maprows = gopts.getintkey('maprows',2*n)
-    stages = gopts.getintkey('nstages',2)
     maxlocal = gopts.getintkey('maxlocal',n)
-        
-    if maprows % n is not 0:
-        maprows = (maprows/n)*n
-        gopts.setkey('maprows',maprows)
-        print "'maprows' adjusted to", maprows, "to ensure integer k in maprows=k*ncols"
-    
-    if m % maprows is not 0:
-        m = ((m/maprows)+1)*maprows
-        gopts.setkey('nrows',m)
-        print "'nrows' changed to", m, "to ensure scalar integer k in nrows=k*maprows"
-    
-    print "using", stages, "stages"
-    
+    gopts.getintkey('seed',random.randint(0,2000000000))
+    format = gopts.getstrkey('format','rows')
+    gopts.getintkey('rows_per_block',max(maxlocal,n))
+    if format not in ('rows','blocks'):
+        return "'format' must be rows or blocks"
+
+    stages = prog.delopt('nstages')
+    if stages is not None:
+        print "'nstages' is ignored, the matrix is generated in one pass"
+
+    m2,maprows2,local = testmat.problem_size(m,n,maprows,maxlocal)
+    gopts.setkey('nrows',m2)
+    gopts.setkey('maprows',maprows2)
+    gopts.setkey('maxlocal',local)
+
     gopts.save_params()
-   
+
     prog.addopt('input','IGNORED')
     prog.addopt('libjar','../java/build/jar/hadoop-lib.jar')
     prog.addopt('inputformat','gov.sandia.dfgleic.NullInputFormat')
-    
+
     prog.addopt('jobconf','mapred.output.compress=true')
     prog.addopt('jobconf','mapred.output.compress.codec=com.hadoop.compression.lzo.LzoCodec')
     prog.addopt('jobconf','fs.local.block.size='+str(int(1024*1024*256)))
 
-
 def runner(job):
     # grab info from environment
     m = gopts.getintkey('nrows')
     maprows = gopts.getintkey('maprows')
     k = m/maprows
-    stages = gopts.getintkey('nstages')
-    
+
     print >>sys.stderr, "using %i map tasks"%(k)
-    
-    for i in xrange(stages):
-        if i==0:
-            opts = [('numreducetasks',str(k)),
-                    ('nummaptasks',str(k))]
-            job.additer(first_mapper,
-                "org.apache.hadoop.mapred.lib.IdentityReducer",
-                opts=opts)
-        else:
-            job.additer(second_mapper,"org.apache.hadoop.mapred.lib.IdentityReducer",
-                opts=[('numreducetasks',str(k))])
-            
+
+    opts = [('numreducetasks','0'),
+            ('nummaptasks',str(k))]
+    job.additer(mapper,"org.apache.hadoop.mapred.lib.IdentityReducer",
+        opts=opts)
+
 if __name__=='__main__':
     # find the hadoop examples jar
     dumbo.main(runner, starter)
 
-    
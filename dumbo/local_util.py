@@ -0,0 +1,46 @@
+"""
+local_util.py
+=============
+
+Utility routines for the programs that run on a single machine
+instead of through Hadoop.  None of these need dumbo or hadoop.
+"""
+
+import sys
+import os
+import multiprocessing
+
+def get_args(argv):
+    args = {}
+    for i,arg in enumerate(argv):
+        if arg[0] == '-':
+            if i+1 < len(argv):
+                val = argv[i+1]
+            else:
+                val = None
+            args[arg[1:]] = val
+    return args
+
+def setstatus(msg):
+    print >>sys.stderr, "Status:", msg
+
+def run_tasks(func,tasks,nprocs=None):
+    """ Run func on each of the tasks using a pool of processes.
+
+    @param func a function of one argument at the top level of a module
+    @param tasks the list of arguments for func
+    @param nprocs the number of processes, the default is the number
+    of processors.  With nprocs=1, the tasks run in this process.
+    @return the list of results from func in the order of tasks
+    """
+    if nprocs is None:
+        nprocs = multiprocessing.cpu_count()
+    nprocs = min(nprocs,len(tasks))
+    if nprocs <= 1:
+        return [func(task) for task in tasks]
+    pool = multiprocessing.Pool(nprocs)
+    try:
+        # use map_async with a timeout so Ctrl-C works
+        return pool.map_async(func,tasks,chunksize=1).get(9999999)
+    finally:
+        pool.terminate()
@@ -1,35 +1,146 @@
 #!/usr/bin/env dumbo
 
 """
+matrix2seqfile.py
+=================
+
 Convert a textual matrix file into a sequence file of typed bytes
+
+The mappers parse batches of lines at once with NumPy (see textrows.py).
+With -format rows, each key is the byte offset of a line and each value
+is the row.  With -format blocks, each value is a packed block of rows
+and each key is the tuple (byte offset of the first line of the block,),
+since the mappers don't know the row offsets that integer block keys
+have, see rowblock.py.  Empty lines are skipped, and malformed lines
+are skipped and counted.
+
+The mappers import numpy.  Add -libegg numpy if the nodes don't have
+it.
+
+Usage
+-----
+
+    dumbo start matrix2seqfile.py -input <tmat> -output <mseq> \\
+        [-format rows|blocks -rows_per_block <int> -batchsize <int>]
+
+    dumbo convert matrix2seqfile.py <mseq> > <tmat>
+
+The convert command writes a sequence file of rows or row blocks back
+to a textual matrix.  To convert a local .tmat file without Hadoop, see
+textrows.py.
 """
 
 import sys
+import os
+
+import numpy
+
+import util
+import textrows
+import rowblock
+
+import dumbo
+import dumbo.backends.common
+
+# create the global options structure
+gopts = util.GlobalOptions()
+
+class BulkMapper(dumbo.backends.common.MapRedBase):
+    """ Map lines of a matrix to a sequence file:
+      Key=<lineno>, Value=[row_i]
+    or to packed blocks of rows.
+    """
+    def __init__(self,format='rows',rows_per_block=1000,batchsize=1000):
+        self.format = format
+        self.rows_per_block = rows_per_block
+        self.batchsize = batchsize
+        self.ncols = None
+
+    def convert(self,keys,lines):
+        A,index,nbad = textrows.parse_lines(lines,self.ncols)
+        if nbad > 0:
+            self.counters['malformed lines'] += nbad
+        if len(index) == 0:
+            return
+        self.ncols = A.shape[1]
+        self.counters['rows converted'] += len(index)
+        if self.format == 'rows':
+            for i,row in zip(index,A):
+                yield keys[i], util.array2list(row)
+        else:
+            for start in xrange(0,len(index),self.rows_per_block):
+                yield (rowblock.tuple_key(keys[index[start]]),
+                    rowblock.pack(A[start:start+self.rows_per_block]))
+
+    def __call__(self,data):
+        keys = []
+        lines = []
+        for key,value in data:
+            keys.append(key)
+            lines.append(value)
+            if len(lines) >= self.batchsize:
+                for key,value in self.convert(keys,lines):
+                    yield key, value
+                keys = []
+                lines = []
+        for key,value in self.convert(keys,lines):
+            yield key, value
 
-"""
-Map lines of a matrix to a sequence file:
-  Key=<lineno>, Value=[row_i]
-"""
-def mapper(key,value):
-    valarray = [float(v) for v in value.split()]
-    if len(valarray) == 0:
-        return
-    yield key, valarray
-    
 class Converter:
+    """ Write a sequence file of rows or row blocks as a textual matrix """
     def __init__(self,opts):
-        pass
+        self.batchsize = 1000
     def __call__(self,data):
-        item = 0
+        rows = []
+        nrows = 0
         for key,value in data:
-            for entry in value:
-                print "%18.16e"%(entry), 
-            print
-            item += 1
-    
-if __name__ == '__main__':
-    import dumbo
-    import dumbo.lib
-    dumbo.run(mapper,dumbo.lib.identityreducer)
+            if rowblock.isblock(value):
+                self.write(rows)
+                rows = []
+                nrows = 0
+                self.write([rowblock.unpack(value)])
+            else:
+                rows.append(value)
+                nrows += 1
+                if nrows >= self.batchsize:
+                    self.write(rows)
+                    rows = []
+                    nrows = 0
+        self.write(rows)
+    def write(self,rows):
+        if len(rows) == 0:
+            return
+        A = numpy.atleast_2d(numpy.vstack(rows))
+        numpy.savetxt(sys.stdout,A,fmt='%18.16e')
+
+def runner(job):
+    format = gopts.getstrkey('format')
+    rows_per_block = gopts.getintkey('rows_per_block')
+    batchsize = gopts.getintkey('batchsize')
+
+    job.additer(mapper=BulkMapper(format,rows_per_block,batchsize),
+        reducer="org.apache.hadoop.mapred.lib.IdentityReducer")
 
-    
+def starter(prog):
+    mypath = os.path.dirname(__file__)
+
+    # set the global opts
+    gopts.prog = prog
+
+    prog.addopt('file',os.path.join(mypath,'util.py'))
+    prog.addopt('file',os.path.join(mypath,'textrows.py'))
+    prog.addopt('file',os.path.join(mypath,'rowblock.py'))
+    prog.addopt('file',os.path.join(mypath,'tbio.py'))
+    prog.addopt('file',os.path.join(mypath,'seqfile.py'))
+    prog.addopt('file',os.path.join(mypath,'local_util.py'))
+
+    format = gopts.getstrkey('format','rows')
+    if format not in ('rows','blocks'):
+        return "'format' must be rows or blocks"
+    gopts.getintkey('rows_per_block',1000)
+    gopts.getintkey('batchsize',1000)
+
+    gopts.save_params()
+
+if __name__ == '__main__':
+    dumbo.main(runner, starter)
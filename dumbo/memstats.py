@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+"""
+memstats.py
+===========
+
+Measure the memory of a mapper or reducer, without dumbo or hadoop.
+
+A MemStats object records the peak size of each buffer of a task, e.g.
+the compression buffer of tsqrlib.TSQR before each compress, or the
+lists of keys and rows in svd.ComputeSVDLeft, and the peak resident
+set size (RSS) of the process.  At the end of the task, finish reports
+them as Hadoop counters in the group Memory, in MB, and prints a json
+report to stderr, so it's in the task log.  Hadoop adds the counters of
+all the tasks, so use the counters of each task, or the reports, to
+size blocksize and memlimit.
+
+The measurements are off unless the environment variable memstats is
+set, i.e. the option -memstats of the drivers:
+
+  -memstats yes : report counters and print the json report
+  -memstats <dir> : also write the report to <dir>/memstats-<task>.json
+    on the machine that runs the task
+
+With -tracemalloc <n>, the report also lists the n lines of code that
+allocated the most memory that is still in use.  This needs the
+tracemalloc module, from Python 3.4 or pytracemalloc.
+
+The size of a buffer counts the NumPy arrays exactly, and estimates the
+rows stored as lists of floats from the size of the first row.
+
+History
+-------
+:2011-03-24: Initial coding
+"""
+
+import sys
+import os
+import json
+import time
+import resource
+
+import numpy
+
+def enabled():
+    """ Test if the environment turns on the measurements. """
+    return os.getenv('memstats','no') not in ('','no')
+
+def peak_rss():
+    """ The peak resident set size of this process in bytes. """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss
+    return maxrss*1024
+
+def current_rss():
+    """ The resident set size of this process in bytes, or None. """
+    try:
+        pages = int(open('/proc/self/statm').read().split()[1])
+    except (IOError,IndexError,ValueError):
+        return None
+    return pages*resource.getpagesize()
+
+def nbytes(obj):
+    """ Estimate the bytes in an array, a row, or a list of rows. """
+    if isinstance(obj,numpy.ndarray):
+        return obj.nbytes
+    if isinstance(obj,(list,tuple)):
+        total = sys.getsizeof(obj)
+        if len(obj) == 0:
+            return total
+        first = obj[0]
+        if isinstance(first,(float,int,long)):
+            return total + len(obj)*sys.getsizeof(first)
+        if isinstance(first,numpy.ndarray):
+            return total + sum(item.nbytes for item in obj
+                if isinstance(item,numpy.ndarray))
+        return total + len(obj)*nbytes(first)
+    return sys.getsizeof(obj)
+
+class MemStats:
+    """ The peak memory of the buffers of a task.
+
+    @param name the name of the task in the report, e.g. 'tsqr'
+    @param on turn on the measurements, the default is enabled()
+    """
+    def __init__(self,name,on=None):
+        if on is None:
+            on = enabled()
+        self.name = name
+        self.on = on
+        self.peaks = {}
+        self.counts = {}
+        self.finished = False
+        self.ntop = 0
+        self.tracemalloc = None
+        if self.on:
+            self.ntop = int(os.getenv('tracemalloc','0') or 0)
+            if self.ntop > 0:
+                self._start_tracemalloc()
+
+    def _start_tracemalloc(self):
+        try:
+            import tracemalloc
+        except ImportError:
+            print >>sys.stderr, "memstats: tracemalloc is not available"
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.tracemalloc = tracemalloc
+
+    def buffer(self,name,obj):
+        """ Record the size of a buffer, an array or a list of rows. """
+        if not self.on:
+            return
+        size = nbytes(obj)
+        self.peaks[name] = max(self.peaks.get(name,0),size)
+        self.counts[name] = self.counts.get(name,0) + 1
+
+    def top(self):
+        """ Return the lines with the largest allocations. """
+        if self.tracemalloc is None:
+            return []
+        snapshot = self.tracemalloc.take_snapshot()
+        sites = []
+        for stat in snapshot.statistics('lineno')[:self.ntop]:
+            frame = stat.traceback[0]
+            sites.append({'site': '%s:%i'%(frame.filename,frame.lineno),
+                'bytes': stat.size, 'blocks': stat.count})
+        return sites
+
+    def report(self):
+        """ Return the measurements as a dictionary. """
+        report = {
+            'name': self.name,
+            'task': os.getenv('mapred_task_id',''),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'peak rss': peak_rss(),
+            'rss': current_rss(),
+            'buffers': dict((name, {'peak': self.peaks[name],
+                'measurements': self.counts[name]}) for name in self.peaks),
+        }
+        if self.tracemalloc is not None:
+            report['top allocations'] = self.top()
+        return report
+
+    def finish(self,counter):
+        """ Report the counters and write the report, once.
+
+        @param counter a function counter(group, name, value)
+        """
+        if not self.on or self.finished:
+            return
+        self.finished = True
+        report = self.report()
+        mb = 1024*1024
+        counter('Memory','peak RSS (MB)',int(report['peak rss']/mb))
+        for name,size in self.peaks.items():
+            counter('Memory','peak %s (MB)'%(name),int(size/mb))
+        data = json.dumps(report,sort_keys=True)
+        print >>sys.stderr, 'memstats:', data
+        dirname = os.getenv('memstats')
+        if dirname != 'yes':
+            task = report['task'] or '%s-%i'%(self.name,os.getpid())
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            f = open(os.path.join(dirname,'memstats-%s.json'%(task)),'w')
+            f.write(data)
+            f.close()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+"""
+mmtsqr.py
+=========
+
+Run TSQR, the normal equations, or the left singular vectors of a
+tall-and-skinny matrix on one machine, without Hadoop.
+
+The matrix is a .npy file or a raw binary file of rows, and it's memory
+mapped, so it doesn't need to fit in memory.  The rows are split into
+one range per task and a pool of processes runs the tasks.  Each task
+reads its range of the memory map in chunks of blocksize*ncols rows
+and compresses them into an R factor with tsqrlib.py, like the mappers
+in tsqr.py, or adds them to A'*A.  The results of the tasks are merged
+in a tree, in parallel too.
+
+Usage
+-----
+
+    python mmtsqr.py -mat <file> -output <file> \\
+        [-task tsqr|normal|svd -ncols <int> -dtype float64|float32 \\
+         -offset <bytes> -blocksize <int> -ntasks <int> -nprocs <int>]
+
+      -mat <file> : a .npy file with a 2d array, or a raw binary file
+        with rows in C order.  For a raw file, -ncols is required.
+
+      -output <file> : the .npy file with the result.  For tsqr this is
+        R, for normal this is A'*A, and for svd this is U, which has
+        one column for each of the r independent columns of A, see
+        rrqr.py.  For svd, the R factor, the singular values
+        and the right singular vectors are also saved to <output
+        without .npy>-R.npy, -S.npy and -V.npy.
+
+      -rank_tol <float> : the relative tolerance for the rank for svd.
+        The default is max(m,n)*eps.
+
+      -task tsqr|normal|svd : the default is tsqr.
+
+      -ncols, -dtype, -offset : the number of columns, the type of each
+        entry, and the number of bytes before the first row in a raw
+        binary file.  The defaults are float64 and 0.
+
+      -blocksize <int> : each task reads blocksize*ncols rows at once.
+        The default is 3, and each chunk has at least 1000 rows.
+
+      -panel <int> : for tsqr and svd of a wide matrix, read
+        blocksize*panel rows at once and update R one panel of columns
+        at a time, see tsqrlib.py.
+
+      -ntasks <int> : the number of row ranges.  The default is nprocs.
+
+      -nprocs <int> : the number of processes.  The default is the
+        number of processors.
+
+      -rcache <dir> : the directory of the cache of R factors and A'*A,
+        see rcache.py.  The default is ~/.mrtsqr/rcache.  Use -rcache no
+        to disable the cache.
+
+History
+-------
+:2011-03-17: Initial coding
+"""
+
+import sys
+import os
+import time
+import multiprocessing
+
+import numpy
+import numpy.linalg
+import numpy.lib.format
+
+import local_util
+import tsqrlib
+import rrqr
+import checkpoint
+import rcache
+
+def open_matrix(opts,mode='r'):
+    """ Memory map the matrix in the file opts['mat']. """
+    filename = opts['mat']
+    if filename.endswith('.npy'):
+        A = numpy.load(filename,mmap_mode=mode)
+    else:
+        dtype = numpy.dtype(opts.get('dtype','float64'))
+        ncols = int(opts['ncols'])
+        offset = int(opts.get('offset',0))
+        nrows = (os.path.getsize(filename) - offset)/(dtype.itemsize*ncols)
+        A = numpy.memmap(filename,dtype=dtype,mode=mode,offset=offset,
+            shape=(nrows,ncols))
+    if A.ndim != 2:
+        raise ValueError("the matrix in %s is not 2d"%(filename))
+    return A
+
+def chunks(A,start,end,chunksize):
+    """ Iterate over the rows start to end of A in chunks. """
+    for first in xrange(start,end,chunksize):
+        yield A[first:min(first+chunksize,end)]
+
+def chunksize(opts,ncols):
+    return max(opts['blocksize']*ncols,1000)
+
+def tsqr_task(opts):
+    """ Compute the R factor of one range of rows. """
+    A = open_matrix(opts)
+    panel = opts['panel']
+    return tsqrlib.tsqr(A[opts['start']:opts['end']],opts['blocksize'],
+        chunksize=chunksize(opts,panel or A.shape[1]),panel=panel)
+
+def normal_task(opts):
+    """ Compute A'*A for one range of rows. """
+    A = open_matrix(opts)
+    G = numpy.zeros((A.shape[1],A.shape[1]))
+    for chunk in chunks(A,opts['start'],opts['end'],chunksize(opts,A.shape[1])):
+        chunk = numpy.asarray(chunk,dtype=float)
+        G += numpy.dot(chunk.T,chunk)
+    return G
+
+def svd_task(opts):
+    """ Compute U = A(:,columns)*M for one range of rows. """
+    A = open_matrix(opts)
+    U = numpy.load(opts['output'],mmap_mode='r+')
+    M = numpy.load(opts['M'])
+    columns = opts['columns']
+    start = opts['start']
+    for chunk in chunks(A,start,opts['end'],chunksize(opts,A.shape[1])):
+        if columns is not None:
+            chunk = chunk[:,columns]
+        U[start:start+chunk.shape[0]] = numpy.dot(chunk,M)
+        start += chunk.shape[0]
+    U.flush()
+    return opts['end'] - opts['start']
+
+def merge_R(Rs):
+    """ Merge a list of R factors into one. """
+    return numpy.linalg.qr(numpy.vstack(Rs),'r')
+
+def tree_merge(Rs,nprocs):
+    """ Merge R factors in pairs until there is only one. """
+    while len(Rs) > 1:
+        pairs = [Rs[i:i+2] for i in xrange(0,len(Rs),2)]
+        Rs = local_util.run_tasks(merge_R,pairs,nprocs)
+    return Rs[0]
+
+def row_tasks(opts,nrows,ntasks):
+    """ Split the rows into ntasks ranges. """
+    tasks = []
+    bounds = numpy.linspace(0,nrows,ntasks+1).astype(int)
+    for i in xrange(ntasks):
+        if bounds[i] == bounds[i+1]:
+            continue
+        task = dict(opts)
+        task['start'] = int(bounds[i])
+        task['end'] = int(bounds[i+1])
+        tasks.append(task)
+    return tasks
+
+def svd_factors(R,tol=None,m=None):
+    """ Compute the SVD of R for its numerical rank, see rrqr.py.
+
+    @param m the number of rows of A for the default tol
+    @return a tuple (S, V, columns, M) where U = A(:,columns)*M, and
+    columns is None if all the columns are independent.
+    """
+    columns,M,S,V = rrqr.left_factor(R,tol,m)
+    if len(columns) == R.shape[1]:
+        return S, V, None, M[numpy.argsort(columns)]
+    return S, V, [int(c) for c in columns], M
+
+def main(args):
+    opts = dict(args)
+    opts['blocksize'] = int(args.get('blocksize',3))
+    opts['panel'] = int(args.get('panel',0)) or None
+    task = args.get('task','tsqr')
+    if task not in ('tsqr','normal','svd'):
+        print >>sys.stderr, "Error: unknown task %s"%(task)
+        sys.exit(1)
+    nprocs = args.get('nprocs',None)
+    if nprocs is not None:
+        nprocs = int(nprocs)
+    ntasks = int(args.get('ntasks',nprocs or multiprocessing.cpu_count()))
+
+    A = open_matrix(opts)
+    nrows,ncols = A.shape
+    nbytes = A.nbytes
+    dtype = str(A.dtype)
+    del A
+    tasks = row_tasks(opts,nrows,ntasks)
+    output = args['output']
+    base = os.path.splitext(output)[0]
+
+    local_util.setstatus('%s of a %i-by-%i matrix with %i tasks'%(
+        task,nrows,ncols,len(tasks)))
+    t0 = time.time()
+    # look up the factor in the cache
+    kind = 'AtA' if task == 'normal' else 'R'
+    cache,key,arrays = rcache.lookup(args.get('rcache',None),
+        checkpoint.LocalFS(),[opts['mat']],kind=kind,precision=dtype,
+        shape=[nrows,ncols],offset=int(opts.get('offset',0)))
+    if arrays is not None:
+        local_util.setstatus('found %s in %s'%(kind,cache.path))
+    if task == 'normal':
+        if arrays is not None:
+            G = arrays['AtA']
+        else:
+            G = sum(local_util.run_tasks(normal_task,tasks,nprocs))
+            if cache is not None:
+                cache.put(key,{'AtA': G},{'input': opts['mat']})
+        numpy.save(output,G)
+    elif task == 'tsqr' or task == 'svd':
+        if arrays is not None:
+            R = arrays['R']
+        else:
+            R = tree_merge(local_util.run_tasks(tsqr_task,tasks,nprocs),
+                nprocs)
+            if cache is not None:
+                cache.put(key,{'R': R},{'input': opts['mat']})
+        if task == 'tsqr':
+            numpy.save(output,R)
+        else:
+            local_util.setstatus('computing U = A*V*inv(S)')
+            rank_tol = args.get('rank_tol',None)
+            if rank_tol is not None:
+                rank_tol = float(rank_tol)
+            S,V,columns,M = svd_factors(R,rank_tol,nrows)
+            local_util.setstatus('numerical rank %i'%(len(S)))
+            numpy.save(base+'-R.npy',R)
+            numpy.save(base+'-S.npy',S)
+            numpy.save(base+'-V.npy',V)
+            numpy.save(base+'-M.npy',M)
+            U = numpy.lib.format.open_memmap(output,mode='w+',
+                dtype=numpy.float64,shape=(nrows,len(S)))
+            del U
+            for t in tasks:
+                t['output'] = output
+                t['M'] = base+'-M.npy'
+                t['columns'] = columns
+            local_util.run_tasks(svd_task,tasks,nprocs)
+            os.remove(base+'-M.npy')
+    dt = time.time() - t0
+    npasses = int(task == 'svd') + int(arrays is None)
+    local_util.setstatus('wrote %s (%.1f sec, read %.1f MB/sec)'%(output, dt,
+        npasses*nbytes/(1e6*max(dt,1e-6))))
+
+if __name__=='__main__':
+    args = local_util.get_args(sys.argv[1:])
+    for key in ['mat','output']:
+        if key not in args:
+            print >>sys.stderr, "Error: -%s not specified"%(key)
+            sys.exit(1)
+    main(args)
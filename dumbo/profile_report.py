@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+"""
+profile_report.py
+=================
+
+Merge the profiles of the tasks of a job from taskprof.py into one
+ranked report for each stage.
+
+The profiles of all the tasks of a stage, e.g. all the mappers of
+tsqr-1-map, are added together.  The tasks run in different working
+directories, so the directories are stripped from the file names of
+the functions before the profiles are added, unless -strip_dirs no.
+For cProfile, the report is the pstats listing.  For samples, the
+report ranks the functions by their self time, the samples in the
+function itself, or their cumulative time, the samples with the
+function anywhere in the stack, and then ranks the hottest lines.
+The times of samples are estimates: the number of samples times the
+sampling interval.
+
+Usage
+-----
+
+    python profile_report.py -input <path>[,<path>...] [-hdfs yes] \\
+        [-top <int> -sort tottime|cumulative -strip_dirs yes|no \\
+         -output <dir>]
+
+      -input <path> : the output of a job, a -profile_dir of the tasks,
+        or a glob of the profile files.  With -hdfs yes, a path in HDFS.
+
+      -top <int> : the number of functions in each report, the default
+        is 25.
+
+      -sort tottime|cumulative : rank by the time in each function
+        (the default) or by the time including its calls.  For cProfile,
+        any sort key of pstats works.
+
+      -output <dir> : also save the merged profile of each stage as
+        <dir>/<stage>.prof for pstats or <dir>/<stage>.json.
+
+History
+-------
+:2011-03-25: Initial coding
+"""
+
+import sys
+import os
+import json
+import marshal
+import posixpath
+import pstats
+
+import checkpoint
+import local_util
+
+class _LoadedStats:
+    """ The stats of a cProfile file for pstats.Stats, which accepts an
+    object with create_stats and stats instead of a file name. """
+    def __init__(self,data):
+        self.stats = marshal.loads(data)
+
+    def create_stats(self):
+        pass
+
+def profile_files(fs,paths):
+    """ Find the profile files under a list of paths.
+
+    @return a dictionary from each stage to a list of (task, kind, path)
+    where kind is 'prof' or 'json'
+    """
+    stages = {}
+    for path in paths:
+        for name,size,mtime in fs.ls(path,hidden=True):
+            base = posixpath.basename(name)
+            parts = base.split('.')
+            if parts[0] != '_profile' or len(parts) < 4 or \
+                    parts[-1] not in ('prof','json'):
+                continue
+            task = '.'.join(parts[2:-1])
+            stages.setdefault(parts[1],[]).append((task,parts[-1],name))
+    return stages
+
+def _strip(func):
+    """ Remove the directory from a function name file:line(name). """
+    filename,rest = func.rsplit(':',1)
+    return os.path.basename(filename) + ':' + rest
+
+def merge_cprofile(fs,names,strip_dirs=True,stream=sys.stdout):
+    """ Add the cProfile files of the tasks into one pstats.Stats. """
+    stats = None
+    for name in names:
+        part = pstats.Stats(_LoadedStats(fs.cat(name)),stream=stream)
+        if strip_dirs:
+            part.strip_dirs()
+        if stats is None:
+            stats = part
+        else:
+            stats.add(part)
+    return stats
+
+def merge_samples(fs,names,strip_dirs=True):
+    """ Add the sample files of the tasks.
+
+    @return a dictionary with the seconds of each stack and each line,
+    the number of samples, and the elapsed seconds of all the tasks
+    """
+    merged = {'stacks': {}, 'lines': {}, 'samples': 0, 'elapsed': 0.,
+        'tasks': 0}
+    for name in names:
+        data = json.loads(fs.cat(name))
+        secs = data['interval']/1000.
+        merged['samples'] += data['samples']
+        merged['elapsed'] += data['elapsed']
+        merged['tasks'] += 1
+        for stack,count in data['stacks']:
+            if strip_dirs:
+                stack = [_strip(func) for func in stack]
+            stack = tuple(stack)
+            merged['stacks'][stack] = merged['stacks'].get(stack,0.) + count*secs
+        for line,count in data['lines'].items():
+            if strip_dirs:
+                line = _strip(line)
+            merged['lines'][line] = merged['lines'].get(line,0.) + count*secs
+    return merged
+
+def rank_samples(merged):
+    """ Compute the self and cumulative seconds of each function.
+
+    @return a list of (self secs, cumulative secs, function)
+    """
+    tottime = {}
+    cumtime = {}
+    for stack,secs in merged['stacks'].items():
+        if len(stack) == 0:
+            continue
+        tottime[stack[-1]] = tottime.get(stack[-1],0.) + secs
+        # a recursive function is only counted once in each stack
+        for func in set(stack):
+            cumtime[func] = cumtime.get(func,0.) + secs
+    return [(tottime.get(func,0.),cumtime[func],func) for func in cumtime]
+
+def print_samples(merged,top=25,sort='tottime',out=sys.stdout):
+    total = sum(merged['stacks'].values())
+    if total == 0.:
+        total = 1.
+    rows = rank_samples(merged)
+    if sort in ('cumulative','cumtime'):
+        rows.sort(key=lambda row: (-row[1],-row[0],row[2]))
+    else:
+        rows.sort(key=lambda row: (-row[0],-row[1],row[2]))
+    print >>out, "%i samples, %.1f secs over %.1f elapsed secs"%(
+        merged['samples'], sum(merged['stacks'].values()), merged['elapsed'])
+    print >>out
+    print >>out, "%10s %7s %10s %7s  %s"%(
+        'self secs','self %','cum secs','cum %','function')
+    for tottime,cumtime,func in rows[:top]:
+        print >>out, "%10.3f %7.2f %10.3f %7.2f  %s"%(
+            tottime, 100.*tottime/total, cumtime, 100.*cumtime/total, func)
+    print >>out
+    print >>out, "%10s %7s  %s"%('secs','%','line')
+    lines = sorted(merged['lines'].items(),key=lambda item: (-item[1],item[0]))
+    for line,secs in lines[:top]:
+        print >>out, "%10.3f %7.2f  %s"%(secs, 100.*secs/total, line)
+
+def report(fs,paths,top=25,sort='tottime',strip_dirs=True,output=None,
+        out=sys.stdout):
+    """ Print the merged report of each stage. """
+    stages = profile_files(fs,paths)
+    if len(stages) == 0:
+        print >>out, "no profiles in %s"%(', '.join(paths))
+        return
+    for stage in sorted(stages):
+        files = stages[stage]
+        print >>out, "=== %s: %i tasks ==="%(stage,len(files))
+        prof = [name for task,kind,name in files if kind == 'prof']
+        samples = [name for task,kind,name in files if kind == 'json']
+        if prof:
+            stats = merge_cprofile(fs,prof,strip_dirs,stream=out)
+            stats.sort_stats(sort).print_stats(top)
+            if output:
+                if not os.path.isdir(output):
+                    os.makedirs(output)
+                stats.dump_stats(os.path.join(output,stage+'.prof'))
+        if samples:
+            merged = merge_samples(fs,samples,strip_dirs)
+            print_samples(merged,top,sort,out)
+            if output:
+                data = dict(merged)
+                data['stacks'] = [[list(stack),secs]
+                    for stack,secs in merged['stacks'].items()]
+                checkpoint.LocalFS().write(os.path.join(output,stage+'.json'),
+                    json.dumps(data))
+        print >>out
+
+def main(args):
+    if args.get('hdfs','no') == 'yes':
+        fs = checkpoint.HadoopFS()
+    else:
+        fs = checkpoint.LocalFS()
+    report(fs,args['input'].split(','),top=int(args.get('top',25)),
+        sort=args.get('sort','tottime'),
+        strip_dirs=args.get('strip_dirs','yes') != 'no',
+        output=args.get('output',None))
+
+if __name__=='__main__':
+    args = local_util.get_args(sys.argv[1:])
+    if 'input' not in args:
+        print >>sys.stderr, "Error: -input not specified"
+        sys.exit(1)
+    main(args)
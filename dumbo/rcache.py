@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+"""
+rcache.py
+=========
+
+A persistent cache of R factors.
+
+Each entry is keyed by the fingerprint of the input matrix (the path,
+size and mtime of each file, see checkpoint.py), the kind of factor,
+the column selection, the precision, and any other parameters that
+change the result.  An entry is a set of named arrays, e.g. R, or R
+and Q'*b, saved in <key>.npz, with the key and the time of its last
+use in <key>.json.  When the cache is larger than maxsize bytes, the
+least recently used entries are removed.
+
+The cache and the matrix are each on a file system from checkpoint.py,
+so a local cache works for a matrix in HDFS, and a cache in HDFS is
+shared by everyone.  The drivers in tsqr.py, svd.py, mmtsqr.py,
+hadoopy/tsqr.py and the tinyimages experiments look up the cache
+before they start a job, and store the factor from the output of the
+last stage, see store_at_exit.  If the matrix changes, its fingerprint
+changes, so the old entry is never used again and it's evicted.
+
+Usage
+-----
+
+    python rcache.py [-rcache <dir>] -list
+    python rcache.py [-rcache <dir>] -evict [-rcache_size <MB>]
+    python rcache.py [-rcache <dir>] -get <key> -output <file.npz>
+    python rcache.py [-rcache <dir>] -put <file.npy|file.npz> -mat <path> \\
+        [-kind R -params <name>=<value>[,<name>=<value>...] -hdfs yes]
+
+      -rcache <dir> : the cache directory, the default is
+        $MRTSQR_RCACHE or ~/.mrtsqr/rcache.  A path that starts with
+        hdfs: is a directory in HDFS.
+
+      -rcache_size <MB> : the size of the cache, the default is 1024.
+
+      -put : add the arrays in a file for the matrix in -mat to the
+        cache.  With -hdfs yes, -mat is a path in HDFS.  The key is
+        the kind and the params of the driver, e.g. the PCA of
+        experiments/tinyimages/ti_pca.py is
+          -kind 'pca R' -params center=rows
+
+History
+-------
+:2011-03-20: Initial coding
+"""
+
+import sys
+import os
+import time
+import json
+import atexit
+import hashlib
+import tempfile
+import cStringIO
+
+import numpy
+
+import checkpoint
+import seqfile
+import local_util
+
+default_maxsize = 1024*1024*1024
+
+def default_path():
+    path = os.getenv('MRTSQR_RCACHE')
+    if path:
+        return path
+    return os.path.join(os.path.expanduser('~'),'.mrtsqr','rcache')
+
+def filesystem(path):
+    """ Return the file system for a cache path. """
+    if path.startswith('hdfs:'):
+        return checkpoint.HadoopFS()
+    return checkpoint.LocalFS()
+
+class RCache:
+    """ A cache of R factors in a directory.
+
+    @param path the directory, the default is default_path()
+    @param fs the file system for path, the default is from filesystem
+    @param maxsize the size of the cache in bytes
+    """
+    def __init__(self,path=None,fs=None,maxsize=None):
+        if path is None:
+            path = default_path()
+        if fs is None:
+            fs = filesystem(path)
+        if maxsize is None:
+            maxsize = default_maxsize
+        self.path = path.rstrip('/')
+        self.fs = fs
+        self.maxsize = maxsize
+
+    def key(self,fs,inputs,kind='R',columns=None,precision='float64',
+            **params):
+        """ Compute the key for a factor of a matrix.
+
+        @param fs the file system with the matrix
+        @param inputs the list of paths with the matrix
+        @param kind the kind of factor, e.g. 'R' or 'AtA'
+        @param columns the list of columns in the factor, or None for
+        all the columns
+        @param precision the type of the computation
+        @param params other parameters that change the factor
+        @return a tuple (key, description)
+        """
+        desc = {
+            'input': checkpoint.fingerprint(fs,inputs),
+            'kind': kind,
+            'columns': columns,
+            'precision': precision,
+            'params': params,
+        }
+        data = json.dumps(desc,sort_keys=True)
+        return hashlib.sha1(data).hexdigest(), json.loads(data)
+
+    def _file(self,key,ext):
+        return '%s/%s.%s'%(self.path,key,ext)
+
+    def _read_info(self,key):
+        data = self.fs.cat(self._file(key,'json'))
+        if not data:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def get(self,key):
+        """ Look up an entry and mark it as used.
+
+        @param key the key from the key method, or the tuple it returns
+        @return a dictionary of arrays, or None if the key isn't cached
+        """
+        if isinstance(key,tuple):
+            key = key[0]
+        info = self._read_info(key)
+        if info is None:
+            return None
+        data = self.fs.cat(self._file(key,'npz'))
+        if len(data) != info.get('size'):
+            return None
+        npz = numpy.load(cStringIO.StringIO(data))
+        arrays = dict((name,npz[name]) for name in npz.files)
+        info['used'] = time.time()
+        self.fs.write(self._file(key,'json'),json.dumps(info,indent=1))
+        return arrays
+
+    def put(self,key,arrays,info={}):
+        """ Add an entry to the cache and evict old entries.
+
+        @param key the tuple from the key method
+        @param arrays a dictionary of arrays, e.g. {'R': R}
+        @param info a dictionary with other information to save
+        """
+        key,desc = key
+        buf = cStringIO.StringIO()
+        numpy.savez(buf,**arrays)
+        data = buf.getvalue()
+        entry = dict(info)
+        entry.update({'key': key, 'desc': desc, 'size': len(data),
+            'used': time.time(), 'created': time.time()})
+        self.fs.write(self._file(key,'npz'),data)
+        self.fs.write(self._file(key,'json'),json.dumps(entry,indent=1))
+        self.evict()
+
+    def entries(self):
+        """ Return the information of each entry, most recently used first. """
+        entries = []
+        for name,size,mtime in self.fs.ls(self.path):
+            if not name.endswith('.json'):
+                continue
+            key = os.path.splitext(os.path.basename(name))[0]
+            info = self._read_info(key)
+            if info is not None and 'key' in info:
+                entries.append(info)
+        entries.sort(key=lambda info: info.get('used',0), reverse=True)
+        return entries
+
+    def remove(self,key):
+        self.fs.rm(self._file(key,'npz'))
+        self.fs.rm(self._file(key,'json'))
+
+    def evict(self,maxsize=None):
+        """ Remove the least recently used entries until the cache has at
+        most maxsize bytes.
+
+        @return the list of removed keys
+        """
+        if maxsize is None:
+            maxsize = self.maxsize
+        total = 0
+        removed = []
+        for info in self.entries():
+            total += info.get('size',0)
+            if total > maxsize:
+                self.remove(info['key'])
+                removed.append(info['key'])
+        return removed
+
+def lookup(path,fs,inputs,kind='R',maxsize=None,**params):
+    """ Look up a factor of a matrix before a job starts.
+
+    @param path the cache directory, None for the default, or 'no'
+    to disable the cache
+    @param fs the file system with the matrix
+    @param inputs the list of paths with the matrix
+    @return a tuple (cache, key, arrays) where arrays is None if the
+    factor isn't cached, and cache and key are None if the cache
+    is disabled.
+    """
+    if path == 'no':
+        return None, None, None
+    cache = RCache(path,maxsize=maxsize)
+    key = cache.key(fs,inputs,kind=kind,**params)
+    if len(key[1]['input']) == 0:
+        # there are no files to fingerprint
+        return None, None, None
+    return cache, key, cache.get(key)
+
+def read_output(fs,path):
+    """ Read the key, value pairs of the sequence files in a path. """
+    pairs = []
+    for name,size,mtime in fs.ls(path):
+        reader = seqfile.Reader(cStringIO.StringIO(fs.cat(name)),arrays=True)
+        pairs.extend(reader)
+    return pairs
+
+def matrix(pairs):
+    """ The matrix with one row in the value of each pair. """
+    return numpy.array([numpy.asarray(value,dtype=float)
+        for key,value in pairs])
+
+def read_matrix(fs,path):
+    """ Read a matrix with one row per record from a sequence file. """
+    return matrix(read_output(fs,path))
+
+def store_at_exit(path,fs,inputs,output,arrays=None,kind='R',**params):
+    """ Store a factor from the output of a job when the driver exits.
+
+    Call this in the driver before the last stage, e.g. from its
+    premapper.  The output of the last stage only exists after the job
+    succeeds, so nothing is stored after a failed job.
+
+    @param path the cache directory, None for the default, or 'no'
+    to disable the cache
+    @param fs the file system with the matrix and the output
+    @param inputs the list of paths with the matrix
+    @param output the output of the last stage
+    @param arrays a function from the pairs of the output to the
+    dictionary of arrays, the default is {'R': matrix(pairs)}
+    """
+    if path == 'no':
+        return
+    if arrays is None:
+        arrays = lambda pairs: {'R': matrix(pairs)}
+    cache = RCache(path)
+    key = cache.key(fs,inputs,kind=kind,**params)
+    if len(key[1]['input']) == 0:
+        return
+    def store():
+        if not fs.exists(output):
+            return
+        try:
+            entry = arrays(read_output(fs,output))
+        except ValueError, msg:
+            print >>sys.stderr, "Warning: cannot cache %s: %s"%(output,msg)
+            return
+        cache.put(key,entry,{'input': ','.join(inputs)})
+        print >>sys.stderr, "Saved the %s of %s in %s"%(kind,
+            ','.join(inputs),cache.path)
+    atexit.register(store)
+
+def write_output(fs,path,pairs):
+    """ Replace the output of a job with a sequence file of pairs. """
+    fd,filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        writer = seqfile.Writer(open(filename,'wb'))
+        writer.write_pairs(pairs)
+        writer.close()
+        fs.rm(path)
+        fs.write(path.rstrip('/')+'/part-00000',open(filename,'rb').read())
+    finally:
+        os.remove(filename)
+
+def write_matrix(fs,path,A):
+    """ Replace the output of a job with the rows of A. """
+    write_output(fs,path,((i,[float(v) for v in row])
+        for i,row in enumerate(A)))
+
+def main(args):
+    maxsize = None
+    if 'rcache_size' in args:
+        maxsize = int(float(args['rcache_size'])*1024*1024)
+    cache = RCache(args.get('rcache',None),maxsize=maxsize)
+    if 'list' in args:
+        for info in cache.entries():
+            print '%s %10i %s %s %s'%(info['key'], info['size'],
+                time.strftime('%Y-%m-%d %H:%M',time.localtime(info['used'])),
+                info['desc']['kind'], info.get('input',''))
+    elif 'evict' in args:
+        for key in cache.evict():
+            print 'removed %s'%(key)
+    elif 'get' in args:
+        arrays = cache.get(args['get'])
+        if arrays is None:
+            print >>sys.stderr, "Error: %s is not in the cache"%(args['get'])
+            sys.exit(1)
+        numpy.savez(args['output'],**arrays)
+    elif 'put' in args:
+        filename = args['put']
+        if filename.endswith('.npz'):
+            npz = numpy.load(filename)
+            arrays = dict((name,npz[name]) for name in npz.files)
+        else:
+            arrays = {'R': numpy.load(filename)}
+        if args.get('hdfs','no') == 'yes':
+            fs = checkpoint.HadoopFS()
+        else:
+            fs = checkpoint.LocalFS()
+        params = {}
+        if args.get('params'):
+            params = dict(p.split('=',1) for p in args['params'].split(','))
+        key = cache.key(fs,[args['mat']],kind=args.get('kind','R'),**params)
+        cache.put(key,arrays,{'input': args['mat']})
+        print key[0]
+    else:
+        print >>sys.stderr, "usage: rcache.py -list|-evict|-get <key>|-put <file>"
+        sys.exit(1)
+
+if __name__=='__main__':
+    main(local_util.get_args(sys.argv[1:]))
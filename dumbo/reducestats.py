@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+
+"""
+reducestats.py
+==============
+
+Measure the input of each reducer and report the skew of the reducers
+of each stage, without dumbo or hadoop.
+
+The mappers of tsqr.py, CholeskyQR.py, and hadoopy/normal.py output
+their rows with random keys, random.randint(0, 4000000000), or a few
+keys, so Hadoop's hash partitioner can give one reducer several times
+the rows of the average reducer.  That reducer sets the time of the
+whole stage.  Each reducer measures its input:
+  keys : the keys, i.e. the calls of the reducer
+  rows : the rows in the values, 1 for a row or the rows of a packed
+    block, see rowblock.py
+  factors : rows/ncols, the number of R factors, or blocks of A'*A,
+    that the reducer merged
+  bytes : the bytes of the values, 8 for each double in a row, or the
+    length of a string, without the framing of typedbytes
+  compressions : the compressions of the task, or null for a task
+    without any
+  secs : the time from the first record to the last output
+
+The option -reducestats of the drivers turns the measurements on:
+
+  -reducestats yes : the default of the dumbo drivers with -hadoop.
+    Each reducer writes _reducestats.<stage>.<task>.json to the output
+    of its stage with one hadoop fs -put, like taskprof.py, and reports
+    the totals as counters.  After each job, the driver prints the skew
+    of the stage.  In the local mode of dumbo, this is
+    -reducestats <output>.reducestats for the output of the job.
+  -reducestats <dir> : the reducers write the files to a local
+    directory on each machine, and the driver prints the report of all
+    the stages in the directory when it exits.
+  -reducestats no : no measurements, the default without -hadoop and
+    of the hadoopy drivers.
+
+The report of a stage lists the total, the mean, the percentiles, and
+the maximum of each measure over the reducers, and the skew max/mean.
+A skew near 1 means the reducers are balanced.  A large skew of rows
+with many reducers means the keys are too few or hash badly, and a
+skew of secs without a skew of rows means a slow node.
+
+Usage
+-----
+
+    python reducestats.py -input <path>[,<path>...] [-hdfs yes] \\
+        [-output <file.json>]
+
+      Print the report of each stage from the files under the paths,
+      e.g. the outputs of all the stages of a job, and write the
+      summaries as json to -output.
+
+History
+-------
+:2011-03-28: Initial coding
+"""
+
+import sys
+import os
+import time
+import json
+import socket
+import posixpath
+
+import numpy
+
+import rowblock
+import checkpoint
+import local_util
+
+MEASURES = ('keys','rows','factors','bytes','compressions','secs')
+PERCENTILES = (50,90,99)
+
+def _task():
+    return os.getenv('mapred_task_id','') or str(os.getpid())
+
+def _innermost(task):
+    """ The task inside the wrappers from util.GlobalOptions.instrument. """
+    while hasattr(task,'task') and hasattr(task,'profiler'):
+        task = task.task
+    return task
+
+class ReduceStats:
+    """ Measure the input of a reducer and save it as a side output.
+
+    @param stage the name of the stage, e.g. tsqr-1-reduce
+    @param dirname a local directory for the file, or '' for the work
+    output directory of the task
+    """
+    def __init__(self,stage,dirname=''):
+        self.stage = stage.replace('.','-')
+        self.dirname = dirname
+        self.nkeys = 0
+        self.nrows = 0
+        self.nbytes = 0
+        # the number of columns of the first row, for a task without
+        # ncols
+        self.width = None
+        self.t0 = None
+        self.saved = False
+
+    def add(self,value):
+        """ Count the rows and the bytes of one value. """
+        if isinstance(value,str):
+            if rowblock.isblock(value):
+                dtype,ncols,nrows = rowblock.header(value)
+                self.nrows += nrows
+                if self.width is None:
+                    self.width = ncols
+            else:
+                self.nrows += 1
+            self.nbytes += len(value)
+        elif isinstance(value,numpy.ndarray):
+            self.nrows += 1 if value.ndim < 2 else value.shape[0]
+            self.nbytes += value.nbytes
+            if self.width is None and value.ndim > 0:
+                self.width = value.shape[-1]
+        elif isinstance(value,(list,tuple)):
+            self.nrows += 1
+            self.nbytes += 8*len(value)
+            if self.width is None:
+                self.width = len(value)
+        else:
+            self.nrows += 1
+            self.nbytes += 8
+
+    def values(self,values):
+        """ Count the values of one key as the reducer reads them. """
+        if self.t0 is None:
+            self.t0 = time.time()
+        self.nkeys += 1
+        for value in values:
+            self.add(value)
+            yield value
+
+    def data(self,data):
+        """ Count the (key, values) pairs of a dumbo reducer. """
+        for key,values in data:
+            yield key, self.values(values)
+
+    def report(self,task=None):
+        """ Return the measurements as a dictionary.
+
+        @param task the reducer, for its ncols and its compressions
+        """
+        task = _innermost(task)
+        ncols = getattr(task,'ncols',None)
+        if not isinstance(ncols,(int,long)) or ncols <= 0:
+            ncols = self.width
+        factors = None
+        if isinstance(ncols,(int,long)) and ncols > 0:
+            factors = float(self.nrows)/ncols
+        ncompress = getattr(task,'ncompress',None)
+        secs = 0.
+        if self.t0 is not None:
+            secs = time.time() - self.t0
+        return {
+            'stage': self.stage,
+            'task': _task(),
+            'host': socket.gethostname(),
+            'ncols': ncols,
+            'keys': self.nkeys,
+            'rows': self.nrows,
+            'factors': factors,
+            'bytes': self.nbytes,
+            'compressions': ncompress,
+            'secs': secs,
+            }
+
+    def save(self,task=None,counter=None):
+        """ Write the measurements once, report the counters, and return
+        the path of the file.
+
+        @param counter a function counter(group, name, value)
+        """
+        if self.saved:
+            return None
+        self.saved = True
+        report = self.report(task)
+        if counter is not None:
+            counter('Reduce input','keys',report['keys'])
+            counter('Reduce input','rows',report['rows'])
+            counter('Reduce input','bytes',report['bytes'])
+        data = json.dumps(report,sort_keys=True)
+        print >>sys.stderr, 'reducestats:', data
+        path = checkpoint.write_task_file(
+            '_reducestats.%s.%s.json'%(self.stage,_task()),data,self.dirname)
+        return path
+
+    def run_iter(self,outputs,task=None,counter=None):
+        """ Save the measurements after the last output of a reducer. """
+        for out in outputs:
+            yield out
+        self.save(task,counter)
+
+def read_stats(fs,paths):
+    """ Read the files of the reducers under a list of paths.
+
+    @return a dictionary from each stage to a list of the reports of
+    its reducers
+    """
+    stages = {}
+    for path in paths:
+        for name,size,mtime in fs.ls(path,hidden=True):
+            base = posixpath.basename(name)
+            if base.startswith('_reducestats.') and base.endswith('.json'):
+                report = json.loads(fs.cat(name))
+                stages.setdefault(report['stage'],[]).append(report)
+    return stages
+
+def summarize(reports):
+    """ Summarize the reports of the reducers of one stage.
+
+    @return a dictionary with the number of reducers and, for each
+    measure, the total, mean, min, percentiles, max, max/mean, and the
+    task with the max
+    """
+    summary = {'reducers': len(reports), 'measures': {}}
+    for measure in MEASURES:
+        pairs = [(r[measure],r['task']) for r in reports
+            if r.get(measure) is not None]
+        if len(pairs) == 0:
+            continue
+        values = numpy.array([v for v,task in pairs],dtype=float)
+        mean = values.mean()
+        imax = int(values.argmax())
+        s = {'total': float(values.sum()), 'mean': float(mean),
+            'min': float(values.min()), 'max': float(values[imax]),
+            'max task': pairs[imax][1]}
+        for p in PERCENTILES:
+            s['p%i'%(p)] = float(numpy.percentile(values,p))
+        if mean > 0:
+            s['skew'] = float(values[imax]/mean)
+        else:
+            s['skew'] = None
+        summary['measures'][measure] = s
+    return summary
+
+def print_summary(stage,summary,out=sys.stdout):
+    print >>out, "=== %s: %i reducers ==="%(stage,summary['reducers'])
+    print >>out, "%-13s %12s %12s %12s %12s %12s %12s %6s"%('measure','total',
+        'mean','p50','p90','p99','max','skew')
+    for measure in MEASURES:
+        if measure not in summary['measures']:
+            continue
+        s = summary['measures'][measure]
+        skew = '-'
+        if s['skew'] is not None:
+            skew = '%.2f'%(s['skew'])
+        print >>out, "%-13s %12.6g %12.6g %12.6g %12.6g %12.6g %12.6g %6s"%(
+            measure, s['total'], s['mean'], s['p50'], s['p90'], s['p99'],
+            s['max'], skew)
+    rows = summary['measures'].get('rows')
+    if rows is not None and rows['max'] > 0:
+        print >>out, "the most rows: %s"%(rows['max task'])
+    print >>out
+
+def report(fs,paths,stage=None,out=sys.stdout):
+    """ Print the summary of each stage under the paths.
+
+    @param stage only report this stage
+    @return a dictionary with the summary of each stage
+    """
+    stages = read_stats(fs,paths)
+    summaries = {}
+    for name in sorted(stages):
+        if stage is not None and name != stage:
+            continue
+        summaries[name] = summarize(stages[name])
+        print_summary(name,summaries[name],out)
+    return summaries
+
+def main(args):
+    if args.get('hdfs','no') == 'yes':
+        fs = checkpoint.HadoopFS()
+    else:
+        fs = checkpoint.LocalFS()
+    paths = args['input'].split(',')
+    summaries = report(fs,paths)
+    if len(summaries) == 0:
+        print "no reducer stats in %s"%(', '.join(paths))
+    if 'output' in args:
+        f = open(args['output'],'w')
+        json.dump(summaries,f,indent=1,sort_keys=True)
+        f.close()
+        local_util.setstatus('wrote %s'%(args['output']))
+
+if __name__=='__main__':
+    args = local_util.get_args(sys.argv[1:])
+    if 'input' not in args:
+        print >>sys.stderr, "Error: -input not specified"
+        sys.exit(1)
+    main(args)
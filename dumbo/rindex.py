@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+"""
+rindex.py
+=========
+
+An index of the R factors of the buckets of rows of a matrix from
+buckettsqr.py, for the R factor of any range of buckets.
+
+The index is a segment tree.  The leaves are the R factors of the
+buckets in order, and each node is the R factor of its two children
+stacked.  The R factor of a range of buckets is the R factor of the
+O(log B) nodes that cover the range stacked, where B is the number of
+buckets, so a query is one small QR factorization.
+
+The index is a directory with
+  tree.npy : the n-by-n R factors of the nodes, node i has children
+    2i and 2i+1 and the leaves start at node size
+  counts.npy : the number of rows under each node
+  buckets.npy : the sorted list of buckets in the leaves
+  index.json : the bucketsize, the number of columns, and size
+and the arrays are memory mapped when the index is opened, so a query
+only reads the nodes it uses.  Buckets without rows between two
+buckets don't have a leaf.
+
+Usage
+-----
+
+    python rindex.py -build <buckettsqr output> -index <dir> [-hdfs yes]
+
+      build the index from the output of buckettsqr.py, a local path or
+      with -hdfs yes, a path in HDFS.
+
+    python rindex.py -index <dir> -first <key> -last <key> \\
+        [-output <file.npy> -solve yes]
+
+      print or save the R factor of the rows with first <= key <= last,
+      rounded out to whole buckets.  With -solve yes, the last column
+      of the matrix is the right hand side b, and the least squares
+      solution of A*x = b is printed, or saved to <output>-x.npy.
+
+History
+-------
+:2011-03-22: Initial coding
+"""
+
+import sys
+import os
+import json
+import cStringIO
+
+import numpy
+import numpy.linalg
+import numpy.lib.format
+
+import checkpoint
+import rowblock
+import seqfile
+import local_util
+
+def read_buckets(fs,path):
+    """ Read the output of buckettsqr.py.
+
+    @return a tuple (bucketsize, buckets, counts, Rs) with the buckets
+    in order
+    """
+    records = {}
+    bucketsize = None
+    for name,size,mtime in fs.ls(path):
+        reader = seqfile.Reader(cStringIO.StringIO(fs.cat(name)))
+        for bucket,(bsize,count,R) in reader:
+            if bucketsize is None:
+                bucketsize = bsize
+            elif bsize != bucketsize:
+                raise ValueError("bucket %i has a bucketsize of %i, not %i"%(
+                    bucket,bsize,bucketsize))
+            if bucket in records:
+                raise ValueError("bucket %i is in the output twice"%(bucket))
+            records[bucket] = (count,rowblock.unpack(str(R)))
+    buckets = sorted(records)
+    return (bucketsize, buckets, [records[b][0] for b in buckets],
+        [records[b][1] for b in buckets])
+
+def _square(R,ncols):
+    """ Pad or compress an R factor to ncols-by-ncols. """
+    if R.shape[0] > ncols:
+        R = numpy.linalg.qr(R,'r')
+    S = numpy.zeros((ncols,ncols))
+    S[:R.shape[0]] = R
+    return S
+
+def build(indexdir,bucketsize,buckets,counts,Rs):
+    """ Build and save the segment tree over the R factors of the buckets. """
+    if len(buckets) == 0:
+        raise ValueError("there are no buckets")
+    ncols = Rs[0].shape[1]
+    size = 1
+    while size < len(buckets):
+        size *= 2
+    if not os.path.isdir(indexdir):
+        os.makedirs(indexdir)
+    tree = numpy.lib.format.open_memmap(os.path.join(indexdir,'tree.npy'),
+        mode='w+',dtype=numpy.float64,shape=(2*size,ncols,ncols))
+    nrows = numpy.zeros(2*size,dtype=numpy.int64)
+    for i,R in enumerate(Rs):
+        tree[size+i] = _square(R,ncols)
+        nrows[size+i] = counts[i]
+    for i in xrange(size-1,0,-1):
+        if nrows[2*i+1] == 0:
+            tree[i] = tree[2*i]
+        else:
+            tree[i] = _square(numpy.vstack((tree[2*i],tree[2*i+1])),ncols)
+        nrows[i] = nrows[2*i] + nrows[2*i+1]
+    tree.flush()
+    del tree
+    numpy.save(os.path.join(indexdir,'counts.npy'),nrows)
+    numpy.save(os.path.join(indexdir,'buckets.npy'),
+        numpy.array(buckets,dtype=numpy.int64))
+    info = {'bucketsize': bucketsize, 'ncols': ncols, 'size': size,
+        'nbuckets': len(buckets)}
+    f = open(os.path.join(indexdir,'index.json'),'w')
+    json.dump(info,f,indent=1)
+    f.close()
+
+class RIndex:
+    """ A segment tree of R factors in a directory from build.
+
+    @param indexdir the directory
+    """
+    def __init__(self,indexdir):
+        info = json.load(open(os.path.join(indexdir,'index.json')))
+        self.bucketsize = info['bucketsize']
+        self.ncols = info['ncols']
+        self.size = info['size']
+        self.tree = numpy.load(os.path.join(indexdir,'tree.npy'),
+            mmap_mode='r')
+        self.counts = numpy.load(os.path.join(indexdir,'counts.npy'),
+            mmap_mode='r')
+        self.buckets = numpy.load(os.path.join(indexdir,'buckets.npy'),
+            mmap_mode='r')
+
+    def nodes(self,lo,hi):
+        """ Return the nodes that cover the leaves lo to hi-1. """
+        nodes = []
+        lo += self.size
+        hi += self.size
+        while lo < hi:
+            if lo & 1:
+                nodes.append(lo)
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                nodes.append(hi)
+            lo >>= 1
+            hi >>= 1
+        return sorted(nodes)
+
+    def query_buckets(self,first,last):
+        """ Compute the R factor of the buckets first to last.
+
+        @return a tuple (R, nrows) with the number of rows in the range
+        """
+        lo = int(numpy.searchsorted(self.buckets,first,'left'))
+        hi = int(numpy.searchsorted(self.buckets,last,'right'))
+        nodes = self.nodes(lo,hi)
+        if len(nodes) == 0:
+            return numpy.zeros((self.ncols,self.ncols)), 0
+        nrows = int(sum(self.counts[i] for i in nodes))
+        if len(nodes) == 1:
+            return numpy.array(self.tree[nodes[0]]), nrows
+        R = numpy.linalg.qr(numpy.vstack([self.tree[i] for i in nodes]),'r')
+        return R, nrows
+
+    def query(self,first,last):
+        """ Compute the R factor of the rows with keys from first to last.
+
+        The range is rounded out to whole buckets.
+
+        @return a tuple (R, nrows)
+        """
+        return self.query_buckets(int(first//self.bucketsize),
+            int(last//self.bucketsize))
+
+    def solve(self,first,last):
+        """ Solve the least squares problem for the rows with keys from
+        first to last, where the last column of the matrix is b.
+
+        @return a tuple (x, R, residual norm, nrows) where R is the R
+        factor of A without b
+        """
+        Rb,nrows = self.query(first,last)
+        n = self.ncols - 1
+        R = Rb[:n,:n]
+        x = numpy.linalg.lstsq(R,Rb[:n,n],rcond=-1)[0]
+        return x, R, abs(Rb[n,n]), nrows
+
+def main(args):
+    if 'build' in args:
+        if args.get('hdfs','no') == 'yes':
+            fs = checkpoint.HadoopFS()
+        else:
+            fs = checkpoint.LocalFS()
+        bucketsize,buckets,counts,Rs = read_buckets(fs,args['build'])
+        local_util.setstatus('building the index of %i buckets'%(len(buckets)))
+        build(args['index'],bucketsize,buckets,counts,Rs)
+        return
+    index = RIndex(args['index'])
+    first = float(args['first'])
+    last = float(args['last'])
+    output = args.get('output',None)
+    if args.get('solve','no') == 'yes':
+        x,R,resid,nrows = index.solve(first,last)
+        if output:
+            numpy.save(output,R)
+            numpy.save(os.path.splitext(output)[0]+'-x.npy',x)
+        else:
+            print "x =", x
+        local_util.setstatus('%i rows, residual norm %g'%(nrows,resid))
+    else:
+        R,nrows = index.query(first,last)
+        if output:
+            numpy.save(output,R)
+        else:
+            print R
+        local_util.setstatus('%i rows'%(nrows))
+
+if __name__=='__main__':
+    args = local_util.get_args(sys.argv[1:])
+    if 'index' not in args:
+        print >>sys.stderr, "Error: -index not specified"
+        sys.exit(1)
+    main(args)
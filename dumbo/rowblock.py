@@ -0,0 +1,117 @@
+"""
+rowblock.py
+===========
+
+A packed format for a block of rows of a matrix.
+
+Our matrices are usually stored with one row per record.  A row block
+stores k consecutive rows of the matrix in a single record instead.
+The key is the offset of the first row in the matrix, an integer, so
+the row i of the block is the row key+i.  When the row offset isn't
+known, e.g. for a block of lines of a text file, where a mapper only
+knows the byte offsets of its split, the key is a tuple instead, see
+tuple_key, and never an integer.  The value is a byte string with a
+small header followed by the packed entries.
+
+The header has 8 bytes:
+  bytes 0-1 : the magic string 'RB'
+  byte 2 : the type of each entry, 'd' for double or 'f' for float
+  byte 3 : the version of the format, currently 1
+  bytes 4-7 : the number of columns as a little-endian uint32
+The entries follow in row-major order as little-endian values, so the
+number of rows is determined by the length of the value.  This module
+doesn't depend on dumbo or hadoop, so it's used by the local tools too.
+
+History
+-------
+:2011-03-14: Initial coding
+"""
+
+import struct
+
+import numpy
+
+magic = 'RB'
+version = 1
+headersize = 8
+
+dtypes = {'d': numpy.dtype('<f8'), 'f': numpy.dtype('<f4')}
+
+def pack(block,dtype='d'):
+    """ Pack a 2d array into a row block value.
+
+    @param block the array with one row of the matrix per row
+    @param dtype the type code for the entries, 'd' or 'f'
+    """
+    block = numpy.asarray(block,dtype=dtypes[dtype])
+    if block.ndim == 1:
+        block = block.reshape(1,len(block))
+    header = struct.pack('<2scBI',magic,dtype,version,block.shape[1])
+    return header + numpy.ascontiguousarray(block).tostring()
+
+def isblock(value):
+    """ Test if a value from a record is a packed row block. """
+    return (isinstance(value,str) and len(value) >= headersize and
+        value[0:2] == magic)
+
+def header(value):
+    """ Return the (dtype, ncols, nrows) information for a row block. """
+    if not isblock(value):
+        raise ValueError("the value is not a packed row block")
+    (m,dtype,ver,ncols) = struct.unpack('<2scBI',value[0:headersize])
+    if ver != version:
+        raise ValueError("unknown row block version %i"%(ver))
+    if dtype not in dtypes:
+        raise ValueError("unknown row block entry type %s"%(dtype))
+    nbytes = len(value) - headersize
+    rowbytes = dtypes[dtype].itemsize*ncols
+    if ncols == 0 or nbytes%rowbytes != 0:
+        raise ValueError(
+            "row block with %i bytes is not a multiple of %i columns"%(
+                nbytes, ncols))
+    return dtype, ncols, nbytes/rowbytes
+
+def unpack(value):
+    """ Return the rows of a row block as a read-only 2d array.
+
+    The array uses the memory of the value, so there is no copy.
+    """
+    dtype,ncols,nrows = header(value)
+    block = numpy.frombuffer(value,dtype=dtypes[dtype],offset=headersize)
+    return block.reshape(nrows,ncols)
+
+def blocks(A,nrows,offset=0,dtype='d'):
+    """ Split the rows of a matrix into packed row blocks.
+
+    @param A the 2d array with the rows
+    @param nrows the number of rows in each block, the last block
+    may have fewer rows.
+    @param offset the index of the first row of A in the full matrix.
+    @return an iterator over (rowoffset, value) pairs
+    """
+    for start in xrange(0,A.shape[0],nrows):
+        yield offset+start, pack(A[start:start+nrows],dtype)
+
+def tuple_key(key):
+    """ The key of a block whose row offset isn't known, e.g. the tuple
+    (byte offset,) for the first line of a block of text. """
+    return (key,)
+
+def row_offset(key):
+    """ Return the row offset of a block with the key, or raise a
+    ValueError if the key is not a row offset, see tuple_key. """
+    if not isinstance(key,(int,long)):
+        raise ValueError(
+            "the block key %s is not a row offset, see rowblock.py"%(
+                str(key)))
+    return key
+
+def row_keys(key,nrows):
+    """ Return the keys of the rows of a block: key+i for a row offset,
+    key+(i,) for a tuple key, e.g. (byte offset, i) for a block of text,
+    and (key, i) otherwise. """
+    if isinstance(key,(int,long)):
+        return [key+i for i in xrange(nrows)]
+    if isinstance(key,(tuple,list)):
+        return [tuple(key)+(i,) for i in xrange(nrows)]
+    return [(key,i) for i in xrange(nrows)]
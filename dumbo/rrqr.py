@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""
+rrqr.py
+=======
+
+A rank-revealing QR factorization with column pivoting of a small R
+factor, without dumbo or hadoop.
+
+For a matrix with redundant columns, the R factor from TSQR is nearly
+singular.  The QR factorization with column pivoting of R,
+  R*P = Q*[R11 R12; 0 R22],
+puts the independent columns first, and the numerical rank r is the
+number of diagonal entries of R11 with
+  |R11(k,k)| > tol*|R11(1,1)|.
+The default tol is max(m,n)*eps for the m rows of A.  R alone doesn't
+know m, so pass m to the functions here: with n*eps, the rounding
+errors of a tall A, about sqrt(m)*eps relative to the norm, make a
+dependent column look independent.  R11 is the R factor of the r
+independent columns A(:,columns(1:r)), and up to the entries of R22,
+  A = A(:,columns(1:r))*inv(R11)*[R11 R12]*P',
+so a pass over A only needs the r independent columns, see svd.py.
+
+This uses scipy.linalg.qr with pivoting, the LAPACK routine dgeqp3,
+if scipy is installed, and otherwise a Householder QR with column
+pivoting in NumPy.
+
+History
+-------
+:2011-03-23: Initial coding
+"""
+
+import numpy
+import numpy.linalg
+
+try:
+    import scipy.linalg
+except ImportError:
+    scipy = None
+
+def _householder_qrp(A):
+    """ Compute the R factor and the column permutation of the QR
+    factorization with column pivoting of A in NumPy. """
+    A = numpy.array(A,dtype=float)
+    m,n = A.shape
+    perm = numpy.arange(n)
+    norms = (A*A).sum(axis=0)
+    for j in xrange(min(m,n)):
+        p = j + int(numpy.argmax(norms[j:]))
+        if p != j:
+            A[:,[j,p]] = A[:,[p,j]]
+            perm[[j,p]] = perm[[p,j]]
+            norms[[j,p]] = norms[[p,j]]
+        alpha = numpy.linalg.norm(A[j:,j])
+        if alpha == 0.:
+            # the other columns are zero too
+            break
+        v = A[j:,j].copy()
+        if v[0] < 0:
+            alpha = -alpha
+        v[0] += alpha
+        v /= numpy.linalg.norm(v)
+        A[j:,j:] -= 2.*numpy.outer(v,numpy.dot(v,A[j:,j:]))
+        # recompute the norms instead of downdating them, since the
+        # downdate loses accuracy for the columns we want to find
+        norms[j+1:] = (A[j+1:,j+1:]**2).sum(axis=0)
+    return numpy.triu(A[:min(m,n)]), perm
+
+def qrp(A):
+    """ Compute the QR factorization with column pivoting of A.
+
+    @return a tuple (R, perm) with A[:,perm] = Q*R
+    """
+    A = numpy.asarray(A,dtype=float)
+    if scipy is not None:
+        R,perm = scipy.linalg.qr(A,mode='r',pivoting=True)
+        return R[:min(A.shape)], perm
+    return _householder_qrp(A)
+
+def default_tol(R,m=None):
+    """ The default tolerance max(m,n)*eps for an R factor of an m-by-n
+    matrix.  Without m, this is max(R.shape)*eps, e.g. for a small A
+    itself. """
+    n = max(R.shape)
+    if m is not None:
+        n = max(n,m)
+    return n*numpy.finfo(float).eps
+
+def rank(R,tol=None,m=None):
+    """ The numerical rank from the diagonal of a pivoted R factor.
+
+    @param m the number of rows of A for the default tol
+    """
+    if R.shape[0] == 0:
+        return 0
+    if tol is None:
+        tol = default_tol(R,m)
+    d = numpy.abs(numpy.diag(R))
+    if d[0] == 0.:
+        return 0
+    return int(numpy.sum(d > tol*d[0]))
+
+def rrqr(R,tol=None,m=None):
+    """ Compute the rank-revealing factorization of an R factor.
+
+    @param R the R factor, or any matrix
+    @param tol the relative tolerance for the rank, see the module
+    @param m the number of rows of A for the default tol
+    @return a tuple (Rp, columns, r) where Rp is the first r rows of
+    the pivoted R factor, columns is the permutation of the columns
+    with the r independent columns first, and r is the numerical rank
+    """
+    Rp,columns = qrp(R)
+    r = rank(Rp,tol,m)
+    return Rp[:r], columns, r
+
+def left_factor(R,tol=None,m=None):
+    """ The left singular vectors from the independent columns.
+
+    @param m the number of rows of A for the default tol
+
+    @return a tuple (columns, M, S, V) with the r independent columns
+    and an r-by-r matrix M, such that U = A(:,columns)*M are the left
+    singular vectors of A for the singular values S and the right
+    singular vectors V.
+    """
+    Rp,columns,r = rrqr(R,tol,m)
+    n = R.shape[1]
+    # the singular vectors of [R11 R12]*P' are those of R
+    Rr = numpy.zeros((r,n))
+    Rr[:,columns] = Rp
+    Ur,S,Vt = numpy.linalg.svd(Rr,full_matrices=False)
+    M = numpy.linalg.solve(Rp[:,:r],Ur)
+    return columns[:r], M, S, Vt.T
+
+def lstsq(R,y,tol=None,m=None):
+    """ Solve min ||R*x - y|| for the basic solution on the independent
+    columns.
+
+    The entries of x for the other columns are zero.
+
+    @param m the number of rows of A for the default tol
+
+    @return a tuple (x, r) with the numerical rank r
+    """
+    R = numpy.asarray(R,dtype=float)
+    Rp,columns,r = rrqr(R,tol,m)
+    Q,R11 = numpy.linalg.qr(R[:,columns[:r]])
+    x = numpy.zeros(R.shape[1])
+    x[columns[:r]] = numpy.linalg.solve(R11,numpy.dot(Q.T,y))
+    return x, r
@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+
+"""
+seqfile.py
+==========
+
+Read and write Hadoop sequence files without Hadoop.
+
+The output of our jobs is a directory of sequence files where the keys
+and values are typed bytes (org.apache.hadoop.typedbytes.TypedBytesWritable).
+With mapred.output.compress=true, the files are record or block
+compressed, usually with the zlib codec (DefaultCodec).  This module
+reads uncompressed, record compressed, and block compressed files with
+the zlib or gzip codecs, and it writes files in the same format that
+Hadoop reads.  Other codecs, like LZO, are not supported.
+
+Copy the output of a job to the local machine with
+    hadoop fs -get tsqr/verytiny-qrr.mseq .
+and then the converters, like check_test_problem.py and pca_svd.py,
+read it without starting a JVM.
+
+Usage
+-----
+
+    python seqfile.py -dump <path>
+
+      print the key, value pairs in a sequence file, or in all the
+      part files in a directory, like dumbo cat
+
+History
+-------
+:2011-03-16: Initial coding
+"""
+
+import sys
+import os
+import struct
+import zlib
+import hashlib
+import time
+
+import tbio
+import local_util
+
+magic = 'SEQ'
+version = 6
+synclen = 16
+syncinterval = 100*(4+synclen)
+
+typedbytes_class = 'org.apache.hadoop.typedbytes.TypedBytesWritable'
+
+codecs = {
+    'org.apache.hadoop.io.compress.DefaultCodec': zlib.MAX_WBITS,
+    'org.apache.hadoop.io.compress.DeflateCodec': zlib.MAX_WBITS,
+    'org.apache.hadoop.io.compress.GzipCodec': 16+zlib.MAX_WBITS,
+}
+
+default_codec = 'org.apache.hadoop.io.compress.DefaultCodec'
+
+def encode_vint(i):
+    """ Encode an integer like WritableUtils.writeVLong """
+    if -112 <= i <= 127:
+        return struct.pack('>b',i)
+    length = -112
+    if i < 0:
+        i = ~i
+        length = -120
+    tmp = i
+    while tmp != 0:
+        tmp >>= 8
+        length -= 1
+    parts = [struct.pack('>b',length)]
+    if length < -120:
+        length = -(length + 120)
+    else:
+        length = -(length + 112)
+    for idx in xrange(length,0,-1):
+        parts.append(chr((i >> ((idx-1)*8)) & 0xff))
+    return ''.join(parts)
+
+def decode_vint(buf,pos):
+    """ Decode an integer like WritableUtils.readVLong
+
+    @return a tuple (value, pos) with the position after the integer
+    """
+    first = struct.unpack_from('>b',buf,pos)[0]
+    if first >= -112:
+        return first, pos+1
+    if first < -120:
+        length = -119 - first
+    else:
+        length = -111 - first
+    i = 0
+    for c in buf[pos+1:pos+length]:
+        i = (i << 8) | ord(c)
+    if first < -120:
+        i = ~i
+    return i, pos+length
+
+def _decompressor(codec):
+    if codec not in codecs:
+        raise ValueError("the codec %s is not supported"%(codec))
+    wbits = codecs[codec]
+    return lambda data: zlib.decompress(data,wbits)
+
+def _compressor(codec):
+    if codec not in codecs:
+        raise ValueError("the codec %s is not supported"%(codec))
+    wbits = codecs[codec]
+    def compress(data):
+        c = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,zlib.DEFLATED,wbits)
+        return c.compress(data) + c.flush()
+    return compress
+
+def _deserializer(classname,arrays):
+    """ Return a function to decode the bytes of a key or value. """
+    if classname == typedbytes_class:
+        reader = tbio.Reader(None,arrays)
+        return lambda data: reader.decode(data[4:])
+    elif classname == 'org.apache.hadoop.io.BytesWritable':
+        return lambda data: data[4:]
+    elif classname == 'org.apache.hadoop.io.Text':
+        return lambda data: data[decode_vint(data,0)[1]:]
+    elif classname == 'org.apache.hadoop.io.LongWritable':
+        return lambda data: struct.unpack('>q',data)[0]
+    elif classname == 'org.apache.hadoop.io.IntWritable':
+        return lambda data: struct.unpack('>i',data)[0]
+    elif classname == 'org.apache.hadoop.io.NullWritable':
+        return lambda data: None
+    else:
+        raise ValueError("the class %s is not supported"%(classname))
+
+class Reader:
+    """ Read the records of a sequence file.
+
+    The keys and values are decoded from typed bytes by default,
+    see tbio.py.  With arrays=True, lists of doubles are decoded
+    into NumPy arrays.
+    """
+    def __init__(self,file,arrays=False):
+        self.file = file
+        self.arrays = arrays
+        self._read_header()
+
+    def _read(self,nbytes):
+        data = self.file.read(nbytes)
+        if len(data) != nbytes:
+            raise ValueError("the sequence file is truncated")
+        return data
+
+    def _read_int(self):
+        return struct.unpack('>i',self._read(4))[0]
+
+    def _read_vint(self):
+        first = self._read(1)
+        value = struct.unpack('>b',first)[0]
+        if value >= -112:
+            return value
+        if value < -120:
+            length = -119 - value
+        else:
+            length = -111 - value
+        return decode_vint(first + self._read(length-1),0)[0]
+
+    def _read_text(self):
+        return self._read(self._read_vint())
+
+    def _read_header(self):
+        header = self._read(4)
+        if header[0:3] != magic:
+            raise ValueError("the file is not a sequence file")
+        self.version = ord(header[3])
+        if self.version < 4:
+            raise ValueError("sequence file version %i is not supported"%(
+                self.version))
+        self.keyclass = self._read_text()
+        self.valueclass = self._read_text()
+        self.compressed = ord(self._read(1)) != 0
+        self.blockcompressed = ord(self._read(1)) != 0
+        self.codec = default_codec
+        if self.compressed and self.version >= 5:
+            self.codec = self._read_text()
+        self.metadata = {}
+        if self.version >= 6:
+            for i in xrange(self._read_int()):
+                key = self._read_text()
+                self.metadata[key] = self._read_text()
+        self.sync = self._read(synclen)
+
+        if self.compressed:
+            self.decompress = _decompressor(self.codec)
+        self.key = _deserializer(self.keyclass,False)
+        self.value = _deserializer(self.valueclass,self.arrays)
+
+    def _check_sync(self):
+        if self._read(synclen) != self.sync:
+            raise ValueError("the sequence file has a bad sync marker")
+
+    def raw_records(self):
+        """ Iterate over the serialized bytes of each key and value """
+        if self.blockcompressed:
+            for record in self._raw_blocks():
+                yield record
+            return
+        while True:
+            data = self.file.read(4)
+            if len(data) == 0:
+                return
+            if len(data) != 4:
+                raise ValueError("the sequence file is truncated")
+            reclen = struct.unpack('>i',data)[0]
+            if reclen == -1:
+                self._check_sync()
+                continue
+            keylen = self._read_int()
+            key = self._read(keylen)
+            value = self._read(reclen - keylen)
+            if self.compressed:
+                value = self.decompress(value)
+            yield key, value
+
+    def _raw_blocks(self):
+        while True:
+            data = self.file.read(4)
+            if len(data) == 0:
+                return
+            if len(data) != 4 or struct.unpack('>i',data)[0] != -1:
+                raise ValueError("the sequence file has a bad block")
+            self._check_sync()
+            nrecords = self._read_vint()
+            buffers = []
+            for i in xrange(4):
+                buffers.append(self.decompress(self._read_text()))
+            keylens,keys,valuelens,values = buffers
+            kpos,kstart,vpos,vstart = 0,0,0,0
+            for i in xrange(nrecords):
+                keylen,kpos = decode_vint(keylens,kpos)
+                valuelen,vpos = decode_vint(valuelens,vpos)
+                yield (keys[kstart:kstart+keylen],
+                    values[vstart:vstart+valuelen])
+                kstart += keylen
+                vstart += valuelen
+
+    def __iter__(self):
+        for key,value in self.raw_records():
+            yield self.key(key), self.value(value)
+
+def part_files(path):
+    """ Return the sorted list of part files in a directory of job output,
+    or [path] if path is a file. """
+    if not os.path.isdir(path):
+        return [path]
+    files = []
+    for name in sorted(os.listdir(path)):
+        filename = os.path.join(path,name)
+        if name.startswith('_') or name.startswith('.'):
+            continue
+        if os.path.isfile(filename):
+            files.append(filename)
+    return files
+
+def pairs(path,arrays=False):
+    """ Iterate over the key, value pairs in a sequence file, or in all
+    the part files in a directory. """
+    for filename in part_files(path):
+        file = open(filename,'rb')
+        for key,value in Reader(file,arrays):
+            yield key, value
+        file.close()
+
+class Writer:
+    """ Write key, value pairs of typed bytes to a sequence file.
+
+    The file is written like SequenceFile.Writer in Hadoop, so Hadoop
+    reads it as the input to a job.
+    """
+    def __init__(self,file,compress='block',codec=default_codec,
+            blocksize=1000000,metadata={}):
+        """
+        @param compress 'none', 'record' or 'block'
+        @param codec the compression codec, the zlib codec is the default
+        @param blocksize the number of bytes of keys and values in
+        each compressed block
+        """
+        if compress not in ('none','record','block'):
+            raise ValueError("unknown compression %s"%(compress))
+        self.file = file
+        self.compress = compress
+        self.blocksize = blocksize
+        self.sync = hashlib.md5('%s@%f'%(id(self),time.time())).digest()
+        self.nbytes = 0
+        self.lastsync = 0
+        self.block = []
+        self.blockbytes = 0
+
+        header = [magic, chr(version), self._text(typedbytes_class),
+            self._text(typedbytes_class),
+            chr(compress != 'none'), chr(compress == 'block')]
+        if compress != 'none':
+            header.append(self._text(codec))
+            self.compressor = _compressor(codec)
+        header.append(struct.pack('>i',len(metadata)))
+        for key,value in sorted(metadata.items()):
+            header.append(self._text(key))
+            header.append(self._text(value))
+        header.append(self.sync)
+        self._write(''.join(header))
+
+    def _text(self,s):
+        return encode_vint(len(s)) + s
+
+    def _write(self,data):
+        self.file.write(data)
+        self.nbytes += len(data)
+
+    def _write_sync(self):
+        self._write(struct.pack('>i',-1) + self.sync)
+        self.lastsync = self.nbytes
+
+    def write_raw(self,key,value):
+        """ Write a key, value pair of typed bytes strings """
+        key = struct.pack('>i',len(key)) + key
+        value = struct.pack('>i',len(value)) + value
+        if self.compress == 'block':
+            self.block.append((key,value))
+            self.blockbytes += len(key) + len(value)
+            if self.blockbytes >= self.blocksize:
+                self._write_block()
+            return
+        if self.nbytes >= self.lastsync + syncinterval:
+            self._write_sync()
+        if self.compress == 'record':
+            value = self.compressor(value)
+        self._write(struct.pack('>ii',len(key)+len(value),len(key)) +
+            key + value)
+
+    def _write_block(self):
+        if len(self.block) == 0:
+            return
+        self._write_sync()
+        keys = [key for key,value in self.block]
+        values = [value for key,value in self.block]
+        parts = [encode_vint(len(self.block))]
+        for buffer in (''.join([encode_vint(len(k)) for k in keys]),
+                ''.join(keys),
+                ''.join([encode_vint(len(v)) for v in values]),
+                ''.join(values)):
+            parts.append(self._text(self.compressor(buffer)))
+        self._write(''.join(parts))
+        self.block = []
+        self.blockbytes = 0
+
+    def write_pair(self,key,value):
+        self.write_raw(tbio.encode(key),tbio.encode(value))
+
+    def write_pairs(self,pairs):
+        for key,value in pairs:
+            self.write_pair(key,value)
+
+    def close(self):
+        if self.compress == 'block':
+            self._write_block()
+        self.file.close()
+
+def convert(script,converter,path,argv):
+    """ Run a dumbo Converter on the output of a job.
+
+    If path is a local file or directory, then the converter reads it
+    with this module.  Otherwise, the converter runs with dumbo convert
+    on the path in HDFS.
+
+    @param script the file with the converter, i.e. __file__
+    @param converter the Converter class
+    @param path the path with the output
+    @param argv the options for the converter
+    """
+    if os.path.exists(path):
+        opts = local_util.get_args(argv).items()
+        converter(opts)(pairs(path,arrays=True))
+    else:
+        import dumbo.cmd
+        import dumbo.util
+        dumbo.cmd.convert(script, path, dumbo.util.parseargs(argv))
+
+def dump(path):
+    for key,value in pairs(path):
+        print '%s\t%s'%(repr(key),repr(value))
+
+if __name__=='__main__':
+    args = local_util.get_args(sys.argv[1:])
+    if 'dump' not in args or args['dump'] is None:
+        print >>sys.stderr, "usage: seqfile.py -dump <path>"
+        sys.exit(1)
+    dump(args['dump'])
@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+
+"""
+streamls.py
+===========
+
+Fit a least squares regression to the latest rows of an unbounded
+stream of rows, without Hadoop.
+
+Each row of the stream is [a, b], where the last entry b is the
+response.  The rows arrive as typed bytes pairs (see tbio.py) from a
+pipe or a socket, and each value is a row as a list of doubles or a
+packed block of rows (see rowblock.py).  The keys are ignored.
+
+The program keeps the R factor of the matrix [A b] of the latest rows.
+The first n entries of its last column are Q'*b, so the coefficients
+are x = R(1:n,1:n) \\ Q'*b, and the last diagonal entry is the norm of
+the residual.  The rows are read in blocks of the rows that have
+arrived, at most blocksize rows, and each block updates R with one QR
+factorization of R stacked on the block.  So the time for each update
+only depends on the number of columns and the size of the block, not
+on the number of rows so far.
+
+There are two ways to forget old rows:
+
+  -forget <lambda> : exponential forgetting.  Each new row scales the
+    weight of the older rows by lambda, so the R factor is for the
+    rows weighted by sqrt(lambda^age).
+
+  -window <nrows> : a sliding window of the last nrows rows.  The
+    window keeps the rows, and when rows leave the window, R is
+    downdated by a block downdate: with R'*W = X' for the rows X that
+    leave, the new R factor is chol(I - W'*W)*R.  This fails when
+    the rows that leave are most of the window, and then R is
+    recomputed from the rows in the window.  R is also recomputed
+    every -refresh downdates to remove the rounding errors of the
+    downdates.
+
+Snapshots of the coefficients are printed, or written to a file, every
+-snapshot_rows rows or -snapshot_secs seconds.  The time snapshots go
+on while no rows arrive, so a reader of the snapshots can tell that the
+program is alive.
+
+Usage
+-----
+
+    python streamls.py [-input <file>|-listen <host:port>|-connect <host:port>] \\
+        [-forget <lambda> | -window <nrows> -refresh <int>] \\
+        [-blocksize <int> -snapshot <file> -snapshot_rows <int> \\
+         -snapshot_secs <float>]
+
+      -input <file> : read the stream from a file or a pipe, the default
+        is stdin.
+
+      -listen <host:port> : accept one connection and read the stream
+        from it.
+
+      -connect <host:port> : read the stream from a server.
+
+      -blocksize <int> : the largest number of rows in each update.
+        The default is 1000.
+
+      -snapshot <file> : write each snapshot to the file as json,
+        by writing a new file and renaming it.  The default is to
+        print each snapshot.
+
+    python streamls.py -produce -ncols <int> [-nrows <int> -rate <rows/sec> \\
+        -blocksize <int> -noise <float> -seed <int>]
+
+      Write a stream of random rows as typed bytes to stdout, so a
+      producer is just a pipe, e.g.
+
+        python streamls.py -produce -ncols 10 -rate 10000 | \\
+            python streamls.py -window 100000
+
+      The rows are written in packed blocks of -blocksize rows, and
+      with -blocksize 1, as one list of doubles per row.  The default
+      of -nrows is to write rows until the pipe is closed.
+
+History
+-------
+:2011-03-21: Initial coding
+"""
+
+import sys
+import os
+import time
+import json
+import socket
+import select
+import collections
+
+import numpy
+import numpy.linalg
+
+import tbio
+import rowblock
+import local_util
+
+class StreamLS:
+    """ The R factor of the rows [A b] of a stream.
+
+    @param forget the exponential forgetting factor, 1 keeps all rows
+    @param window the number of rows in the sliding window, or None
+    for no window
+    @param refresh recompute R from the window after this many downdates
+    """
+    def __init__(self,forget=1.,window=None,refresh=100):
+        if not 0. < forget <= 1.:
+            raise ValueError("the forgetting factor must be in (0,1]")
+        if window is not None and forget != 1.:
+            raise ValueError("use a window or a forgetting factor, not both")
+        self.forget = forget
+        self.window = window
+        self.refresh = refresh
+        self.R = None
+        self.ncols = None
+        self.nrows = 0      # the number of rows so far
+        self.nwindow = 0    # the number of rows in the window
+        self.blocks = collections.deque()
+        self.ndowndates = 0
+        self.nrecomputes = 0
+        self.nupdates = 0
+        self.update_time = 0.
+        self.max_update_time = 0.
+
+    def update(self,block):
+        """ Add a 2d array of rows to the stream. """
+        t0 = time.time()
+        block = numpy.array(block,dtype=float,ndmin=2)
+        if self.ncols is None:
+            if block.shape[1] < 2:
+                raise ValueError("each row needs a response and a column")
+            self.ncols = block.shape[1]
+            self.R = numpy.zeros((0,self.ncols))
+        elif block.shape[1] != self.ncols:
+            raise ValueError("a row with %i cols but row 1 had %i cols"%(
+                block.shape[1], self.ncols))
+        k = block.shape[0]
+        if k == 0:
+            return
+        if self.forget < 1.:
+            # the weight of row i of the block is sqrt(forget^(k-1-i))
+            w = numpy.sqrt(self.forget)**numpy.arange(k-1,-1,-1)
+            parts = [numpy.sqrt(self.forget)**k*self.R, block*w[:,numpy.newaxis]]
+        else:
+            parts = [self.R, block]
+        self.R = numpy.linalg.qr(numpy.vstack(parts),'r')
+        self.nrows += k
+        if self.window is not None:
+            self.blocks.append(block)
+            self.nwindow += k
+            self._slide()
+        dt = time.time() - t0
+        self.nupdates += 1
+        self.update_time += dt
+        self.max_update_time = max(self.max_update_time,dt)
+
+    def _slide(self):
+        """ Remove the rows that left the window from R. """
+        old = []
+        while self.nwindow > self.window:
+            first = self.blocks[0]
+            extra = self.nwindow - self.window
+            if first.shape[0] <= extra:
+                old.append(self.blocks.popleft())
+            else:
+                old.append(first[:extra])
+                self.blocks[0] = first[extra:]
+            self.nwindow -= old[-1].shape[0]
+        if len(old) == 0:
+            return
+        if self.ndowndates >= self.refresh or not self._downdate(numpy.vstack(old)):
+            self._recompute()
+
+    def _downdate(self,X):
+        """ Remove the rows X from R.
+
+        @return False if R is singular or the downdate fails
+        """
+        n = self.ncols
+        if self.R.shape[0] < n:
+            return False
+        d = numpy.abs(numpy.diag(self.R))
+        if d.min() <= n*numpy.finfo(float).eps*d.max():
+            return False
+        W = numpy.linalg.solve(self.R.T,X.T)
+        try:
+            C = numpy.linalg.cholesky(numpy.eye(n) - numpy.dot(W,W.T))
+        except numpy.linalg.LinAlgError:
+            return False
+        self.R = numpy.dot(C.T,self.R)
+        self.ndowndates += 1
+        return True
+
+    def _recompute(self):
+        """ Compute R from the rows in the window. """
+        self.R = numpy.linalg.qr(numpy.vstack(self.blocks),'r')
+        self.ndowndates = 0
+        self.nrecomputes += 1
+
+    def coefficients(self):
+        """ Return the coefficients x and the norm of the residual. """
+        if self.R is None or self.R.shape[0] == 0:
+            return None, None
+        n = self.ncols - 1
+        R = self.R[:n,:n]
+        QTb = self.R[:n,n]
+        x = numpy.linalg.lstsq(R,QTb,rcond=-1)[0]
+        if self.R.shape[0] > n:
+            resid = abs(self.R[n,n])
+        else:
+            resid = 0.
+        return x, resid
+
+    def snapshot(self):
+        """ Return a dictionary with the coefficients and statistics. """
+        x,resid = self.coefficients()
+        snap = {
+            'time': time.time(),
+            'rows': self.nrows,
+            'updates': self.nupdates,
+            'mean update msecs': 1000.*self.update_time/max(self.nupdates,1),
+            'max update msecs': 1000.*self.max_update_time,
+        }
+        if x is not None:
+            snap['coefficients'] = [float(v) for v in x]
+            snap['residual norm'] = float(resid)
+        if self.window is not None:
+            snap['window rows'] = self.nwindow
+            snap['recomputes'] = self.nrecomputes
+        else:
+            snap['forget'] = self.forget
+        return snap
+
+class StreamFile:
+    """ Read the bytes that have arrived on a pipe or a socket.
+
+    The read of a file object waits until it has all the bytes, so
+    the reader would wait for a full chunk before it decodes a row.
+    The read here returns as soon as some bytes have arrived.
+    """
+    def __init__(self,file=None,sock=None):
+        self.file = file
+        self.sock = sock
+
+    def fileno(self):
+        if self.sock is not None:
+            return self.sock.fileno()
+        return self.file.fileno()
+
+    def read(self,nbytes):
+        if self.sock is not None:
+            return self.sock.recv(nbytes)
+        return os.read(self.file.fileno(),nbytes)
+
+    def wait(self,timeout):
+        """ Wait for bytes, or the end of the stream, to arrive.
+
+        @return False if nothing arrived in timeout seconds
+        """
+        ready = select.select([self],[],[],timeout)[0]
+        return len(ready) > 0
+
+def _address(hostport):
+    host,port = hostport.rsplit(':',1)
+    return host, int(port)
+
+def open_stream(args):
+    """ Open the input stream from the command line arguments. """
+    if 'listen' in args:
+        server = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+        server.bind(_address(args['listen']))
+        server.listen(1)
+        local_util.setstatus('listening on %s'%(args['listen']))
+        sock,addr = server.accept()
+        server.close()
+        return StreamFile(sock=sock)
+    elif 'connect' in args:
+        sock = socket.create_connection(_address(args['connect']))
+        return StreamFile(sock=sock)
+    elif 'input' in args:
+        return StreamFile(open(args['input'],'rb'))
+    return StreamFile(sys.stdin)
+
+def arrivals(reader,blocksize=1000,timeout=None):
+    """ Iterate over blocks of the rows that have arrived.
+
+    A block ends after blocksize rows, or when the rows in the buffer
+    of the reader run out, so a block never waits for more rows.
+
+    @param timeout if not None, the file of the reader is a StreamFile,
+    and None is yielded each time no rows arrive for timeout seconds
+    @return an iterator over 2d arrays of rows
+    """
+    rows = []
+    nrows = 0
+    pairs = reader.pairs()
+    while True:
+        if timeout is not None and reader.pos == len(reader.buf) and \
+                not reader.eof and not reader.file.wait(timeout):
+            yield None
+            continue
+        try:
+            key,value = pairs.next()
+        except StopIteration:
+            break
+        if rowblock.isblock(value):
+            block = rowblock.unpack(value)
+        else:
+            block = numpy.array(value,dtype=float,ndmin=2)
+        rows.append(block)
+        nrows += block.shape[0]
+        if nrows >= blocksize or reader.pos == len(reader.buf):
+            yield numpy.vstack(rows)
+            rows = []
+            nrows = 0
+    if nrows > 0:
+        yield numpy.vstack(rows)
+
+def publish(snap,filename=None):
+    """ Print a snapshot, or write it to a file and rename it. """
+    if filename is None:
+        print json.dumps(snap,sort_keys=True)
+        sys.stdout.flush()
+        return
+    tmpname = filename + '.tmp'
+    f = open(tmpname,'w')
+    json.dump(snap,f,sort_keys=True,indent=1)
+    f.close()
+    os.rename(tmpname,filename)
+
+def produce(args,out=sys.stdout):
+    """ Write random rows [A b] with b = A*x + noise as typed bytes. """
+    ncols = int(args['ncols'])
+    nrows = args.get('nrows',None)
+    if nrows is not None:
+        nrows = int(nrows)
+    rate = float(args.get('rate',0))
+    blocksize = int(args.get('blocksize',100))
+    noise = float(args.get('noise',0.1))
+    rng = numpy.random.RandomState(int(args.get('seed',0)))
+    x = rng.randn(ncols)
+    local_util.setstatus('producing rows with coefficients %s'%(x))
+    writer = tbio.Writer(out)
+    nwritten = 0
+    t0 = time.time()
+    try:
+        while nrows is None or nwritten < nrows:
+            k = blocksize
+            if nrows is not None:
+                k = min(k,nrows-nwritten)
+            A = rng.randn(k,ncols)
+            b = numpy.dot(A,x) + noise*rng.randn(k)
+            block = numpy.hstack((A,b[:,numpy.newaxis]))
+            if blocksize == 1:
+                writer.write_pair(nwritten,block[0])
+            else:
+                writer.write_pair(nwritten,rowblock.pack(block))
+            out.flush()
+            nwritten += k
+            if rate > 0:
+                delay = t0 + nwritten/rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+    except IOError:
+        # the consumer closed the pipe
+        pass
+
+def main(args):
+    if 'produce' in args:
+        produce(args)
+        return
+    window = args.get('window',None)
+    if window is not None:
+        window = int(window)
+    fit = StreamLS(forget=float(args.get('forget',1.)),window=window,
+        refresh=int(args.get('refresh',100)))
+    blocksize = int(args.get('blocksize',1000))
+    snapshot = args.get('snapshot',None)
+    snap_rows = int(args.get('snapshot_rows',0))
+    snap_secs = float(args.get('snapshot_secs',1.))
+
+    reader = tbio.Reader(open_stream(args),arrays=True)
+    last_rows = 0
+    last_time = time.time()
+    timeout = None
+    if snap_secs > 0:
+        timeout = snap_secs
+    for block in arrivals(reader,blocksize,timeout):
+        if block is not None:
+            fit.update(block)
+        now = time.time()
+        if (snap_rows > 0 and fit.nrows - last_rows >= snap_rows) or \
+                (snap_secs > 0 and now - last_time >= snap_secs):
+            publish(fit.snapshot(),snapshot)
+            last_rows = fit.nrows
+            last_time = now
+    publish(fit.snapshot(),snapshot)
+
+if __name__=='__main__':
+    main(local_util.get_args(sys.argv[1:]))
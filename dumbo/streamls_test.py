@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+streamls_test.py
+================
+
+Tests of streamls.py on a slow pipe: the rows are used, and the
+snapshots published, before the stream ends.
+
+    python streamls_test.py
+
+History
+-------
+:2011-03-29: Initial coding
+"""
+
+import os
+import sys
+import json
+import time
+import select
+import subprocess
+import unittest
+
+import numpy
+
+import tbio
+import streamls
+
+def encode_row(i,row):
+    return tbio.encode(i) + tbio.encode([float(v) for v in row])
+
+def readline(f,timeout):
+    """ Read a line from a pipe, or return None after timeout seconds. """
+    if len(select.select([f],[],[],timeout)[0]) == 0:
+        return None
+    return f.readline()
+
+class SlowPipeTest(unittest.TestCase):
+    def setUp(self):
+        self.rfd,self.wfd = os.pipe()
+        self.rows = numpy.random.RandomState(0).randn(5,4)
+
+    def tearDown(self):
+        for fd in (self.rfd,self.wfd):
+            if fd is not None:
+                os.close(fd)
+
+    def test_arrivals(self):
+        stream = streamls.StreamFile(os.fdopen(self.rfd,'rb',0))
+        reader = tbio.Reader(stream)
+        blocks = streamls.arrivals(reader,1000,timeout=0.05)
+        for i,row in enumerate(self.rows):
+            os.write(self.wfd,encode_row(i,row))
+            block = blocks.next()
+            self.assertTrue(block is not None)
+            self.assertEqual(block.shape,(1,4))
+            self.assertTrue(numpy.all(block[0] == row))
+            # nothing more arrives, so the blocks are empty
+            self.assertTrue(blocks.next() is None)
+        os.close(self.wfd)
+        self.wfd = None
+        self.assertEqual(list(blocks),[])
+        self.rfd = None # closed with the file
+
+    def test_snapshots(self):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+            'streamls.py')
+        proc = subprocess.Popen([sys.executable,script,'-snapshot_secs','0.1'],
+            stdin=self.rfd,stdout=subprocess.PIPE,close_fds=True)
+        os.close(self.rfd)
+        self.rfd = None
+        try:
+            for i,row in enumerate(self.rows):
+                os.write(self.wfd,encode_row(i,row))
+                t0 = time.time()
+                while True:
+                    line = readline(proc.stdout,5.)
+                    self.assertTrue(line,'no snapshot before the end')
+                    snap = json.loads(line)
+                    if snap['rows'] == i+1:
+                        break
+                    self.assertTrue(time.time() - t0 < 5.)
+            # with no rows, the snapshots go on
+            for i in xrange(2):
+                snap = json.loads(readline(proc.stdout,5.))
+                self.assertEqual(snap['rows'],len(self.rows))
+        finally:
+            os.close(self.wfd)
+            self.wfd = None
+            proc.stdout.read()
+            proc.wait()
+        self.assertEqual(proc.returncode,0)
+
+if __name__=='__main__':
+    unittest.main()
@@ -5,6 +5,28 @@ svd.py
 ===========
 
 Implement a svd algorithm using dumbo and numpy using tsqr.py
+
+The R factor from the TSQR stages is saved in the cache from rcache.py,
+see tsqr.py.  If the R factor of the matrix is in the cache, the TSQR
+stages are skipped and only the job for U runs.
+
+The rank of the matrix is from the QR factorization with column
+pivoting of R, see rrqr.py, with the relative tolerance -rank_tol (the
+default is max(m,n)*eps).  The TSQR stages count the m rows of the
+matrix, see tsqr.SerialTSQR, and the count is saved with R in the
+file for the job for U and in the cache.  For a matrix of rank r, U
+has r columns, and the job for U only reads the r independent columns
+of each row.
+
+With -memstats yes or -memstats <dir>, each task reports its peak
+memory and the peak size of its buffers, e.g. the lists of keys and
+rows in ComputeSVDLeft, see memstats.py.
+
+With -profile cprofile or -profile sample, each task runs under a
+profiler, and with -trace yes or -trace <dir>, each task records a
+timeline, see tsqr.py, taskprof.py, and tasktrace.py.  With
+-reducestats yes or -reducestats <dir>, the reducers of the TSQR stages
+measure their input, see reducestats.py.
 """
 
 import pprint
@@ -18,6 +40,12 @@ import numpy
 import numpy.linalg
 
 import util
+import rowblock
+import rrqr
+import memstats
+import textrows
+import checkpoint
+import rcache
 
 import dumbo
 import dumbo.util
@@ -29,16 +57,45 @@ import tsqr
 gopts = util.GlobalOptions()
 
 class TextMatrixConverter:
-    """ Convert from Hadoop typed bytes to a textual matrix """
+    """ Convert from Hadoop typed bytes to a textual matrix.
+
+    The number of rows of the matrix, the sum of the records with the
+    key tsqr.SerialTSQR.countkey, is the first line, see write_R.
+    """
     def __init__(self,filename):
         self.filename = filename
     def __call__(self,data):
-        file = open(self.filename, 'w')
+        rows = []
+        nrows = None
         for key,value in data:
-            for entry in value:
-                file.write("%18.16e "%(entry))
-            file.write('\n');
-        file.close()
+            if key == tsqr.SerialTSQR.countkey:
+                nrows = (nrows or 0) + int(value)
+            else:
+                rows.append(value)
+        write_R(self.filename,rows,nrows)
+
+def write_R(filename,R,nrows=None):
+    """ Write R as a text matrix with a first line '# rows <nrows>' for
+    the number of rows of the matrix, if it's known. """
+    file = open(filename, 'w')
+    if nrows is not None:
+        file.write('# rows %i\n'%(nrows))
+    for row in R:
+        for entry in row:
+            file.write("%18.16e "%(entry))
+        file.write('\n');
+    file.close()
+
+def read_R(filename):
+    """ Read a file from write_R.
+
+    @return a tuple (R, nrows) where nrows is None if it's not known
+    """
+    nrows = None
+    line = open(filename).readline().split()
+    if line[:2] == ['#','rows']:
+        nrows = int(line[2])
+    return numpy.atleast_2d(numpy.loadtxt(filename)), nrows
 
 def setup_left_svd(backend, fs, opts):
     """ Setup the left-sided SVD after a TSQR.
@@ -66,6 +123,29 @@ def setup_left_svd(backend, fs, opts):
     fs.convert(lastiter, opts, conv)
     
     opts.append(('file',localR))
+    
+    # save R in the cache for the next time
+    cachedir = gopts.getstrkey('rcache')
+    if cachedir != 'no':
+        cache = rcache.RCache(cachedir)
+        key = cache.key(matrix_fs(),[gopts.getstrkey('input')])
+        if len(key[1]['input']) > 0:
+            R,nrows = read_R(localR)
+            arrays = {'R': R}
+            if nrows is not None:
+                arrays['nrows'] = numpy.array(nrows)
+            cache.put(key,arrays,{'input': gopts.getstrkey('input')})
+    
+def ship_cached_R(backend, fs, opts):
+    """ Ship the R factor from the cache instead of a TSQR. """
+    opts.append(('file',gopts.getstrkey('tsqr_R_filename')))
+    
+def matrix_fs():
+    """ The file system with the matrix, for the cache. """
+    hadoop = gopts.getstrkey('hadoop')
+    if hadoop:
+        return checkpoint.HadoopFS(os.path.join(hadoop,'bin','hadoop'))
+    return checkpoint.LocalFS()
 
 class ComputeSVDLeft(dumbo.backends.common.MapRedBase):
     """ Compute the left factor in the SVD given the other two factors.
@@ -74,13 +154,16 @@ class ComputeSVDLeft(dumbo.backends.common.MapRedBase):
     each processor.  Usually by the distributed cache.
     """
 
-    def __init__(self,Rfilename,blocksize=3):
+    def __init__(self,Rfilename,blocksize=3,rank_tol=None):
         self.blocksize=blocksize
+        self.rank_tol = rank_tol
         self.nrows = 0
         self.data = []
         self.keys = []
         self.ncols = None
         self.Rfilename = Rfilename
+        self.lines = textrows.LineBatch()
+        self.memstats = memstats.MemStats('svd')
         #self.V = numpy.loadtxt('svd-V.tmat')
         #self.S = numpy.loadtxt('svd-S.tmat')
  
@@ -107,9 +190,11 @@ class ComputeSVDLeft(dumbo.backends.common.MapRedBase):
             self.counters['Blocks Output'] += 1
             # compress the data
             
-            if self.ncols is None:
+            if self.ncols is None or len(self.data) == 0:
                 return
                 
+            self.memstats.buffer('keys',self.keys)
+            self.memstats.buffer('rows',self.data)
             t0 = time.time()
             A = numpy.array(self.data)
             U = self.compute_U(A)
@@ -126,41 +211,76 @@ class ComputeSVDLeft(dumbo.backends.common.MapRedBase):
             self.keys = []
             
     
+    def output_lines(self):
+        """ Compute the rows of U for a batch of lines of text at once. """
+        keys,A,nbad = self.lines.parse(self.ncols)
+        if nbad > 0:
+            self.counters['malformed lines'] += nbad
+        if len(keys) == 0:
+            return
+        if self.ncols is None:
+            self.ncols = A.shape[1]
+        self.nrows += len(keys)
+        t0 = time.time()
+        U = self.compute_U(A)
+        dt = time.time() - t0
+        self.counters['numpy time (millisecs)'] += int(1000*dt)
+        for key,row in zip(keys,U):
+            yield key, util.array2list(row)
+    
+    def setup(self):
+        """ Compute the map from the independent columns to U. """
+        R,nrows = read_R(self.Rfilename)
+        columns,M,S,V = rrqr.left_factor(R,self.rank_tol,nrows)
+        print >>sys.stderr, "Numerical rank: %i of %i columns"%(
+            len(columns), R.shape[1])
+        if len(columns) == R.shape[1]:
+            # all the columns are independent, so undo the permutation
+            # instead of copying the columns of A
+            self.columns = None
+            self.M = M[numpy.argsort(columns)]
+        else:
+            self.columns = columns
+            self.M = M
+    
     def compute_U(self,A):
-        """ Compute AR^{+} for the pseudo-inverse """
-        #print >>sys.stderr, "A.shape: " + str(A.shape)
-        #print >>sys.stderr, "self.V.shape: " + str(self.V.shape)
-        AR = numpy.dot(A,self.V)
-        #print >>sys.stderr, "AR.shape: " + str(AR.shape)
-        #print >>sys.stderr, "diag(self.Sinv).shape: " + str(numpy.diag(self.Sinv).shape)
-        AR = numpy.dot(AR,numpy.diag(self.Sinv))
-        return AR
+        """ Compute AR^{+} for the pseudo-inverse from the independent
+        columns of A """
+        if self.columns is not None:
+            A = A[:,self.columns]
+        return numpy.dot(A,self.M)
     
     def __call__(self,data):
         # startup
-        R = numpy.loadtxt(self.Rfilename)
-        U,S,Vt = numpy.linalg.svd(R)
-        #self.Ut = U.transpose()
-        self.V = Vt.transpose()
-        tol = max(R.shape)*numpy.finfo(float).eps*max(S)
-        r = numpy.sum(S>tol)
-        self.Sinv = 1./S[0:r]
-        if len(self.Sinv) < self.V.shape[1]:
-            self.Sinv = numpy.hstack((self.Sinv,
-                numpy.zeros(self.V.shape[1] - len(self.Sinv))))
+        self.setup()
         # map job
         for key,value in data:
-            if isinstance(value, str):
-                # handle conversion from string
-                value = [float(p) for p in value.split()]
+            if isinstance(value, str) and not rowblock.isblock(value):
+                # parse lines of text in batches
+                if self.lines.append(key,value):
+                    for key,value in self.output_lines():
+                        yield key, value
+                continue
+            if rowblock.isblock(value):
+                # a packed block of rows gives a block of rows of U
+                self.counters['Blocks Output'] += 1
+                U = self.compute_U(rowblock.unpack(value))
+                yield key, rowblock.pack(U)
+                continue
                 
             self.collect(key,value)
             for key,value in self.output():
                 yield key, value
      
         # finally, output data
+        for key,value in self.output_lines():
+            yield key,value
         for key,value in self.output(final=True):
             yield key,value
+        self.memstats.finish(self.counter)
+        
+    def counter(self,group,name,value):
+        self.counters[name] += value
     
 def runner(job):
     #niter = int(os.getenv('niter'))
@@ -169,6 +289,25 @@ def runner(job):
     schedule = gopts.getstrkey('reduce_schedule')
     finalreduce = gopts.getstrkey('final_reduce')
     
+    Rfile = gopts.getstrkey('tsqr_R_filename')
+    rank_tol = gopts.getstrkey('rank_tol')
+    if rank_tol:
+        rank_tol = float(rank_tol)
+    else:
+        rank_tol = None
+    
+    if gopts.getintkey('rcache_hit'):
+        # the R factor is from the cache
+        job.additer(mapper=gopts.instrument(ComputeSVDLeft(Rfile,
+                blocksize=blocksize,rank_tol=rank_tol),'svd-U-map'),
+            premapper=ship_cached_R,
+            opts=[('numreducetasks',str(finalreduce))])
+        return
+    
+    # the stages count the rows of the matrix for the rank tolerance,
+    # see tsqr.SerialTSQR
+    count_rows = 'rows'
+    
     schedule = schedule.split(',')
     for i,part in enumerate(schedule):
         if part.startswith('s'):
@@ -180,16 +319,20 @@ def runner(job):
         else:
             nreducers = int(part)
             if i==0:
-                mapper = tsqr.SerialTSQR(blocksize=blocksize,isreducer=False)
+                mapper = tsqr.SerialTSQR(blocksize=blocksize,isreducer=False,
+                    count_rows=count_rows)
+                count_rows = 'counts'
             else:
                 mapper = 'org.apache.hadoop.mapred.lib.IdentityMapper'
-            job.additer(mapper=mapper,
-                    reducer=tsqr.SerialTSQR(blocksize=blocksize,isreducer=True),
+            reducer = tsqr.SerialTSQR(blocksize=blocksize,isreducer=True,
+                count_rows=count_rows)
+            count_rows = 'counts'
+            job.additer(mapper=gopts.instrument(mapper,'tsqr-%i-map'%(i+1)),
+                    reducer=gopts.instrument(reducer,'tsqr-%i-reduce'%(i+1)),
                     opts=[('numreducetasks',str(nreducers))])
 
-    Rfile = gopts.getstrkey('tsqr_R_filename')
-        
-    job.additer(mapper=ComputeSVDLeft(Rfile,blocksize=blocksize),
+    job.additer(mapper=gopts.instrument(ComputeSVDLeft(Rfile,
+            blocksize=blocksize,rank_tol=rank_tol),'svd-U-map'),
         input=-1,
         premapper=setup_left_svd,
         opts=[('numreducetasks',str(finalreduce))])
@@ -221,6 +364,19 @@ def starter(prog):
         
     prog.addopt('file',os.path.join(mypath,'util.py'))
     prog.addopt('file',os.path.join(mypath,'tsqr.py'))
+    prog.addopt('file',os.path.join(mypath,'rowblock.py'))
+    prog.addopt('file',os.path.join(mypath,'tsqrlib.py'))
+    prog.addopt('file',os.path.join(mypath,'memstats.py'))
+    prog.addopt('file',os.path.join(mypath,'taskprof.py'))
+    prog.addopt('file',os.path.join(mypath,'tasktrace.py'))
+    prog.addopt('file',os.path.join(mypath,'reducestats.py'))
+    prog.addopt('file',os.path.join(mypath,'rrqr.py'))
+    prog.addopt('file',os.path.join(mypath,'textrows.py'))
+    prog.addopt('file',os.path.join(mypath,'tbio.py'))
+    prog.addopt('file',os.path.join(mypath,'seqfile.py'))
+    prog.addopt('file',os.path.join(mypath,'local_util.py'))
+    prog.addopt('file',os.path.join(mypath,'checkpoint.py'))
+    prog.addopt('file',os.path.join(mypath,'rcache.py'))
     
     prog.addopt('input',mat)
     matname,matext = os.path.splitext(mat)
@@ -228,6 +384,17 @@ def starter(prog):
     gopts.getintkey('blocksize',3)
     gopts.getstrkey('reduce_schedule','1')
     gopts.getstrkey('final_reduce','1')
+    gopts.getstrkey('rank_tol','')
+    gopts.getstrkey('memstats','no')
+    gopts.getintkey('tracemalloc',0)
+    try:
+        gopts.getprofile()
+    except ValueError, msg:
+        return str(msg)
+    gopts.gettrace()
+    # the job for U copies the whole output of the last TSQR stage, so
+    # the side files of the reducers are only written on request
+    gopts.getstrkey('reducestats','no')
     gopts.setkey('input',mat)
     
     output = prog.getopt('output')
@@ -244,6 +411,22 @@ def starter(prog):
     
     gopts.setkey('tsqr_R_filename',os.path.split(matname)[1]+'-R.tmat')
     
+    # look up the R factor in the cache
+    gopts.setkey('hadoop',prog.getopt('hadoop') or '')
+    cache,key,arrays = rcache.lookup(prog.delopt('rcache'),matrix_fs(),[mat])
+    if cache is None:
+        gopts.setkey('rcache','no')
+    else:
+        gopts.setkey('rcache',cache.path)
+    if arrays is not None and 'nrows' not in arrays:
+        # the rank tolerance needs the number of rows, see rrqr.py
+        arrays = None
+    gopts.setkey('rcache_hit',int(arrays is not None))
+    if arrays is not None:
+        print "Found the R factor of %s in %s"%(mat,cache.path)
+        write_R(gopts.getstrkey('tsqr_R_filename'),
+            numpy.atleast_2d(arrays['R']),int(arrays['nrows']))
+    
     gopts.save_params()
 
 if __name__ == '__main__':
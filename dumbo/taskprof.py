@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""
+taskprof.py
+===========
+
+Profile a map or reduce task, without dumbo or hadoop.
+
+The option -profile of the drivers runs each task under a profiler,
+see util.GlobalOptions.profiled and hadoopy_util.SavedOptions.profiled:
+
+  -profile cprofile : the deterministic profiler cProfile.  It counts
+    every function call, so a task with many small calls runs slower.
+
+  -profile sample : a statistical profiler.  Every -profile_interval
+    milliseconds of CPU time (the default is 5), a timer signal
+    records the stack of the task.  The overhead is small and does
+    not depend on the number of calls, but it only estimates the time
+    of each function.
+
+The profile runs from the first record of a task to its last output,
+so it includes the time to read and write the records.  Each task
+writes its profile as a side output file
+  _profile.<stage>.<task>.prof : cProfile, in the format of pstats
+  _profile.<stage>.<task>.json : the samples
+where stage is the name of the mapper or reducer, e.g. tsqr-1-map, and
+task is the Hadoop task id.  The file goes to the work output directory
+of the task, so Hadoop moves it into the output of the job when the
+task succeeds, and the name starts with _ so the next stage doesn't
+read it.  With -profile_dir <dir>, the file is written to a local
+directory on the node instead.  Use profile_report.py to merge the
+profiles of the tasks into one report for each stage.
+
+History
+-------
+:2011-03-25: Initial coding
+"""
+
+import sys
+import os
+import time
+import json
+import signal
+import marshal
+
+import checkpoint
+
+MODES = ('cprofile','sample')
+
+def _funcname(code):
+    """ The name of a function like pstats, file:line(name). """
+    return '%s:%i(%s)'%(code.co_filename,code.co_firstlineno,code.co_name)
+
+class Profiler:
+    """ Profile a task and save the profile as a side output.
+
+    @param stage the name of the stage in the file name
+    @param mode 'cprofile' or 'sample'
+    @param dirname a local directory for the profile, or '' for the work
+    output directory of the task
+    @param interval the sampling interval in milliseconds
+    """
+    def __init__(self,stage,mode,dirname='',interval=5):
+        if mode not in MODES:
+            raise ValueError("the profile mode must be one of %s, not %s"%(
+                ', '.join(MODES), mode))
+        if interval <= 0:
+            raise ValueError("the profile interval must be positive")
+        self.stage = stage.replace('.','-')
+        self.mode = mode
+        self.dirname = dirname
+        self.interval = interval
+        self.running = False
+        self.profile = None
+        self.stacks = {}
+        self.lines = {}
+        self.nsamples = 0
+        self.elapsed = 0.
+
+    def start(self):
+        """ Start or resume the profile. """
+        if self.running:
+            return
+        self.running = True
+        self.t0 = time.time()
+        if self.mode == 'cprofile':
+            import cProfile
+            if self.profile is None:
+                self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            secs = self.interval/1000.
+            signal.signal(signal.SIGPROF,self._sample)
+            signal.setitimer(signal.ITIMER_PROF,secs,secs)
+
+    def stop(self):
+        """ Pause the profile. """
+        if not self.running:
+            return
+        self.running = False
+        if self.mode == 'cprofile':
+            self.profile.disable()
+        else:
+            signal.setitimer(signal.ITIMER_PROF,0,0)
+            signal.signal(signal.SIGPROF,signal.SIG_DFL)
+        self.elapsed += time.time() - self.t0
+
+    def _sample(self,signum,frame):
+        """ Record the stack of the interrupted frame. """
+        self.nsamples += 1
+        line = '%s:%i(%s)'%(frame.f_code.co_filename,frame.f_lineno,
+            frame.f_code.co_name)
+        self.lines[line] = self.lines.get(line,0) + 1
+        stack = []
+        while frame is not None:
+            stack.append(_funcname(frame.f_code))
+            frame = frame.f_back
+        stack = tuple(reversed(stack))
+        self.stacks[stack] = self.stacks.get(stack,0) + 1
+
+    def task(self):
+        return os.getenv('mapred_task_id','') or str(os.getpid())
+
+    def filename(self):
+        if self.mode == 'cprofile':
+            ext = 'prof'
+        else:
+            ext = 'json'
+        return '_profile.%s.%s.%s'%(self.stage,self.task(),ext)
+
+    def data(self):
+        """ Return the profile as the contents of the file. """
+        if self.mode == 'cprofile':
+            # the same as cProfile.Profile.dump_stats
+            self.profile.create_stats()
+            return marshal.dumps(self.profile.stats)
+        return json.dumps({
+            'stage': self.stage,
+            'task': self.task(),
+            'interval': self.interval,
+            'elapsed': self.elapsed,
+            'samples': self.nsamples,
+            'stacks': [[list(stack),count]
+                for stack,count in self.stacks.items()],
+            'lines': self.lines,
+            })
+
+    def save(self):
+        """ Write the profile file and return its path. """
+        self.stop()
+        path = checkpoint.write_task_file(self.filename(),self.data(),
+            self.dirname)
+        print >>sys.stderr, 'taskprof: wrote the profile to %s'%(path)
+        return path
+
+    def run_iter(self,outputs):
+        """ Profile an iterator over the outputs of a task and save the
+        profile after the last output. """
+        self.start()
+        try:
+            for out in outputs:
+                yield out
+        finally:
+            self.stop()
+        self.save()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+
+"""
+tasktrace.py
+============
+
+A timeline of the tasks and stages of a job in the Chrome trace event
+format, without dumbo or hadoop.
+
+With the option -trace of the drivers, each task records timed spans:
+  read : from the start of the task, or the end of the last compress,
+    to the next compress, i.e. reading the records and filling the
+    buffer of rows
+  parse : parsing a batch of lines of text, inside a read
+  compress : a QR compression of the buffer, see tsqrlib.py
+  spill : writing the R factor of a bucket before the end of the
+    task, see buckettsqr.py
+  emit : writing the output at the end of the task
+  task : the whole task, from its first record to its last output
+and each driver records when it launches and finishes each stage.
+
+A span costs two calls to time.time and an append to a list, and a
+task keeps the first maxspans spans (100000), and after that, only the
+total time of each kind of span.  So the trace is cheap enough to leave
+on for a production run.
+
+  -trace yes : each task writes _trace.<stage>.<task>.json to the
+    output of its stage, like taskprof.py, and the driver writes
+    _trace.driver.<name>.json to the final output.
+  -trace <dir> : the tasks and the driver write the files to a local
+    directory on each machine.
+
+The times are the clocks of each machine, so the clocks of the nodes
+should be synchronized, e.g. with ntp.
+
+Usage
+-----
+
+    python tasktrace.py -input <path>[,<path>...] [-hdfs yes] -output <file.json>
+
+      merge the trace files under the paths, e.g. the outputs of all the
+      stages of a job, into one trace.  Open it in chrome://tracing or
+      the Perfetto UI.  Each stage is a process in the trace, and each
+      task a thread of the stage.  The stages of the drivers are in the
+      process driver.
+
+History
+-------
+:2011-03-26: Initial coding
+"""
+
+import sys
+import os
+import time
+import json
+import socket
+import atexit
+import posixpath
+
+import checkpoint
+import local_util
+
+# the tracer of this task, or None
+_tracer = None
+# the timeline of the stages of this driver, or None
+_timeline = None
+
+def _task():
+    return os.getenv('mapred_task_id','') or str(os.getpid())
+
+class Tracer:
+    """ Record the spans of a task and save them as a side output.
+
+    @param stage the name of the stage, e.g. tsqr-1-map
+    @param dirname a local directory for the trace, or '' for the work
+    output directory of the task
+    @param maxspans the largest number of spans to keep
+    """
+    def __init__(self,stage,dirname='',maxspans=100000):
+        self.stage = stage.replace('.','-')
+        self.dirname = dirname
+        self.maxspans = maxspans
+        self.spans = []
+        self.totals = {}
+        self.ndropped = 0
+        self.t0 = None
+        self.mark = None
+
+    def start(self):
+        """ Start the trace and make it the tracer of this process. """
+        global _tracer
+        if self.t0 is None:
+            self.t0 = time.time()
+            self.mark = self.t0
+        _tracer = self
+
+    def span(self,name,start,end=None):
+        """ Record a span from start to end, the default is now. """
+        if end is None:
+            end = time.time()
+        if len(self.spans) < self.maxspans:
+            self.spans.append((name,start,end-start))
+        else:
+            self.ndropped += 1
+        total = self.totals.get(name)
+        if total is None:
+            self.totals[name] = [1,end-start]
+        else:
+            total[0] += 1
+            total[1] += end-start
+
+    def since(self,name,end=None):
+        """ Record a span from the end of the last span from since. """
+        if end is None:
+            end = time.time()
+        self.span(name,self.mark,end)
+        self.mark = end
+
+    def filename(self):
+        return '_trace.%s.%s.json'%(self.stage,_task())
+
+    def data(self):
+        return json.dumps({
+            'kind': 'task',
+            'stage': self.stage,
+            'task': _task(),
+            'host': socket.gethostname(),
+            'spans': self.spans,
+            'totals': self.totals,
+            'dropped': self.ndropped,
+            })
+
+    def save(self):
+        """ Record the task span, write the trace, and return its path. """
+        global _tracer
+        self.span('task',self.t0)
+        if _tracer is self:
+            _tracer = None
+        path = checkpoint.write_task_file(self.filename(),self.data(),
+            self.dirname)
+        print >>sys.stderr, 'trace: wrote the trace to %s'%(path)
+        return path
+
+    def run_iter(self,outputs):
+        """ Trace an iterator over the outputs of a task and save the
+        trace after the last output. """
+        self.start()
+        for out in outputs:
+            yield out
+        self.save()
+
+def span(name,start,end=None):
+    """ Record a span in the tracer of this process, if there is one. """
+    if _tracer is not None:
+        _tracer.span(name,start,end)
+
+def since(name,end=None):
+    """ Record a span since the last one, if there is a tracer. """
+    if _tracer is not None:
+        _tracer.since(name,end)
+
+class Timeline:
+    """ The launch and finish times of the stages of a driver.
+
+    @param name the name of the driver, e.g. tsqr
+    """
+    def __init__(self,name):
+        self.name = name
+        self.stages = []
+        self.t0 = time.time()
+
+    def launch(self,stage):
+        """ Record the launch of a stage, and the finish of the last
+        stage if it's still running. """
+        self.finish()
+        self.stages.append([str(stage),time.time(),None])
+
+    def finish(self):
+        """ Record the finish of the running stage. """
+        if self.stages and self.stages[-1][2] is None:
+            self.stages[-1][2] = time.time()
+
+    def data(self):
+        self.finish()
+        return json.dumps({
+            'kind': 'driver',
+            'name': self.name,
+            'host': socket.gethostname(),
+            'start': self.t0,
+            'end': time.time(),
+            'stages': self.stages,
+            })
+
+    def save(self,fs,dirname):
+        """ Write the timeline into a directory of fs. """
+        path = dirname.rstrip('/')+'/_trace.driver.%s.json'%(self.name)
+        fs.write(path,self.data())
+        print >>sys.stderr, 'trace: wrote the timeline to %s'%(path)
+        return path
+
+def timeline(name,fs=None,dirname=None):
+    """ Return the timeline of this driver, and create it the first
+    time.  With fs and dirname, the timeline is saved when the driver
+    exits. """
+    global _timeline
+    if _timeline is None:
+        _timeline = Timeline(name)
+        if fs is not None:
+            atexit.register(_timeline.save,fs,dirname)
+    return _timeline
+
+def _event(name,cat,pid,tid,start,dur,t0,args=None):
+    event = {'name': name, 'cat': cat, 'ph': 'X', 'pid': pid, 'tid': tid,
+        'ts': int(1e6*(start-t0)), 'dur': int(1e6*dur)}
+    if args:
+        event['args'] = args
+    return event
+
+def _metadata(kind,pid,tid,name):
+    return {'name': kind, 'ph': 'M', 'pid': pid, 'tid': tid,
+        'args': {'name': name}}
+
+def read_traces(fs,paths):
+    """ Read the trace files under a list of paths. """
+    traces = []
+    for path in paths:
+        for name,size,mtime in fs.ls(path,hidden=True):
+            base = posixpath.basename(name)
+            if base.startswith('_trace.') and base.endswith('.json'):
+                traces.append(json.loads(fs.cat(name)))
+    return traces
+
+def merge(traces):
+    """ Merge the trace files into a Chrome trace.
+
+    @return a dictionary for json
+    """
+    tasks = [t for t in traces if t['kind'] == 'task' and t['spans']]
+    drivers = [t for t in traces if t['kind'] == 'driver']
+    starts = [t['start'] for t in drivers]
+    starts.extend(min(s[1] for s in t['spans']) for t in tasks)
+    if len(starts) == 0:
+        return {'traceEvents': [], 'displayTimeUnit': 'ms'}
+    t0 = min(starts)
+    events = []
+    # the drivers are process 0
+    if drivers:
+        events.append(_metadata('process_name',0,0,'driver'))
+    for tid,driver in enumerate(drivers):
+        events.append(_metadata('thread_name',0,tid,
+            '%s on %s'%(driver['name'],driver['host'])))
+        events.append(_event(driver['name'],'driver',0,tid,driver['start'],
+            driver['end']-driver['start'],t0))
+        for stage,launch,finish in driver['stages']:
+            if finish is None:
+                finish = driver['end']
+            events.append(_event('stage %s'%(stage),'stage',0,tid,launch,
+                finish-launch,t0))
+    # each stage is a process and each task is a thread, in the order
+    # the stages and the tasks started
+    bystage = {}
+    for t in tasks:
+        bystage.setdefault(t['stage'],[]).append(t)
+    first = lambda t: min(s[1] for s in t['spans'])
+    stages = sorted(bystage,key=lambda s: min(first(t) for t in bystage[s]))
+    for pid,stage in enumerate(stages):
+        pid += 1
+        events.append(_metadata('process_name',pid,0,stage))
+        events.append({'name': 'process_sort_index', 'ph': 'M', 'pid': pid,
+            'args': {'sort_index': pid}})
+        for tid,t in enumerate(sorted(bystage[stage],key=first)):
+            events.append(_metadata('thread_name',pid,tid,
+                '%s on %s'%(t['task'],t['host'])))
+            for name,start,dur in t['spans']:
+                args = None
+                if name == 'task':
+                    args = {'totals (count, secs)': t['totals'],
+                        'dropped spans': t['dropped']}
+                events.append(_event(name,name,pid,tid,start,dur,t0,args))
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def main(args):
+    if args.get('hdfs','no') == 'yes':
+        fs = checkpoint.HadoopFS()
+    else:
+        fs = checkpoint.LocalFS()
+    traces = read_traces(fs,args['input'].split(','))
+    trace = merge(traces)
+    f = open(args['output'],'w')
+    json.dump(trace,f)
+    f.close()
+    local_util.setstatus('wrote %i events from %i trace files to %s'%(
+        len(trace['traceEvents']), len(traces), args['output']))
+
+if __name__=='__main__':
+    args = local_util.get_args(sys.argv[1:])
+    if 'input' not in args or 'output' not in args:
+        print >>sys.stderr, "Error: -input and -output are required"
+        sys.exit(1)
+    main(args)
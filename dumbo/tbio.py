@@ -0,0 +1,505 @@
+"""
+tbio.py
+=======
+
+Read and write Hadoop typed bytes without dumbo or hadoopy.
+
+The typed bytes format is what Hadoop streaming uses with -io typedbytes
+and what the dumbo and hadoopy jobs read and write.  This module handles
+the type codes that our jobs use, and it reads and writes rows of doubles
+with NumPy instead of a struct.pack for each entry.  The reader decodes
+a list of doubles into a NumPy array with one frombuffer call, and raw
+bytes into an array of bytes that shares the memory of the read buffer.
+
+Types are mapped like the typedbytes module that dumbo uses:
+  bool -> bool (2), int -> int (3) or long (4), long -> long (4),
+  float -> double (6), str -> string (7), tuple -> vector (8),
+  list -> list (9), dict -> map (10), Bytes -> bytes (0)
+and 1d NumPy arrays are written as lists of doubles.  The reader
+returns the same types, except long (4) is always a long, and with
+arrays=True a list of doubles is a 1d array of doubles and raw bytes
+are a 1d array of uint8.
+
+Usage
+-----
+
+    python tbio.py -dump <file>
+
+      print the contents of a typed bytes file, like
+      cxx/dump_typedbytes_info
+
+    python tbio.py -check <file>
+
+      check that reading and writing a typed bytes file returns the
+      same bytes, and that the arrays match the lists.  See the
+      test_tbio target in cxx/Makefile.
+
+History
+-------
+:2011-03-14: Initial coding with a writer
+:2011-03-15: Added a reader, batches of rows, and a streaming runner
+"""
+
+import sys
+import struct
+import itertools
+
+import numpy
+
+BYTES = 0
+BYTE = 1
+BOOL = 2
+INT = 3
+LONG = 4
+FLOAT = 5
+DOUBLE = 6
+STRING = 7
+VECTOR = 8
+LIST = 9
+MAP = 10
+MARKER = 255
+
+class Bytes(str):
+    """ A string that is written as typed bytes raw bytes (code 0). """
+    pass
+
+# the type for a list of doubles
+_doubles = numpy.dtype([('code','u1'),('value','>f8')])
+
+def encode_doubles(a):
+    """ Encode a sequence of numbers as a typed bytes list of doubles. """
+    a = numpy.asarray(a,dtype=float)
+    rec = numpy.empty(len(a),dtype=_doubles)
+    rec['code'] = DOUBLE
+    rec['value'] = a
+    return chr(LIST) + rec.tostring() + chr(MARKER)
+
+def _isdoubles(obj):
+    for val in obj:
+        if type(val) is not float:
+            return False
+    return len(obj) > 0
+
+def encode(obj):
+    """ Encode a python object as typed bytes. """
+    t = type(obj)
+    if t is float:
+        return struct.pack('>Bd',DOUBLE,obj)
+    elif t is bool:
+        return struct.pack('>BB',BOOL,obj)
+    elif t is int or t is long:
+        if t is int and -2147483648 <= obj <= 2147483647:
+            return struct.pack('>Bi',INT,obj)
+        else:
+            return struct.pack('>Bq',LONG,obj)
+    elif t is Bytes:
+        return struct.pack('>Bi',BYTES,len(obj)) + obj
+    elif t is str:
+        return struct.pack('>Bi',STRING,len(obj)) + obj
+    elif t is unicode:
+        obj = obj.encode('utf-8')
+        return struct.pack('>Bi',STRING,len(obj)) + obj
+    elif t is list:
+        if _isdoubles(obj):
+            return encode_doubles(obj)
+        return chr(LIST) + ''.join([encode(v) for v in obj]) + chr(MARKER)
+    elif t is tuple:
+        return (struct.pack('>Bi',VECTOR,len(obj)) +
+            ''.join([encode(v) for v in obj]))
+    elif t is dict:
+        parts = [struct.pack('>Bi',MAP,len(obj))]
+        for key,val in obj.iteritems():
+            parts.append(encode(key))
+            parts.append(encode(val))
+        return ''.join(parts)
+    elif t is numpy.ndarray and obj.ndim == 1:
+        return encode_doubles(obj)
+    elif isinstance(obj,numpy.floating):
+        return struct.pack('>Bd',DOUBLE,float(obj))
+    elif isinstance(obj,numpy.integer):
+        return encode(int(obj))
+    else:
+        raise TypeError("cannot encode type %s as typed bytes"%(str(t)))
+
+class Writer:
+    """ Write key, value pairs to a typed bytes file. """
+    def __init__(self,file):
+        self.file = file
+
+    def write(self,obj):
+        self.file.write(encode(obj))
+
+    def write_pair(self,key,value):
+        self.file.write(encode(key) + encode(value))
+
+    def write_pairs(self,pairs):
+        for key,value in pairs:
+            self.write_pair(key,value)
+
+    def close(self):
+        self.file.close()
+
+class Reader:
+    """ Read typed bytes objects from a file.
+
+    The reader keeps a buffer of the file and decodes objects from it,
+    so it works with pipes like sys.stdin.
+    """
+    def __init__(self,file,arrays=True,chunksize=1<<20):
+        """
+        @param file the file to read from
+        @param arrays if true, decode lists of doubles and raw bytes
+        into NumPy arrays
+        @param chunksize the number of bytes to read at once
+        """
+        self.file = file
+        self.arrays = arrays
+        self.chunksize = chunksize
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.hint = 64 # the length of the last list of doubles
+
+    def _fill(self,nbytes):
+        """ Try to buffer nbytes after the current position.
+
+        @return the number of bytes after the current position
+        """
+        avail = len(self.buf) - self.pos
+        if avail >= nbytes or self.eof:
+            return avail
+        parts = [self.buf[self.pos:]]
+        while avail < nbytes:
+            data = self.file.read(max(self.chunksize,nbytes-avail))
+            if not data:
+                self.eof = True
+                break
+            parts.append(data)
+            avail += len(data)
+        self.buf = ''.join(parts)
+        self.pos = 0
+        return avail
+
+    def _need(self,nbytes):
+        if self._fill(nbytes) < nbytes:
+            raise ValueError("the typed bytes data is truncated")
+
+    def _unpack(self,fmt,nbytes):
+        self._need(nbytes)
+        val = struct.unpack_from(fmt,self.buf,self.pos)[0]
+        self.pos += nbytes
+        return val
+
+    def _bytes(self):
+        nbytes = self._unpack('>i',4)
+        self._need(nbytes)
+        start = self.pos
+        self.pos += nbytes
+        return start, nbytes
+
+    def read_code(self):
+        """ Read the type code of the next object.
+
+        @return the type code, or None at the end of the file
+        """
+        if self._fill(1) == 0:
+            return None
+        code = ord(self.buf[self.pos])
+        self.pos += 1
+        return code
+
+    def _read_doubles(self):
+        """ Decode a list of doubles with NumPy.
+
+        The list code has already been read.  If the list has anything
+        other than doubles, this returns None and reads nothing.
+
+        The codes are checked with NumPy in a window of hint entries,
+        the length of the last list, and the window doubles while the
+        list is longer.  The reader only waits
+        for bytes that the list must still have, at least one more
+        double or the marker, so it never waits on a pipe for the
+        next record.
+        """
+        n = self.hint
+        need = 10 # one double and the marker
+        while True:
+            avail = self._fill(need)
+            if avail < need:
+                raise ValueError("the typed bytes data is truncated")
+            m = min(n,avail/9)
+            rec = numpy.frombuffer(self.buf,dtype=_doubles,count=m,
+                offset=self.pos)
+            other = numpy.flatnonzero(rec['code'] != DOUBLE)
+            if len(other) > 0:
+                k = other[0]
+                break
+            if 9*m < avail:
+                if ord(self.buf[self.pos+9*m]) != DOUBLE:
+                    k = m
+                    break
+                # the list has more than m doubles
+                if m == n:
+                    n *= 2
+                need = 9*(m+1)+1
+            else:
+                # the byte after the m doubles hasn't arrived
+                need = 9*m+1
+        if ord(self.buf[self.pos+9*k]) != MARKER:
+            return None
+        values = rec['value'][:k].astype(numpy.float64)
+        self.pos += 9*k + 1
+        self.hint = k
+        return values
+
+    def read_value(self,code,arrays=None):
+        """ Read an object after its type code. """
+        if arrays is None:
+            arrays = self.arrays
+        if code == DOUBLE:
+            return self._unpack('>d',8)
+        elif code == INT:
+            return self._unpack('>i',4)
+        elif code == LONG:
+            return long(self._unpack('>q',8))
+        elif code == STRING:
+            start,nbytes = self._bytes()
+            return self.buf[start:start+nbytes]
+        elif code == LIST:
+            if arrays and self._fill(1) > 0 and \
+                ord(self.buf[self.pos]) == DOUBLE:
+                values = self._read_doubles()
+                if values is not None:
+                    return values
+            items = []
+            while True:
+                code = self.read_code()
+                if code == MARKER:
+                    return items
+                elif code is None:
+                    raise ValueError("the typed bytes data is truncated")
+                items.append(self.read_value(code,arrays))
+        elif code == VECTOR:
+            nitems = self._unpack('>i',4)
+            return tuple([self.read(arrays) for i in xrange(nitems)])
+        elif code == MAP:
+            nitems = self._unpack('>i',4)
+            items = {}
+            for i in xrange(nitems):
+                key = self.read(arrays)
+                items[key] = self.read(arrays)
+            return items
+        elif code == BYTES:
+            start,nbytes = self._bytes()
+            if arrays:
+                return numpy.frombuffer(
+                    memoryview(self.buf)[start:start+nbytes],dtype=numpy.uint8)
+            return Bytes(self.buf[start:start+nbytes])
+        elif code == BYTE:
+            return self._unpack('>b',1)
+        elif code == BOOL:
+            return bool(self._unpack('>B',1))
+        elif code == FLOAT:
+            return self._unpack('>f',4)
+        else:
+            raise ValueError("unknown typed bytes code %i"%(code))
+
+    def read(self,arrays=None):
+        """ Read the next object.
+
+        @raise EOFError at the end of the file
+        """
+        code = self.read_code()
+        if code is None:
+            raise EOFError()
+        return self.read_value(code,arrays)
+
+    def decode(self,data):
+        """ Decode one object from a string instead of the file. """
+        self.buf = data
+        self.pos = 0
+        self.eof = True
+        return self.read()
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.read()
+            except EOFError:
+                return
+
+    def pairs(self):
+        """ Iterate over the key, value pairs in the file.
+
+        The keys are never decoded into arrays, so they can be compared.
+        """
+        while True:
+            try:
+                key = self.read(False)
+            except EOFError:
+                return
+            try:
+                value = self.read()
+            except EOFError:
+                raise ValueError("the typed bytes data ends after a key")
+            yield key, value
+
+    def batches(self,batchsize=1000):
+        """ Iterate over lists of at most batchsize key, value pairs. """
+        pairs = self.pairs()
+        while True:
+            batch = list(itertools.islice(pairs,batchsize))
+            if len(batch) == 0:
+                return
+            yield batch
+
+def row_batches(reader,batchsize=1000):
+    """ Iterate over the rows of a matrix in batches.
+
+    Each value in the file is a row, as a list of doubles, or a packed
+    block of rows (see rowblock.py).
+
+    @return an iterator over (keys, A) pairs where A is an array with
+    one row of the matrix per row and keys has the key for each row.
+    The rows of a packed block all have the key of the block.
+    """
+    import rowblock
+    for batch in reader.batches(batchsize):
+        keys = []
+        rows = []
+        for key,value in batch:
+            if rowblock.isblock(value):
+                block = rowblock.unpack(value)
+                keys.extend([key]*block.shape[0])
+                rows.append(block)
+            else:
+                keys.append(key)
+                rows.append(numpy.asarray(value,dtype=float))
+        yield keys, numpy.atleast_2d(numpy.vstack(rows))
+
+def _output(writer,pairs):
+    if pairs is not None:
+        writer.write_pairs(pairs)
+
+def run(mapper,reducer=None,argv=None):
+    """ Run a mapper or reducer as a Hadoop streaming task with -io typedbytes.
+
+    This is a replacement for hadoopy.run that decodes rows with a
+    Reader.  The mapper is called as mapper(key,value), and the reducer
+    as reducer(key,values) for each group of equal keys.  Both may
+    return an iterator over output pairs, and if they have a close
+    method, then its output pairs are written at the end.
+
+    @param argv the command line, the task is argv[1], 'map' or 'reduce'
+    """
+    if argv is None:
+        argv = sys.argv
+    reader = Reader(sys.stdin)
+    writer = Writer(sys.stdout)
+    if argv[1] == 'map':
+        func = mapper
+        for key,value in reader.pairs():
+            _output(writer,func(key,value))
+    elif argv[1] == 'reduce':
+        func = reducer
+        for key,group in itertools.groupby(reader.pairs(),lambda p: p[0]):
+            _output(writer,func(key,(value for k,value in group)))
+    else:
+        raise ValueError("unknown task %s"%(argv[1]))
+    if hasattr(func,'close'):
+        _output(writer,func.close())
+    sys.stdout.flush()
+
+_names = {BYTES: 'ByteSequence', BYTE: 'Byte', BOOL: 'Boolean',
+    INT: 'Integer', LONG: 'Long', FLOAT: 'Float', DOUBLE: 'Double',
+    STRING: 'String'}
+
+def dump_value(reader,code,indent=0,out=sys.stdout):
+    """ Print one object like cxx/dump_typedbytes_info """
+    pre = ' '*indent
+    if code in (BYTE,BOOL,INT,LONG):
+        out.write("%sTypedBytes%s: %i\n"%(
+            pre,_names[code],reader.read_value(code,False)))
+    elif code in (FLOAT,DOUBLE):
+        out.write("%sTypedBytes%s: %f\n"%(
+            pre,_names[code],reader.read_value(code,False)))
+    elif code == STRING:
+        out.write("%sTypedBytesString: %s\n"%(
+            pre,reader.read_value(code,False)))
+    elif code == BYTES:
+        value = reader.read_value(code,False)
+        out.write("%sTypedBytesByteSequence: length=%i"%(pre,len(value)))
+        if len(value) == 0:
+            out.write("\n")
+        else:
+            first = (value[:8] + '\0'*8)[:8]
+            out.write(" first 8 bytes: %s %s\n"%(
+                first[:4].encode('hex'),first[4:].encode('hex')))
+    elif code == VECTOR or code == MAP:
+        nitems = reader._unpack('>i',4)
+        if code == VECTOR:
+            out.write("%sTypedBytesVector: length=%i\n"%(pre,nitems))
+        else:
+            out.write("%sTypedBytesMap: length=%i\n"%(pre,nitems))
+        for i in xrange(nitems):
+            if code == MAP:
+                out.write("%s Key:\n"%(pre))
+                dump_value(reader,reader.read_code(),indent+2,out)
+                out.write("%s Value:\n"%(pre))
+            dump_value(reader,reader.read_code(),indent+2,out)
+    elif code == LIST:
+        out.write("%sTypedBytesList:\n"%(pre))
+        while True:
+            code = reader.read_code()
+            if code == MARKER or code is None:
+                break
+            dump_value(reader,code,indent+2,out)
+    else:
+        raise ValueError("unknown typed bytes code %i"%(code))
+
+def dump(file,out=sys.stdout):
+    """ Print all the objects in a file like cxx/dump_typedbytes_info """
+    reader = Reader(file,arrays=False)
+    while True:
+        code = reader.read_code()
+        if code is None:
+            break
+        dump_value(reader,code,0,out)
+
+def check(filename):
+    """ Check the reader and writer on a typed bytes file.
+
+    @return true if the file is read and written again exactly and
+    the lists of doubles match the arrays.
+    """
+    data = open(filename,'rb').read()
+    objs = list(Reader(open(filename,'rb'),arrays=False))
+    if ''.join([encode(obj) for obj in objs]) != data:
+        print >>sys.stderr, "ERROR: writing %s changes the bytes"%(filename)
+        return False
+    arrays = list(Reader(open(filename,'rb'),arrays=True,chunksize=64))
+    if len(arrays) != len(objs):
+        print >>sys.stderr, "ERROR: the reader with arrays found %i "\
+            "objects instead of %i"%(len(arrays),len(objs))
+        return False
+    for i,(obj,arr) in enumerate(zip(objs,arrays)):
+        if isinstance(arr,numpy.ndarray):
+            same = (numpy.array(obj,dtype=arr.dtype) == arr).all()
+        else:
+            same = obj == arr
+        if not same:
+            print >>sys.stderr, "ERROR: object %i differs with arrays"%(i)
+            return False
+    return True
+
+if __name__=='__main__':
+    if len(sys.argv) != 3 or sys.argv[1] not in ('-dump','-check'):
+        print >>sys.stderr, "usage: tbio.py -dump|-check <file>"
+        sys.exit(1)
+    if sys.argv[1] == '-dump':
+        dump(open(sys.argv[2],'rb'))
+    elif check(sys.argv[2]):
+        print "CORRECT"
+    else:
+        print "INCORRECT"
+        sys.exit(1)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""
+tbio_test.py
+============
+
+Tests of the typed bytes reader in tbio.py, in particular the NumPy
+decoding of lists of doubles.
+
+    python tbio_test.py
+
+History
+-------
+:2011-03-29: Initial coding
+"""
+
+import os
+import threading
+import unittest
+import StringIO
+
+import numpy
+
+import tbio
+
+class PipeFile:
+    """ The read end of a pipe that returns the bytes available, like
+    streamls.StreamFile, instead of waiting for the whole request. """
+    def __init__(self,fd):
+        self.fd = fd
+
+    def read(self,nbytes):
+        return os.read(self.fd,nbytes)
+
+class SlicedFile:
+    """ A file that returns at most step bytes from each read. """
+    def __init__(self,data,step):
+        self.data = data
+        self.pos = 0
+        self.step = step
+
+    def read(self,nbytes):
+        n = min(nbytes,self.step)
+        data = self.data[self.pos:self.pos+n]
+        self.pos += len(data)
+        return data
+
+def rows(nrows,ncols,seed=0):
+    return numpy.random.RandomState(seed).randn(nrows,ncols)
+
+def encode_rows(A):
+    return ''.join([tbio.encode(i) + tbio.encode(list(row))
+        for i,row in enumerate(A)])
+
+class ReaderTest(unittest.TestCase):
+    def check_rows(self,reader,A):
+        pairs = list(reader.pairs())
+        self.assertEqual(len(pairs),A.shape[0])
+        for i,(key,value) in enumerate(pairs):
+            self.assertEqual(key,i)
+            self.assertTrue(isinstance(value,numpy.ndarray))
+            self.assertTrue(numpy.all(value == A[i]))
+
+    def test_narrow(self):
+        A = rows(100,3)
+        self.check_rows(tbio.Reader(StringIO.StringIO(encode_rows(A))),A)
+
+    def test_wide(self):
+        # wider than the first hint of the reader
+        for ncols in (63,64,65,200,1000):
+            A = rows(20,ncols)
+            reader = tbio.Reader(StringIO.StringIO(encode_rows(A)))
+            self.check_rows(reader,A)
+            self.assertEqual(reader.hint,ncols)
+
+    def test_changing_widths(self):
+        data = ''.join([tbio.encode(i) + tbio.encode([float(j)
+            for j in xrange(n)]) for i,n in enumerate([5,300,1,70,2])])
+        values = [v for k,v in tbio.Reader(StringIO.StringIO(data)).pairs()]
+        self.assertEqual([len(v) for v in values],[5,300,1,70,2])
+        for v in values:
+            self.assertTrue(numpy.all(v == numpy.arange(len(v))))
+
+    def test_mixed_list(self):
+        obj = [1.5]*100 + [3, 'x']
+        value = tbio.Reader(StringIO.StringIO(tbio.encode(obj))).read()
+        self.assertEqual(value,obj)
+
+    def test_truncated(self):
+        data = tbio.encode(list(rows(1,100)[0]))
+        reader = tbio.Reader(StringIO.StringIO(data[:-5]))
+        self.assertRaises(ValueError,reader.read)
+
+    def test_small_reads(self):
+        A = rows(30,150)
+        data = encode_rows(A)
+        for step in (1,7,9,100,4096):
+            self.check_rows(tbio.Reader(SlicedFile(data,step)),A)
+
+    def test_pipe(self):
+        A = rows(50,100)
+        rfd,wfd = os.pipe()
+        def write():
+            f = os.fdopen(wfd,'wb',0)
+            for i in xrange(A.shape[0]):
+                f.write(tbio.encode(i) + tbio.encode(list(A[i])))
+            f.close()
+        writer = threading.Thread(target=write)
+        writer.start()
+        reader = tbio.Reader(PipeFile(rfd))
+        self.check_rows(reader,A)
+        writer.join()
+        os.close(rfd)
+
+    def test_pipe_does_not_wait(self):
+        # a record is returned without any bytes of the next record
+        rfd,wfd = os.pipe()
+        reader = tbio.Reader(PipeFile(rfd))
+        try:
+            for ncols in (3,100,100,10):
+                row = list(rows(1,ncols)[0])
+                os.write(wfd,tbio.encode(ncols) + tbio.encode(row))
+                result = []
+                t = threading.Thread(target=lambda: result.append(
+                    reader.pairs().next()))
+                t.daemon = True
+                t.start()
+                t.join(5.)
+                self.assertFalse(t.isAlive(),
+                    'the reader waited for the next record')
+                key,value = result[0]
+                self.assertEqual(key,ncols)
+                self.assertTrue(numpy.all(value == row))
+                self.assertEqual(reader.pos,len(reader.buf))
+        finally:
+            os.close(wfd)
+            os.close(rfd)
+
+if __name__=='__main__':
+    unittest.main()
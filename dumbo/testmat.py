@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+"""
+testmat.py
+==========
+
+Generate TSQR test problems in a single pass.
+
+The test matrix is
+
+    A = [Q_1; Q_2; ... ; Q_s]*R/sqrt(s)
+
+where each Q_i is a random local-by-n matrix with orthonormal columns
+and R is the upper triangle of the all ones matrix.  Then A'*A = R'*R
+and so the R factor of A is R, up to the signs of its rows.  The rows
+from each task only depend on the seed and the index of the task, so
+all the tasks run in parallel in a single pass.  The same tasks run
+as map tasks in generate_test_problems.py, or as local processes here.
+
+Usage
+-----
+
+    python testmat.py -nrows <int> -ncols <int> -output <dir> \\
+        [-maprows <int> -maxlocal <int> -seed <int> -nprocs <int> \\
+         -format rows|blocks -rows_per_block <int> \\
+         -filetype typedbytes|seqfile|npy]
+
+      -output <dir> : the local directory for the output.  Each task
+        writes one file, part-<task>.tb, part-<task> or part-<task>.npy.
+
+      -maprows <int> : the number of rows for each task.  The default
+        is 2*ncols.
+
+      -maxlocal <int> : the number of rows in each Q_i.  The default,
+        and the minimum, is ncols.
+
+      -seed <int> : the seed for the random number generator.  The
+        default is 0.
+
+      -nprocs <int> : the number of processes.  The default is the
+        number of processors.
+
+      -format rows|blocks : with rows, each record is one row of the
+        matrix.  With blocks, each record is a packed block of
+        rows_per_block rows (see rowblock.py).  The default is rows.
+
+      -filetype typedbytes|seqfile|npy : write a typed bytes file of
+        records, a block compressed sequence file of records, or a .npy
+        file with the rows.  The default is typedbytes.
+        A typed bytes file is loaded into HDFS as a sequence file with
+          hadoop jar $HADOOP_STREAMING_JAR loadtb <hdfspath> < part-00000.tb
+        and a sequence file is copied into HDFS with hadoop fs -put.
+
+History
+-------
+:2011-03-14: Initial coding based on generate_test_problems.py
+"""
+
+__author__ = 'David F. Gleich'
+
+import sys
+import os
+import math
+
+import numpy
+import numpy.linalg
+import numpy.lib.format
+
+import rowblock
+import tbio
+import seqfile
+import local_util
+
+def problem_size(m,n,maprows,maxlocal):
+    """ Adjust the size of a test problem so each task has an integer
+    number of local blocks and the matrix has an integer number of tasks.
+
+    @return a tuple (m,maprows,local) of the adjusted sizes.
+    """
+    local = max(maxlocal,n)
+    if maprows < local:
+        maprows = local
+        print >>sys.stderr, "'maprows' adjusted to", maprows, \
+            "to ensure maprows >= maxlocal >= ncols"
+    if maprows % local is not 0:
+        maprows = (maprows/local)*local
+        print >>sys.stderr, "'maprows' adjusted to", maprows, \
+            "to ensure integer k in maprows=k*maxlocal"
+    if m % maprows is not 0:
+        m = ((m/maprows)+1)*maprows
+        print >>sys.stderr, "'nrows' changed to", m, \
+            "to ensure scalar integer k in nrows=k*maprows"
+    return m, maprows, local
+
+def task_blocks(task,m,n,maprows,local,seed=0,status=None):
+    """ Generate the rows of the test matrix for one task.
+
+    @param task the index of the task
+    @param m the number of rows in the matrix
+    @param n the number of columns in the matrix
+    @param maprows the number of rows for each task
+    @param local the number of rows in each block
+    @param seed the seed for the whole matrix
+    @param status an optional function to report the status
+    @return an iterator over (rowoffset, block) pairs where block is
+    a local-by-n array.
+    """
+    state = numpy.random.RandomState([seed,task])
+    nblocks = m/local
+    scale = 1./math.sqrt(nblocks)
+    offset = task*maprows
+    nsteps = maprows/local
+    for i in xrange(nsteps):
+        if status is not None:
+            status('step %i/%i: generating local %i-by-%i Q matrix'%(
+                i+1,nsteps,local,n))
+        Q = numpy.linalg.qr(state.randn(local,n))[0] # just the Q factor
+        # Q*R is a cumulative sum over the columns of Q because R
+        # is the upper triangle of the all ones matrix
+        A = numpy.cumsum(Q,axis=1)
+        A *= scale
+        yield offset+i*local, A
+
+def records(blocks,format='rows',rows_per_block=None):
+    """ Convert blocks of rows into the records for the output.
+
+    @param blocks an iterator over (rowoffset, block) pairs
+    @param format 'rows' for a record per row, keyed by the row index,
+    or 'blocks' for packed row blocks keyed by the row offset.
+    @param rows_per_block the number of rows in each packed block, the
+    default is the number of rows in each of the blocks
+    """
+    for offset,A in blocks:
+        if format == 'rows':
+            for i in xrange(A.shape[0]):
+                yield offset+i, A[i]
+        elif format == 'blocks':
+            nrows = rows_per_block
+            if nrows is None:
+                nrows = A.shape[0]
+            for key,value in rowblock.blocks(A,nrows,offset):
+                yield key, value
+        else:
+            raise ValueError("unknown format %s"%(format))
+
+def write_task(opts):
+    """ Write the rows of one task to a local file. """
+    task = opts['task']
+    m,n = opts['nrows'], opts['ncols']
+    maprows,local = opts['maprows'], opts['local']
+    blocks = task_blocks(task,m,n,maprows,local,opts['seed'])
+
+    if opts['filetype'] == 'npy':
+        filename = os.path.join(opts['output'],'part-%05i.npy'%(task))
+        A = numpy.lib.format.open_memmap(filename,mode='w+',
+            dtype=numpy.float64,shape=(maprows,n))
+        first = task*maprows
+        for offset,block in blocks:
+            A[offset-first:offset-first+block.shape[0]] = block
+        del A
+    elif opts['filetype'] == 'typedbytes':
+        filename = os.path.join(opts['output'],'part-%05i.tb'%(task))
+        writer = tbio.Writer(open(filename,'wb'))
+        writer.write_pairs(records(blocks,opts['format'],
+            opts['rows_per_block']))
+        writer.close()
+    elif opts['filetype'] == 'seqfile':
+        filename = os.path.join(opts['output'],'part-%05i'%(task))
+        writer = seqfile.Writer(open(filename,'wb'))
+        writer.write_pairs(records(blocks,opts['format'],
+            opts['rows_per_block']))
+        writer.close()
+    else:
+        raise ValueError("unknown filetype %s"%(opts['filetype']))
+    return filename
+
+def main(args):
+    m = int(args['nrows'])
+    n = int(args['ncols'])
+    output = args['output']
+    maprows = int(args.get('maprows',2*n))
+    maxlocal = int(args.get('maxlocal',n))
+    nprocs = args.get('nprocs',None)
+    if nprocs is not None:
+        nprocs = int(nprocs)
+    rows_per_block = args.get('rows_per_block',None)
+    if rows_per_block is not None:
+        rows_per_block = int(rows_per_block)
+
+    m,maprows,local = problem_size(m,n,maprows,maxlocal)
+    ntasks = m/maprows
+
+    if not os.path.isdir(output):
+        os.makedirs(output)
+
+    tasks = []
+    for task in xrange(ntasks):
+        tasks.append({'task': task, 'nrows': m, 'ncols': n,
+            'maprows': maprows, 'local': local,
+            'seed': int(args.get('seed',0)), 'output': output,
+            'format': args.get('format','rows'),
+            'rows_per_block': rows_per_block,
+            'filetype': args.get('filetype','typedbytes')})
+
+    local_util.setstatus('generating %i-by-%i matrix with %i tasks'%(
+        m,n,ntasks))
+    files = local_util.run_tasks(write_task,tasks,nprocs)
+    local_util.setstatus('wrote %i files to %s'%(len(files),output))
+
+if __name__=='__main__':
+    args = local_util.get_args(sys.argv[1:])
+    for key in ['nrows','ncols','output']:
+        if key not in args:
+            print >>sys.stderr, "Error: -%s not specified"%(key)
+            sys.exit(1)
+    main(args)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+"""
+textrows.py
+===========
+
+Parse the rows of a textual matrix in bulk with NumPy.
+
+A textual matrix (a .tmat file) has one row per line with the entries
+separated by whitespace.  Instead of calling float on each entry, the
+routines here join a batch of lines and parse all of them with one
+call to numpy.fromstring.  This module doesn't depend on dumbo or hadoop,
+so matrix2seqfile.py uses it in the mappers and it also runs as a
+local tool that converts a large .tmat file with many processes.  Each
+process converts one byte range of the file, like a Hadoop split.
+
+Usage
+-----
+
+    python textrows.py -input <file.tmat> -output <dir> \\
+        [-nprocs <int> -split_size <bytes> -format rows|blocks \\
+         -rows_per_block <int> -batchsize <int> -filetype typedbytes|seqfile]
+
+      -output <dir> : the local directory for the output.  Each split
+        is written to a file part-<split>.tb or part-<split>.
+
+      -nprocs <int> : the number of processes.  The default is the
+        number of processors.
+
+      -split_size <bytes> : the size of each byte range of the input.
+        The default is 256MB.
+
+      -format rows|blocks : with rows, each record is one row keyed by
+        the byte offset of its line, like the mappers in matrix2seqfile.py.
+        With blocks, each record is a packed block of rows (see rowblock.py)
+        keyed by the tuple (byte offset of its first line,).  The default
+        is rows.
+
+      -rows_per_block <int> : the number of rows in each block.  The
+        default is 1000.
+
+      -batchsize <int> : the number of lines to parse at once.  The
+        default is 1000.
+
+      -filetype typedbytes|seqfile : write typed bytes files, which are
+        loaded into HDFS with
+          hadoop jar $HADOOP_STREAMING_JAR loadtb <hdfspath> < part-00000.tb
+        or block compressed sequence files, which are copied into HDFS
+        with hadoop fs -put.  The default is typedbytes.
+
+History
+-------
+:2011-03-15: Initial coding
+"""
+
+import sys
+import os
+import itertools
+
+import numpy
+
+import rowblock
+import tbio
+import seqfile
+import local_util
+
+def parse_lines(lines,ncols=None):
+    """ Parse a batch of lines from a textual matrix.
+
+    Empty lines are skipped.  A line is malformed if it has a different
+    number of entries from the first row, or if an entry isn't a number.
+
+    @param lines the list of lines
+    @param ncols the number of columns, the default is the number of
+    entries in the first non-empty line.
+    @return a tuple (A, index, nmalformed) where A has one row for each
+    line lines[i] for i in index, and nmalformed is the number of
+    malformed lines.
+    """
+    counts = numpy.array([len(line.split()) for line in lines],dtype=int)
+    nonempty = counts > 0
+    if ncols is None:
+        if not nonempty.any():
+            return numpy.zeros((0,0)), numpy.zeros(0,dtype=int), 0
+        ncols = counts[nonempty][0]
+    good = counts == ncols
+    index = numpy.flatnonzero(good)
+    values = numpy.fromstring(' '.join(itertools.compress(lines,good)),
+        sep=' ')
+    if values.size != len(index)*ncols:
+        # some entry isn't a number, so parse the lines one at a time
+        rows = []
+        keep = []
+        for i in index:
+            try:
+                rows.append([float(v) for v in lines[i].split()])
+                keep.append(i)
+            except ValueError:
+                pass
+        index = numpy.array(keep,dtype=int)
+        values = numpy.array(rows,dtype=float)
+    A = values.reshape(len(index),ncols)
+    return A, index, int(nonempty.sum()) - len(index)
+
+class LineBatch:
+    """ Collect the lines of a textual matrix and parse them in batches.
+
+    The mappers append each line of text as it arrives.  When append
+    returns True, the batch is full and the mapper parses it with one
+    call to parse_lines and adds the rows to its own buffer.
+    """
+    def __init__(self,batchsize=1000):
+        self.batchsize = batchsize
+        self.keys = []
+        self.lines = []
+
+    def __len__(self):
+        return len(self.lines)
+
+    def append(self,key,line):
+        """ Add a line to the batch.
+
+        @return True if the batch is full
+        """
+        self.keys.append(key)
+        self.lines.append(line)
+        return len(self.lines) >= self.batchsize
+
+    def parse(self,ncols=None):
+        """ Parse the lines in the batch and clear it.
+
+        @param ncols the number of columns, see parse_lines
+        @return a tuple (keys, A, nmalformed) where A has one row for
+        each key in keys
+        """
+        if len(self.lines) == 0:
+            return [], numpy.zeros((0,ncols or 0)), 0
+        A,index,nbad = parse_lines(self.lines,ncols)
+        keys = [self.keys[i] for i in index]
+        self.keys = []
+        self.lines = []
+        return keys, A, nbad
+
+def byte_ranges(size,split_size):
+    """ Split the bytes of a file into ranges of split_size bytes.
+
+    @return a list of (start,end) pairs
+    """
+    split_size = max(int(split_size),1)
+    return [(start,min(start+split_size,size))
+        for start in xrange(0,size,split_size)]
+
+def read_split(file,start,end,batchsize=1000):
+    """ Read the lines of a file that start in a byte range.
+
+    Like a Hadoop split, a line that starts in the range and continues
+    past the end is part of this range, and a line that starts before
+    the range is part of the previous range.
+
+    @param file a file opened in binary mode
+    @return an iterator over (offsets, lines) pairs where offsets is
+    the list of the byte offsets of each line.
+    """
+    if start > 0:
+        file.seek(start-1)
+        file.readline() # skip the rest of the previous line
+    else:
+        file.seek(0)
+    pos = file.tell()
+    while pos < end:
+        lines = file.readlines(batchsize*80)
+        if len(lines) == 0:
+            break
+        offsets = []
+        for i,line in enumerate(lines):
+            if pos >= end:
+                lines = lines[:i]
+                break
+            offsets.append(pos)
+            pos += len(line)
+        yield offsets, lines
+
+def records(batches,format='rows',rows_per_block=1000,ncols=None):
+    """ Convert batches of lines into records for a sequence file.
+
+    @param batches an iterator over (keys, lines) pairs
+    @return an iterator over (key, value) pairs where each value is a
+    row as an array or a packed row block.
+    """
+    nmalformed = 0
+    for keys,lines in batches:
+        A,index,nbad = parse_lines(lines,ncols)
+        nmalformed += nbad
+        if len(index) == 0:
+            continue
+        ncols = A.shape[1]
+        if format == 'rows':
+            for i,row in zip(index,A):
+                yield keys[i], row
+        elif format == 'blocks':
+            for start in xrange(0,len(index),rows_per_block):
+                yield (rowblock.tuple_key(keys[index[start]]),
+                    rowblock.pack(A[start:start+rows_per_block]))
+        else:
+            raise ValueError("unknown format %s"%(format))
+    if nmalformed > 0:
+        print >>sys.stderr, "skipped %i malformed lines"%(nmalformed)
+
+def convert_split(opts):
+    """ Convert one byte range of a textual matrix to a file. """
+    if opts['filetype'] == 'seqfile':
+        filename = os.path.join(opts['output'],'part-%05i'%(opts['split']))
+        writer = seqfile.Writer(open(filename,'wb'))
+    else:
+        filename = os.path.join(opts['output'],'part-%05i.tb'%(opts['split']))
+        writer = tbio.Writer(open(filename,'wb'))
+    input = open(opts['input'],'rb')
+    batches = read_split(input,opts['start'],opts['end'],opts['batchsize'])
+    writer.write_pairs(records(batches,opts['format'],opts['rows_per_block']))
+    writer.close()
+    input.close()
+    return filename
+
+def main(args):
+    input = args['input']
+    output = args['output']
+    nprocs = args.get('nprocs',None)
+    if nprocs is not None:
+        nprocs = int(nprocs)
+    split_size = int(args.get('split_size',256*1024*1024))
+    format = args.get('format','rows')
+    if format not in ('rows','blocks'):
+        print >>sys.stderr, "Error: -format must be rows or blocks"
+        sys.exit(1)
+    filetype = args.get('filetype','typedbytes')
+    if filetype not in ('typedbytes','seqfile'):
+        print >>sys.stderr, "Error: -filetype must be typedbytes or seqfile"
+        sys.exit(1)
+
+    if not os.path.isdir(output):
+        os.makedirs(output)
+
+    tasks = []
+    size = os.path.getsize(input)
+    for split,(start,end) in enumerate(byte_ranges(size,split_size)):
+        tasks.append({'input': input, 'output': output, 'split': split,
+            'start': start, 'end': end, 'format': format,
+            'rows_per_block': int(args.get('rows_per_block',1000)),
+            'batchsize': int(args.get('batchsize',1000)),
+            'filetype': filetype})
+
+    local_util.setstatus('converting %s with %i splits'%(input,len(tasks)))
+    files = local_util.run_tasks(convert_split,tasks,nprocs)
+    local_util.setstatus('wrote %i files to %s'%(len(files),output))
+
+if __name__=='__main__':
+    args = local_util.get_args(sys.argv[1:])
+    for key in ['input','output']:
+        if key not in args:
+            print >>sys.stderr, "Error: -%s not specified"%(key)
+            sys.exit(1)
+    main(args)
@@ -5,17 +5,88 @@ tsqr.py
 ===========
 
 Implement a tsqr algorithm using dumbo and numpy
+
+Before the job starts, the R factor of the matrix is looked up in the
+cache from rcache.py, in the directory from the option -rcache <dir>
+(the default is ~/.mrtsqr/rcache).  If it's there, the output is
+written from the cache and no job runs.  Otherwise, the driver stores
+the R factor in the output in the cache when it exits after the last
+stage, except for the pivoted R of -rank_revealing and the R of
+-append_to.  Use -rcache no to disable the cache.
+
+With -append_to <path>, the R factor in path is updated with the rows
+in -mat, e.g. the rows appended to a matrix since path was computed.
+The job only reads the new rows.  The starter reads the old R factor
+and ships it to the reducer of the last stage, which stacks it with
+the R factors of the new rows, so the last stage of -reduce_schedule
+must have one reducer.  The file <output>.absorbed lists the
+fingerprint of every input in the R factor, see checkpoint.py, and
+a file that is already in the old R factor is an error.  The driver
+writes the file when it exits after the last stage, and only if the
+output exists, so a failed job leaves no list for its output.
+
+With -rank_revealing yes, the last reducer computes the QR
+factorization with column pivoting of R, see rrqr.py, with the
+relative tolerance -rank_tol (the default is max(m,n)*eps, and the
+stages count the m rows of the matrix for it).  The output
+is then the first r rows of the pivoted R factor with the keys 0 to
+r-1, the record ('rank', r), and the record ('columns', the permutation
+of the columns with the r independent columns first).  This can't be
+used with -append_to, and an R factor in the cache is only used if the
+entry has the number of rows too, as svd.py stores it.
+
+Each stage of -reduce_schedule writes its output to <output>_pre<i>,
+and the output of the last stage is the output.  When a stage starts,
+the driver writes the manifest of the stage before it, see
+checkpoint.py, and keeps the outputs of the stages.  When the driver
+runs again, it skips the stages whose manifest is still current and
+starts from the first stale stage, e.g. after the last stage failed.
+The last stage always runs.  Use -checkpoint no to run every stage.
+
+For a wide matrix, with thousands of columns, use -panel <int> to
+update R one panel of columns at a time from a buffer of
+blocksize*panel rows, see tsqrlib.py.  Each task then needs memory for
+R and blocksize*panel rows instead of blocksize*ncols rows.
+
+With -memstats yes or -memstats <dir>, each task reports its peak
+memory and the peak size of its buffers, see memstats.py, and
+-tracemalloc <n> adds the n largest allocation sites.
+
+With -profile cprofile or -profile sample, each task runs under a
+profiler and writes its profile to the output of its stage, or to
+-profile_dir <dir> on the node, see taskprof.py.  Merge the profiles
+with profile_report.py.
+
+With -trace yes or -trace <dir>, each task records the spans of its
+reads, compresses, and output, and the driver records the launch of
+each stage, see tasktrace.py.  Merge the traces of all the stages into
+one Chrome trace with tasktrace.py.
+
+With -reducestats yes, the default with -hadoop, each reducer measures
+its input, the keys, rows, bytes, and R factors it merged, and the
+driver prints the skew of the reducers of each stage after the job,
+see reducestats.py.  Use -reducestats no to turn this off, or
+-reducestats <dir> to write the measurements to a local directory on
+each node.  In the local mode of dumbo, -reducestats yes writes them to
+<output>.reducestats.
 """
 
 import sys
 import os
-import time
 import random
+import json
+import atexit
 
 import numpy
 import numpy.linalg
 
 import util
+import rowblock
+import tsqrlib
+import rrqr
+import checkpoint
+import rcache
+import tasktrace
 
 import dumbo
 import dumbo.backends.common
@@ -23,9 +94,23 @@ import dumbo.backends.common
 # create the global options structure
 gopts = util.GlobalOptions()
 
-class SerialTSQR(dumbo.backends.common.MapRedBase):
-    def __init__(self,blocksize=3,keytype='random',isreducer=False):
-        self.blocksize=blocksize
+class SerialTSQR(tsqrlib.TSQR,dumbo.backends.common.MapRedBase):
+    """ The TSQR mapper and reducer, see tsqrlib.TSQR.
+
+    With count_rows, each task also outputs the number of rows of the
+    matrix in its R factor as a record with the key countkey, so the
+    last stage knows the number of rows m for the default rank
+    tolerance, see rrqr.py.  The tasks that read the matrix use
+    count_rows='rows' to count its rows, and the later tasks use
+    count_rows='counts' to add up the counts from the last stage.
+    """
+
+    countkey = 'row count'
+
+    def __init__(self,blocksize=3,keytype='random',isreducer=False,
+            prior=None,rank_revealing=False,rank_tol=None,panel=None,
+            count_rows=False):
+        tsqrlib.TSQR.__init__(self,blocksize=blocksize,panel=panel)
         if keytype=='random':
             self.keyfunc = lambda x: random.randint(0, 4000000000)
         elif keytype=='first':
@@ -34,9 +119,13 @@ class SerialTSQR(dumbo.backends.common.MapRedBase):
             raise Error("Unkonwn keytype %s"%(keytype))
         self.first_key = None
         self.isreducer=isreducer
-        self.nrows = 0
-        self.data = []
-        self.ncols = None
+        # the text file with an R factor to stack with the rows
+        self.prior = prior
+        self.rank_revealing = rank_revealing
+        self.rank_tol = rank_tol
+        self.count_rows = count_rows
+        # the rows of the matrix in the R factors from the last stage
+        self.rowcount = 0
     
     def _firstkey(self, i):
         if isinstance(self.first_key, (list,tuple)):
@@ -46,103 +135,290 @@ class SerialTSQR(dumbo.backends.common.MapRedBase):
     
     def array2list(self,row):
         return [float(val) for val in row]
-
-    def QR(self):
-        A = numpy.array(self.data)
-        return numpy.linalg.qr(A,'r')
         
-    def compress(self):
-        """ Compute a QR factorization on the data accumulated so far. """
-        if self.ncols is None:
-            return
-        if len(self.data) < self.ncols:
-            return
-            
-        t0 = time.time()
-        R = self.QR()
-        dt = time.time() - t0
-        self.counters['numpy time (millisecs)'] += int(1000*dt)
+    def counter(self,group,name,value):
+        self.counters[name] += value
         
-        # reset data and re-initialize to R
-        self.data = []
-        for row in R:
-            self.data.append(self.array2list(row))
-            
-            
+    def message(self,msg):
+        print >>sys.stderr, msg
     
     def collect(self,key,value):
-        if len(self.data) == 0:
+        if self.first_key is None:
             self.first_key = key
+        self.add_row(value)
         
-        if self.ncols == None:
-            self.ncols = len(value)
-            print >>sys.stderr, "Matrix size: %i columns"%(self.ncols)
-        else:
-            # TODO should we warn and truncate here?
-            # No. that seems like something that will introduce
-            # bugs.  Maybe we could add a "liberal" flag
-            # for that.
-            assert(len(value) == self.ncols)
+    def collect_block(self,key,block):
+        """ Collect a 2d array of rows at once.
         
-        self.data.append(value)
-        self.nrows += 1
+        @param key the key for the first row of the block
+        @param block a numpy array with one row of the matrix per row
+        """
+        if self.first_key is None:
+            self.first_key = key
+        self.add_block(block)
         
-        if len(self.data)>self.blocksize*self.ncols:
-            self.counters['QR Compressions'] += 1
-            # compress the data
-            self.compress()
-            
-        # write status updates so Hadoop doesn't complain
-        if self.nrows%50000 == 0:
-            self.counters['rows processed'] += 50000
+    def collect_value(self,key,value):
+        """ Collect a row, a row of text, or a packed block of rows. """
+        if self.count_rows and key == self.countkey:
+            self.rowcount += value
+        elif rowblock.isblock(value):
+            self.collect_block(key,rowblock.unpack(value))
+        elif isinstance(value, str):
+            self.collect_line(key,value)
+        else:
+            self.collect(key,value)
+
+    def collect_line(self,key,line):
+        """ Collect a row as a line of text, see tsqrlib.TSQR.add_line """
+        if self.first_key is None:
+            self.first_key = key
+        self.add_line(line)
+
+    def matrix_rows(self):
+        """ The number of rows of the matrix in the R factor, or None
+        without count_rows. """
+        if self.count_rows == 'rows':
+            return self.nrows
+        elif self.count_rows == 'counts':
+            return self.rowcount
+        return None
 
     def close(self):
-        self.counters['rows processed'] += self.nrows%50000
-        self.compress()
-        for i,row in enumerate(self.data):
+        R = self.result()
+        if self.rank_revealing:
+            for key,val in self.close_pivoted(R):
+                yield key,val
+            return
+        for i,row in enumerate(R):
             key = self.keyfunc(i)
-            yield key, row
+            yield key, self.array2list(row)
+        if self.count_rows:
+            yield self.countkey, self.matrix_rows()
+            
+    def close_pivoted(self,R):
+        """ Output the pivoted R factor of the independent columns. """
+        pairs = pivoted_output(R,self.rank_tol,self.matrix_rows())
+        self.counter('Program','numerical rank',len(pairs)-2)
+        return pairs
             
     def __call__(self,data):
         if self.isreducer == False:
             # map job
             for key,value in data:
-                if isinstance(value, str):
-                    # handle conversion from string
-                    value = [float(p) for p in value.split()]
-                self.collect(key,value)
+                self.collect_value(key,value)
                 
         else:
             for key,values in data:
                 for value in values:
-                    self.collect(key,value)
+                    self.collect_value(key,value)
+        if self.prior:
+            self.add_block(numpy.atleast_2d(numpy.loadtxt(self.prior)))
         # finally, output data
         for key,val in self.close():
             yield key,val
+        tasktrace.since('emit')
+    
+class CenteredTSQR(SerialTSQR):
+    """ Compute the R factor of the column-centered matrix in one pass.
+    
+    Next to its R factor, each task keeps the number of rows it has
+    seen and their column mean.  The R factor is always for the
+    centered rows.  When two pieces with counts n1 and n2 and means m1
+    and m2 are merged, the rank-one correction row
+      sqrt(n1*n2/(n1+n2))*(m1 - m2)
+    is stacked with the two R factors before the QR compression.  The
+    count and mean travel between the stages as a single record with
+    the key meankey and the value (count, mean).
+    
+    With center=False, this class is the same as SerialTSQR.
+    """
+    
+    meankey = 'column mean'
+    
+    def __init__(self,blocksize=3,keytype='random',isreducer=False,
+            center=True):
+        SerialTSQR.__init__(self,blocksize=blocksize,keytype=keytype,
+            isreducer=isreducer)
+        self.center = center
+        self.count = 0
+        self.mean = None
+        # the number of rows at the start of the buffer that are 
+        # already centered, the others are raw rows from the input
+        self.ncentered = 0
+        
+    def merge_mean(self,count,mean):
+        """ Merge the column mean of count rows into the running mean.
+        
+        @return the correction row for the R factor, or None for
+        the first mean.
+        """
+        if self.count == 0:
+            self.count = count
+            self.mean = numpy.array(mean,dtype=float)
+            return None
+        total = self.count + count
+        corr = numpy.sqrt(float(self.count)*count/total)*(self.mean - mean)
+        self.mean += (float(count)/total)*(mean - self.mean)
+        self.count = total
+        return corr
+        
+    def _center(self):
+        """ Center the raw rows in the buffer and merge their mean. """
+        if self.isreducer or self.nbuffered == self.ncentered:
+            return
+        A = numpy.vstack(self.data)
+        B = A[self.ncentered:]
+        mean = B.mean(axis=0)
+        parts = [A[:self.ncentered], B - mean]
+        corr = self.merge_mean(B.shape[0],mean)
+        if corr is not None:
+            parts.append(corr[numpy.newaxis,:])
+        self.data = [numpy.vstack(parts)]
+        self.nbuffered = self.data[0].shape[0]
+        self.ncentered = self.nbuffered
+        
+    def compress(self):
+        if self.center and self.ncols is not None:
+            self._center()
+        SerialTSQR.compress(self)
+        self.ncentered = self.nbuffered
+        
+    def collect(self,key,value):
+        if self.center and key == self.meankey:
+            count,mean = value
+            corr = self.merge_mean(count,numpy.array(mean))
+            if corr is not None:
+                SerialTSQR.collect(self,key,corr)
+        else:
+            SerialTSQR.collect(self,key,value)
+            
+    def close(self):
+        for key,val in SerialTSQR.close(self):
+            yield key,val
+        if self.center and self.count > 0:
+            yield self.meankey, (self.count, self.array2list(self.mean))
+    
+def pivoted_output(R,tol=None,m=None):
+    """ Return the output pairs of a rank-revealing last stage.
+
+    @param m the number of rows of the matrix for the default tol
+    """
+    Rp,columns,r = rrqr.rrqr(R,tol,m)
+    pairs = [(i, util.array2list(row)) for i,row in enumerate(Rp)]
+    pairs.append(('rank', r))
+    pairs.append(('columns', [int(c) for c in columns]))
+    return pairs
+
+def absorbed_path(output):
+    return output.rstrip('/')+'.absorbed'
+
+def read_absorbed(fs,output):
+    """ Read the list of inputs in the R factor in output, or return
+    None if there is no list. """
+    data = fs.cat(absorbed_path(output))
+    if not data:
+        return None
+    try:
+        return json.loads(data)['inputs']
+    except (ValueError,KeyError,TypeError):
+        return None
+
+def write_absorbed(fs,output,mat,append_to=''):
+    """ Write the list of inputs in the R factor in output: the inputs
+    in the R factor in append_to and the files in mat. """
+    inputs = checkpoint.fingerprint(fs,[mat])
+    if append_to:
+        inputs = (read_absorbed(fs,append_to) or []) + inputs
+    fs.write(absorbed_path(output),json.dumps({'inputs': sorted(inputs),
+        'append_to': append_to or None},indent=1))
+
+def last_stage(premapper):
+    """ Add to the premapper of the last stage: when the driver exits
+    with the output of the job, write <output>.absorbed and store the R
+    factor in the cache, see rcache.py. """
+    def last_premapper(backend,fs,opts):
+        premapper(backend,fs,opts)
+        jobfs = gopts.jobfs()
+        output = gopts.getstrkey('job_output')
+        def absorbed():
+            if jobfs.exists(output):
+                write_absorbed(jobfs,output,gopts.getstrkey('input'),
+                    gopts.getstrkey('append_to'))
+        atexit.register(absorbed)
+        rcache.store_at_exit(gopts.getstrkey('rcache'),jobfs,
+            [gopts.getstrkey('input')],output)
+    return last_premapper
+    
+def job_params():
+    """ The parameters of the stages in their manifests, see
+    util.GlobalOptions.first_stage. """
+    return {'script': 'tsqr.py',
+        'blocksize': gopts.getintkey('blocksize'),
+        'panel': gopts.getintkey('panel',0),
+        'rank_revealing': gopts.getstrkey('rank_revealing','no')}
     
 def runner(job):
     #niter = int(os.getenv('niter'))
     
     blocksize = gopts.getintkey('blocksize')
     schedule = gopts.getstrkey('reduce_schedule')
+    panel = gopts.getintkey('panel',0) or None
+    prior = gopts.getstrkey('append_R','')
+    rank_revealing = gopts.getstrkey('rank_revealing','no') == 'yes'
+    rank_tol = gopts.getstrkey('rank_tol','')
+    if rank_tol:
+        rank_tol = float(rank_tol)
+    else:
+        rank_tol = None
+    
+    # with rank_revealing, the stages count the rows of the matrix for
+    # the rank tolerance, see SerialTSQR
+    count_rows = None
+    if rank_revealing:
+        count_rows = 'rows'
     
     schedule = schedule.split(',')
+    # the stages before first are current, see starter
+    first = gopts.getintkey('first_stage',0)
     for i,part in enumerate(schedule):
+        # record the launch of each stage and report the reducers of
+        # the last stage in the driver
+        premapper = gopts.premapper('tsqr','%i (%s)'%(i+1,part))
+        if i+1 == len(schedule):
+            premapper = last_stage(premapper)
+        kwargs = {'premapper': gopts.staged(premapper,i,schedule,job_params())}
         if part.startswith('s'):
             nreducers = int(part[1:])
             # these tasks should just spray data and compress
+            if i < first:
+                continue
             job.additer(mapper="org.apache.hadoop.mapred.lib.IdentityMapper",
                 reducer="org.apache.hadoop.mapred.lib.IdentityReducer",
-                opts=[('numreducetasks',str(nreducers))])
+                opts=[('numreducetasks',str(nreducers))],**kwargs)
         else:
             nreducers = int(part)
             if i==0:
-                mapper = SerialTSQR(blocksize=blocksize,isreducer=False)
+                mapper = SerialTSQR(blocksize=blocksize,isreducer=False,
+                    panel=panel,count_rows=count_rows)
+                if rank_revealing:
+                    count_rows = 'counts'
             else:
                 mapper = 'org.apache.hadoop.mapred.lib.IdentityMapper'
-            job.additer(mapper=mapper,
-                    reducer=SerialTSQR(blocksize=blocksize,isreducer=True),
-                    opts=[('numreducetasks',str(nreducers))])
+            if i+1 == len(schedule) and (prior or rank_revealing):
+                reducer = SerialTSQR(blocksize=blocksize,isreducer=True,
+                    prior=prior or None,rank_revealing=rank_revealing,
+                    rank_tol=rank_tol,panel=panel,count_rows=count_rows)
+            else:
+                reducer = SerialTSQR(blocksize=blocksize,isreducer=True,
+                    panel=panel,count_rows=count_rows)
+            if rank_revealing:
+                count_rows = 'counts'
+            mapper = gopts.instrument(mapper,'tsqr-%i-map'%(i+1))
+            reducer = gopts.instrument(reducer,'tsqr-%i-reduce'%(i+1))
+            if i < first:
+                continue
+            job.additer(mapper=mapper,reducer=reducer,
+                    opts=[('numreducetasks',str(nreducers))],**kwargs)
     
     
 
@@ -168,17 +444,110 @@ def starter(prog):
         prog.addopt('libegg','numpy')
         
     prog.addopt('file',os.path.join(mypath,'util.py'))
+    prog.addopt('file',os.path.join(mypath,'rowblock.py'))
+    prog.addopt('file',os.path.join(mypath,'tsqrlib.py'))
+    prog.addopt('file',os.path.join(mypath,'memstats.py'))
+    prog.addopt('file',os.path.join(mypath,'taskprof.py'))
+    prog.addopt('file',os.path.join(mypath,'tasktrace.py'))
+    prog.addopt('file',os.path.join(mypath,'reducestats.py'))
+    prog.addopt('file',os.path.join(mypath,'rrqr.py'))
+    prog.addopt('file',os.path.join(mypath,'textrows.py'))
+    prog.addopt('file',os.path.join(mypath,'tbio.py'))
+    prog.addopt('file',os.path.join(mypath,'seqfile.py'))
+    prog.addopt('file',os.path.join(mypath,'local_util.py'))
+    prog.addopt('file',os.path.join(mypath,'checkpoint.py'))
+    prog.addopt('file',os.path.join(mypath,'rcache.py'))
     
     prog.addopt('input',mat)
     matname,matext = os.path.splitext(mat)
     
     gopts.getintkey('blocksize',3)
-    gopts.getstrkey('reduce_schedule','1')
+    gopts.getintkey('panel',0)
+    gopts.getstrkey('memstats','no')
+    gopts.getintkey('tracemalloc',0)
+    try:
+        gopts.getprofile()
+    except ValueError, msg:
+        return str(msg)
+    gopts.gettrace()
+    schedule = gopts.getstrkey('reduce_schedule','1')
+    if gopts.getstrkey('rank_revealing','no') == 'yes':
+        if schedule.split(',')[-1] != '1':
+            return "the last stage of 'reduce_schedule' must be 1 with 'rank_revealing'"
+        gopts.getstrkey('rank_tol','')
     
     
     output = prog.getopt('output')
     if not output:
-        prog.addopt('output','%s-qrr%s'%(matname,matext))
+        output = '%s-qrr%s'%(matname,matext)
+        prog.addopt('output',output)
+        
+    hadoop = prog.getopt('hadoop')
+    if hadoop:
+        fs = checkpoint.HadoopFS(os.path.join(hadoop,'bin','hadoop'))
+    else:
+        fs = checkpoint.LocalFS()
+    # the driver writes its timeline and reads the stats of the
+    # reducers in the output
+    gopts.setjob(output,hadoop)
+    rcachepath = prog.delopt('rcache')
+    
+    # check the inputs in the R factor, see last_stage
+    inputs = checkpoint.fingerprint(fs,[mat])
+    fs.rm(absorbed_path(output))
+    append_to = prog.delopt('append_to')
+    if append_to:
+        if gopts.getstrkey('rank_revealing') == 'yes':
+            return "use 'append_to' or 'rank_revealing', not both"
+        if append_to.rstrip('/') == output.rstrip('/'):
+            return "'append_to' and 'output' must be different"
+        if schedule.split(',')[-1] != '1':
+            return "the last stage of 'reduce_schedule' must be 1 with 'append_to'"
+        R = rcache.read_matrix(fs,append_to)
+        if R.size == 0:
+            return "there is no R factor in %s"%(append_to)
+        absorbed = read_absorbed(fs,append_to)
+        if absorbed is None:
+            print "Warning: %s has no list of inputs"%(absorbed_path(append_to))
+            absorbed = []
+        done = set(f[0] for f in absorbed)
+        for f in inputs:
+            if f[0] in done:
+                return "%s is already in the R factor in %s"%(f[0],append_to)
+        # ship the old R factor to the last reducer
+        Rfile = os.path.split(matname)[1]+'-prior-R.tmat'
+        numpy.savetxt(Rfile,R)
+        prog.addopt('file',Rfile)
+        gopts.setkey('append_R',Rfile)
+        print "Appending the rows in %s to the R factor in %s"%(mat,append_to)
+    gopts.setkey('append_to',append_to or '')
+    
+    # look up the R factor in the cache, and store it after the job
+    # unless the output is a pivoted R or the R of more rows
+    gopts.setkey('input',mat)
+    gopts.setkey('rcache','no')
+    if not append_to:
+        cache,key,arrays = rcache.lookup(rcachepath,fs,[mat])
+        if cache is not None and gopts.getstrkey('rank_revealing') != 'yes':
+            gopts.setkey('rcache',cache.path)
+        if arrays is not None and 'nrows' not in arrays and \
+                gopts.getstrkey('rank_revealing') == 'yes':
+            # the rank tolerance needs the number of rows, see svd.py
+            arrays = None
+        if arrays is not None:
+            print "Found the R factor of %s in %s"%(mat,cache.path)
+            if gopts.getstrkey('rank_revealing') == 'yes':
+                rank_tol = gopts.getstrkey('rank_tol')
+                rcache.write_output(fs,output,pivoted_output(arrays['R'],
+                    float(rank_tol) if rank_tol else None,
+                    int(arrays['nrows'])))
+            else:
+                rcache.write_matrix(fs,output,arrays['R'])
+            write_absorbed(fs,output,mat)
+            sys.exit(0)
+    
+    # skip the stages that are current from the last run
+    gopts.first_stage([mat],schedule.split(','),job_params())
         
     splitsize = prog.delopt('split_size')
     if splitsize is not None:
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+
+"""
+tsqrlib.py
+==========
+
+The serial TSQR compression without dumbo or hadoop.
+
+The TSQR class reads the rows of a tall-and-skinny matrix, one at a
+time, in blocks, or as lines of text, and keeps a small buffer of rows.  When the buffer
+has more than blocksize*ncols rows, it replaces them with their R
+factor.  So it only needs memory for about blocksize*ncols rows.  Lines
+of text are parsed in batches of batchsize lines, see textrows.py.  The
+mappers and reducers in tsqr.py and hadoopy/tsqr.py are thin adapters
+over this class.  With the option -memstats of the drivers, the class
+records the peak size of the buffer before each compress, see
+memstats.py, and with -trace, the spans of each read, parse, and
+compress, see tasktrace.py.
+
+For a wide matrix, with thousands of columns, the buffer of
+blocksize*ncols rows needs blocksize*ncols^2 doubles.  With a panel
+size p, the buffer only has blocksize*p rows, and the rows are added to
+the R factor one panel of p columns at a time, see panel_update.  Then
+the memory is ncols^2 doubles for R and blocksize*p*ncols doubles for
+the buffer, and the work for each row is about the same as with the
+larger buffer.
+
+The tsqr function runs the same compression over a NumPy array, a
+memory map, or an iterator over rows, chunks of rows, or lines, e.g.
+
+    import tsqrlib
+    R = tsqrlib.tsqr(numpy.load('A.npy',mmap_mode='r'))
+    R,QTb = tsqrlib.tsqr(chunks_of_A, b=chunks_of_b)
+    R,G = tsqrlib.tsqr(rows, gram=True)
+
+History
+-------
+:2011-03-18: Initial coding
+"""
+
+import time
+import itertools
+
+import numpy
+import numpy.linalg
+
+import rowblock
+import textrows
+import memstats
+import tasktrace
+
+class TSQR:
+    """ Compress the rows of a matrix into an R factor.
+
+    Subclasses report progress by overriding counter and message.
+
+    @param blocksize compress the buffer after blocksize*ncols rows
+    @param gram also compute G = A'*A from the rows
+    @param batchsize the number of lines of text to parse at once
+    @param panel if set, compress the buffer after blocksize*panel rows
+    and update R one panel of columns at a time, see panel_update
+    """
+    def __init__(self,blocksize=3,gram=False,batchsize=1000,panel=None):
+        self.blocksize = blocksize
+        self.panel = panel
+        self.R = None
+        self.lines = textrows.LineBatch(batchsize)
+        self.gram = gram
+        self.G = None
+        self.nrows = 0
+        self.nreported = 0
+        self.nbuffered = 0
+        # the number of rows at the start of the buffer that are the
+        # R factor from the last compression
+        self.nfactor = 0
+        # the number of compressions, see reducestats.py
+        self.ncompress = 0
+        self.data = []
+        self.ncols = None
+        self.memstats = memstats.MemStats('tsqr')
+
+    def counter(self,group,name,value):
+        """ Increment a counter, see hadoopy.counter. """
+        pass
+
+    def message(self,msg):
+        """ Report a status message. """
+        pass
+
+    def _check_ncols(self,ncols):
+        if self.ncols is None:
+            self.ncols = ncols
+            self.message("Matrix size: %i columns"%(self.ncols))
+            if self.gram:
+                self.G = numpy.zeros((ncols,ncols))
+        elif ncols != self.ncols:
+            raise ValueError("a row with %i cols but row 1 had %i cols"%(
+                ncols, self.ncols))
+
+    def compress(self):
+        """ Compute a QR factorization on the data accumulated so far. """
+        if self.ncols is None or self.nbuffered == self.nfactor:
+            return
+        tasktrace.since('read')
+        self.memstats.buffer('compression buffer',self.data)
+        A = numpy.vstack(self.data)
+        self.ncompress += 1
+        if self.G is not None:
+            rows = A[self.nfactor:]
+            self.G += numpy.dot(rows.T,rows)
+
+        t0 = time.time()
+        if self.panel:
+            # the buffer only has new rows, and R is separate
+            if self.R is None:
+                self.R = numpy.zeros((self.ncols,self.ncols))
+            panel_update(self.R,A,self.panel)
+            self.data = []
+            self.nbuffered = 0
+        else:
+            R = numpy.linalg.qr(A,'r')
+            # reset data and re-initialize to R
+            self.data = [R]
+            self.nbuffered = R.shape[0]
+            self.nfactor = self.nbuffered
+        dt = time.time() - t0
+        self.counter('Timer','numpy time (millisecs)',int(1000*dt))
+        tasktrace.since('compress')
+
+    def report(self):
+        """ Report the rows processed since the last report. """
+        if self.nrows > self.nreported:
+            self.counter('Program','rows processed',
+                self.nrows - self.nreported)
+            self.nreported = self.nrows
+
+    def _buffered(self,nrows):
+        """ Update the counts after nrows were added to the buffer. """
+        self.nbuffered += nrows
+        self.nrows += nrows
+
+        if self.panel:
+            limit = self.blocksize*self.panel
+        else:
+            limit = self.blocksize*self.ncols
+        if self.nbuffered>limit:
+            self.counter('Program','QR Compressions',1)
+            # compress the data
+            self.compress()
+
+        # write status updates so Hadoop doesn't complain
+        if self.nrows - self.nreported >= 50000:
+            self.report()
+
+    def add_row(self,row):
+        """ Add one row, as a list or a 1d array. """
+        self._check_ncols(len(row))
+        self.data.append(row)
+        self._buffered(1)
+
+    def add_block(self,block):
+        """ Add a 2d array with one row of the matrix per row. """
+        self._check_ncols(block.shape[1])
+        self.data.append(block)
+        self._buffered(block.shape[0])
+
+    def add_line(self,line):
+        """ Add one row as a line of text. """
+        if self.lines.append(None,line):
+            self.parse_lines()
+
+    def parse_lines(self):
+        """ Parse the lines of text so far and add their rows.
+
+        Lines with the wrong number of entries, or with an entry that
+        isn't a number, are skipped and counted.
+        """
+        if len(self.lines) == 0:
+            return
+        t0 = time.time()
+        keys,A,nbad = self.lines.parse(self.ncols)
+        tasktrace.span('parse',t0)
+        if nbad > 0:
+            self.counter('Program','malformed lines',nbad)
+        if len(keys) > 0:
+            self.add_block(A)
+
+    def add(self,rows):
+        """ Add one row, a 2d array of rows, a packed row block, or a
+        line of text. """
+        if isinstance(rows,str):
+            if rowblock.isblock(rows):
+                self.add_block(rowblock.unpack(rows))
+            else:
+                self.add_line(rows)
+            return
+        rows = numpy.asarray(rows,dtype=float)
+        if rows.ndim == 1:
+            self.add_row(rows)
+        elif rows.ndim == 2:
+            if rows.shape[0] > 0:
+                self.add_block(rows)
+        else:
+            raise ValueError("rows must be 1d or 2d, not %id"%(rows.ndim))
+
+    def result(self):
+        """ Compress the buffer and return the R factor. """
+        tasktrace.since('read')
+        self.parse_lines()
+        self.report()
+        self.compress()
+        self.memstats.finish(self.counter)
+        if self.panel and self.R is not None:
+            return self.R[:min(self.nrows,self.ncols)]
+        if len(self.data) == 0:
+            return numpy.zeros((0,self.ncols or 0))
+        return numpy.vstack(self.data)
+
+def _householder_wy(h,tau):
+    """ Return the compact WY form I - Y*T*Y' of the Householder
+    reflectors from numpy.linalg.qr(A,'raw'). """
+    k = len(tau)
+    Y = numpy.tril(h.T[:,:k],-1)
+    Y[numpy.arange(k),numpy.arange(k)] = 1.
+    T = numpy.zeros((k,k))
+    for i in xrange(k):
+        T[i,i] = tau[i]
+        if i > 0:
+            T[:i,i] = -tau[i]*numpy.dot(T[:i,:i],numpy.dot(Y[:,:i].T,Y[:,i]))
+    return Y, T
+
+def panel_update(R,A,panel):
+    """ Replace R with the R factor of [R; A] one panel at a time.
+
+    For each panel of columns, this computes the QR factorization of
+    the diagonal block of R stacked on the panel of A, and applies its
+    Householder reflectors in the compact WY form to the rest of the
+    rows of R for the panel and to A.  This is the blocked Householder
+    QR of [R; A] that skips the zeros below the diagonal of R, so the
+    work is about 2*ncols^2*(panel + nrows) flops, and the extra memory
+    is one copy of A.
+
+    @param R an n-by-n upper triangular array, updated in place
+    @param A the new rows, an array with n columns
+    @param panel the number of columns in each panel
+    """
+    n = R.shape[1]
+    A = numpy.array(A,dtype=float)
+    for c0 in xrange(0,n,panel):
+        c1 = min(c0+panel,n)
+        p = c1 - c0
+        h,tau = numpy.linalg.qr(numpy.vstack((R[c0:c1,c0:c1],A[:,c0:c1])),
+            'raw')
+        R[c0:c1,c0:c1] = numpy.triu(h.T[:p])
+        if c1 == n:
+            break
+        Y,T = _householder_wy(h,tau)
+        X = numpy.vstack((R[c0:c1,c1:],A[:,c1:]))
+        X -= numpy.dot(Y,numpy.dot(T.T,numpy.dot(Y.T,X)))
+        R[c0:c1,c1:] = X[:p]
+        A[:,c1:] = X[p:]
+    return R
+
+def chunks(A,chunksize):
+    """ Iterate over the rows of an array or memory map in chunks. """
+    for first in xrange(0,A.shape[0],chunksize):
+        yield A[first:first+chunksize]
+
+def _chunked(rows,chunksize):
+    if isinstance(rows,numpy.ndarray):
+        return chunks(rows,chunksize)
+    return iter(rows)
+
+def _augment(a,b):
+    """ Append the right-hand sides b to the rows a. """
+    if a.ndim == 1:
+        return numpy.hstack((a,numpy.ravel(b)))
+    b = numpy.asarray(b,dtype=float)
+    return numpy.hstack((a,b.reshape(a.shape[0],-1)))
+
+def tsqr(rows,blocksize=3,b=None,gram=False,chunksize=None,panel=None):
+    """ Compute the R factor of a tall-and-skinny matrix in one pass.
+
+    @param rows the matrix as a 2d array or memory map, or an iterator
+    over its rows, over 2d arrays with a few rows each, over packed row
+    blocks, or over lines of text
+    @param blocksize compress the buffer after blocksize*ncols rows
+    @param b the right-hand sides in the same form as rows, i.e. a 1d
+    or 2d array, or an iterator over entries, rows, or chunks that
+    match those of rows.  With b, the result includes Q'*b.
+    @param gram if True, the result includes A'*A
+    @param chunksize the number of rows to read at once from an array.
+    The default is max(blocksize*ncols,1000).
+    @param panel the panel size for a wide matrix, see TSQR
+    @return R, or a tuple (R, Q'*b), (R, A'*A), or (R, Q'*b, A'*A)
+    """
+    if isinstance(rows,numpy.ndarray):
+        if rows.ndim != 2:
+            raise ValueError("the matrix must be 2d, not %id"%(rows.ndim))
+        if chunksize is None:
+            chunksize = max(blocksize*(panel or rows.shape[1]),1000)
+
+    compressor = TSQR(blocksize=blocksize,gram=gram,panel=panel)
+    if b is None:
+        for chunk in _chunked(rows,chunksize):
+            compressor.add(chunk)
+        R = compressor.result()
+        if gram:
+            return R, compressor.G
+        return R
+
+    ncols = None
+    vector = False
+    for chunk,bchunk in itertools.izip(_chunked(rows,chunksize),
+            _chunked(b,chunksize)):
+        chunk = numpy.asarray(chunk,dtype=float)
+        if ncols is None:
+            ncols = chunk.shape[-1]
+            vector = numpy.ndim(bchunk) < chunk.ndim
+        compressor.add(_augment(chunk,bchunk))
+    Rb = compressor.result()
+    if ncols is None:
+        # no rows at all
+        ncols = Rb.shape[1]
+    R = Rb[:ncols,:ncols]
+    QTb = Rb[:ncols,ncols:]
+    if vector:
+        QTb = QTb[:,0]
+    result = (R, QTb)
+    if gram:
+        G = compressor.G
+        if G is not None:
+            G = G[:ncols,:ncols]
+        result += (G,)
+    return result
@@ -8,6 +8,7 @@ Utility routines for the tsqr and regression code.
 import sys
 import os
 import dumbo.util
+import dumbo.backends.common
 
 def setstatus(msg):
     print >>sys.stderr, "Status:", msg
@@ -31,8 +32,39 @@ def flatten(l, ltypes=(list, tuple)):
                 l[i:i + 1] = l[i]
         i += 1
     return ltype(l)
+
+class ProfiledTask(dumbo.backends.common.MapRedBase):
+    """ Run a mapper or reducer under a taskprof.Profiler or a
+    tasktrace.Tracer. """
+    def __init__(self,task,profiler):
+        self.task = task
+        self.profiler = profiler
+
+    def __call__(self,data):
+        return self.profiler.run_iter(self.task(data))
+
+class MeasuredReducer(dumbo.backends.common.MapRedBase):
+    """ Run a reducer and measure its input with a
+    reducestats.ReduceStats. """
+    def __init__(self,task,stats):
+        self.task = task
+        self.stats = stats
+
+    def counter(self,group,name,value):
+        self.counters[name] += value
+
+    def __call__(self,data):
+        return self.stats.run_iter(self.task(self.stats.data(data)),
+            self.task,self.counter)
         
 
+def stage_output(output,stage,nstages):
+    """ The output of a stage of a job, as dumbo names the output of
+    each iteration: <output>_pre<stage+1>, and output for the last. """
+    if stage+1 == nstages:
+        return output
+    return output + "_pre%i"%(stage+1)
+
 class GlobalOptions:
     """ A class to manage passing options to the actual jobs that run. 
     
@@ -100,4 +132,221 @@ class GlobalOptions:
         assert(self.prog is not None)
         for key,value in self.cache.items():
             self.prog.addopt('param',str(key)+'='+str(value))
-        
+
+    def getprofile(self):
+        """ Get the options of the task profiler, see taskprof.py.
+
+        @return a tuple (mode, dirname, interval) where mode is 'no',
+        'cprofile', or 'sample'
+        """
+        mode = self.getstrkey('profile','no')
+        dirname = self.getstrkey('profile_dir','')
+        interval = self.getintkey('profile_interval',5)
+        if mode not in ('no','cprofile','sample'):
+            raise ValueError(
+                "option 'profile' must be no, cprofile, or sample")
+        return mode, dirname, interval
+
+    def profiled(self,task,stage):
+        """ Wrap a mapper or reducer to run under the profiler from the
+        options, or return it if the profile is off.
+
+        @param stage the name of the task in the profile, e.g. tsqr-1-map
+        """
+        mode,dirname,interval = self.getprofile()
+        if mode == 'no' or isinstance(task,str):
+            return task
+        import taskprof
+        return ProfiledTask(task,taskprof.Profiler(stage,mode,dirname,interval))
+
+
+    def gettrace(self):
+        """ Get the option trace, see tasktrace.py.
+
+        @return 'no', 'yes', or a local directory
+        """
+        return self.getstrkey('trace','no')
+
+    def traced(self,task,stage):
+        """ Wrap a mapper or reducer to record its spans, see
+        tasktrace.py, or return it if the trace is off. """
+        trace = self.gettrace()
+        if trace == 'no' or isinstance(task,str):
+            return task
+        import tasktrace
+        if trace == 'yes':
+            trace = ''
+        return ProfiledTask(task,tasktrace.Tracer(stage,trace))
+
+    def getreducestats(self,hadoop=None):
+        """ Get the option reducestats, see reducestats.py.
+
+        @param hadoop the -hadoop option of the starter, the default is
+        yes with hadoop and no without
+        @return 'yes', 'no', or a local directory
+        """
+        default = 'no'
+        if hadoop:
+            default = 'yes'
+        return self.getstrkey('reducestats',default)
+
+    def measured(self,task,stage):
+        """ Wrap a reducer to measure its input, see reducestats.py, or
+        return it if the measurements are off. """
+        mode = self.getreducestats()
+        if mode == 'no' or isinstance(task,str):
+            return task
+        import reducestats
+        if mode == 'yes':
+            mode = ''
+        return MeasuredReducer(task,reducestats.ReduceStats(stage,mode))
+
+    def instrument(self,task,stage):
+        """ Wrap a mapper or reducer with the profiler and the trace
+        from the options.  A stage whose name ends with reduce is also
+        measured, see measured. """
+        task = self.traced(self.profiled(task,stage),stage)
+        if stage.endswith('reduce'):
+            task = self.measured(task,stage)
+        return task
+
+    def setjob(self,output,hadoop=None):
+        """ Save the output of the job and the hadoop directory for the
+        files of the driver, see premapper, and get the option
+        reducestats.
+
+        In the local mode of dumbo, the reducers have no work output
+        directory, so -reducestats yes becomes the local directory
+        <output>.reducestats, which is cleared here.
+        """
+        self.setkey('job_output',output)
+        self.setkey('job_hadoop',hadoop or '')
+        if self.getreducestats(hadoop) == 'yes' and not hadoop:
+            import checkpoint
+            dirname = output + '.reducestats'
+            checkpoint.LocalFS().rm(dirname)
+            self.setkey('reducestats',dirname)
+
+    def jobfs(self):
+        """ The file system with the output of the job. """
+        import checkpoint
+        hadoop = self.getstrkey('job_hadoop','')
+        if hadoop:
+            return checkpoint.HadoopFS(os.path.join(hadoop,'bin','hadoop'))
+        return checkpoint.LocalFS()
+
+    def premapper(self,driver,stage):
+        """ Return a premapper for a stage of a driver.
+
+        The premapper runs in the driver before each job.  With the
+        trace, it records the launch of the stage in the timeline of the
+        driver, see tasktrace.py, which is saved when the driver exits.
+        With -reducestats yes, it prints the skew of the reducers of the
+        last stage, whose output is the input of this one, and the skew
+        of the last stage is printed when the driver exits, see
+        reducestats.py.  Call setjob in the starter first.
+
+        @param driver the name of the driver, e.g. tsqr
+        @param stage the name of the stage in the timeline
+        """
+        def premapper(backend,fs,opts):
+            import atexit
+            import checkpoint
+            trace = self.gettrace()
+            if trace == 'yes':
+                import tasktrace
+                tasktrace.timeline(driver,self.jobfs(),
+                    self.getstrkey('job_output')).launch(stage)
+            elif trace != 'no':
+                import tasktrace
+                tasktrace.timeline(driver,checkpoint.LocalFS(),
+                    trace).launch(stage)
+            mode = self.getreducestats()
+            if mode == 'no':
+                return
+            import reducestats
+            iteration = int(dumbo.util.getopt(opts,'iteration',delete=False)[0])
+            if iteration == 0:
+                if mode == 'yes':
+                    atexit.register(reducestats.report,self.jobfs(),
+                        [self.getstrkey('job_output')])
+                else:
+                    atexit.register(reducestats.report,checkpoint.LocalFS(),
+                        [mode])
+            elif mode == 'yes':
+                reducestats.report(self.jobfs(),
+                    dumbo.util.getopt(opts,'input',delete=False))
+        return premapper
+
+    def _checkpoints(self,params):
+        import checkpoint
+        enabled = self.getstrkey('checkpoint','yes') != 'no'
+        return checkpoint.Checkpoints(self.jobfs(),params,enabled)
+
+    def _stage_inputs(self,stage,nstages):
+        if stage == 0:
+            return self.getstrkey('job_inputs').split(',')
+        return [stage_output(self.getstrkey('job_output'),stage-1,nstages)]
+
+    def first_stage(self,inputs,schedule,params):
+        """ Find the first stage of a job to run, after the stages whose
+        manifest is current, see checkpoint.py.  The starter calls this
+        after setjob, and the runner only adds the iterations from this
+        stage on, each with the premapper from staged.
+
+        The last stage always runs, so its output is never checked.
+        Use -checkpoint no to run every stage.
+
+        @param inputs the list of inputs of the job
+        @param schedule the list of the stages in the reduce schedule
+        @param params a dictionary with the parameters of the job
+        @return the index of the first stage to run
+        """
+        self.setkey('job_inputs',','.join(inputs))
+        output = self.getstrkey('job_output')
+        checkpoints = self._checkpoints(params)
+        first = 0
+        while first+1 < len(schedule) and checkpoints.current(first,
+                self._stage_inputs(first,len(schedule)),
+                stage_output(output,first,len(schedule)),
+                {'schedule': schedule[:first+1]}):
+            print "Stage %i (%s) is current in %s"%(first+1,schedule[first],
+                stage_output(output,first,len(schedule)))
+            first += 1
+        self.setkey('first_stage',first)
+        if self.prog:
+            # keep the outputs of the stages for the next run
+            self.prog.addopt('preoutputs','yes')
+        return first
+
+    def staged(self,premapper,stage,schedule,params):
+        """ Wrap the premapper of a stage of a job with checkpoints.
+
+        dumbo numbers the outputs of the iterations it runs, so after
+        the skipped stages, see first_stage, the premapper sets the
+        input and the output of the iteration to those of the stage.  It
+        also writes the manifest of the last stage, whose output is done
+        when this one starts.
+
+        @param stage the index of the stage
+        @param schedule the list of the stages in the reduce schedule
+        @param params a dictionary with the parameters of the job
+        """
+        nstages = len(schedule)
+        def staged_premapper(backend,fs,opts):
+            output = self.getstrkey('job_output')
+            if stage > 0:
+                dumbo.util.getopt(opts,'input',delete=True)
+                dumbo.util.getopt(opts,'inputformat',delete=True)
+                opts.append(('input',stage_output(output,stage-1,nstages)))
+                opts.append(('inputformat','sequencefile'))
+            if stage+1 < nstages:
+                dumbo.util.getopt(opts,'output',delete=True)
+                opts.append(('output',stage_output(output,stage,nstages)))
+            if stage > self.getintkey('first_stage',0):
+                self._checkpoints(params).save(stage-1,
+                    self._stage_inputs(stage-1,nstages),
+                    stage_output(output,stage-1,nstages),
+                    {'schedule': schedule[:stage]})
+            premapper(backend,fs,opts)
+        return staged_premapper
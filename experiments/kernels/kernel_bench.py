@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+"""
+kernel_bench.py
+===============
+
+Time the local kernels that reduce a block of rows into a running
+factor, without Hadoop, to pick the blocksize for each number of
+columns.
+
+The times in experiments/blocksize/experiment.log are whole Hadoop
+jobs, so they mix the noise of the cluster with the cost of the
+kernel.  This program times each kernel alone, on one core, for a grid
+of ncols and blocksize.  A buffer of blocksize*ncols rows is reduced
+into the factor, as in the tasks:
+
+  tsqr : tsqrlib.TSQR.add_block and compress, the path of SerialTSQR
+    in dumbo/tsqr.py and hadoopy/tsqr.py: stack R on the buffer and
+    compute the R factor with numpy.linalg.qr.
+  lapack : the QR factorization in place in a preallocated buffer of
+    ncols + blocksize*ncols rows in Fortran order, with the LAPACK
+    routine dgeqrf from scipy.  Without scipy, this is
+    numpy.linalg.qr(...,'raw') on the same buffer, which copies it.
+  gram : A'*A of the stacked buffer added to a running sum, as in
+    NormalEquations.AtA in hadoopy/normal.py.
+  ata : A'*A with numpy.mat, as in AtA.compress in dumbo/CholeskyQR.py.
+
+Each kernel first reduces two buffers without a timer, then the time of
+each of -ncompress reductions is measured, and the throughput is the
+rows in a buffer divided by the median time.  The buffer is added in
+chunks of -chunk rows (the default is the whole buffer), so -chunk 1
+also times stacking the rows one at a time, like the tasks do for rows
+that are not packed blocks.  A configuration whose buffer needs more
+than -maxmem MB is skipped.
+
+The recommended blocksize for each kernel and ncols is the smallest
+blocksize with a throughput within -tolerance (0.05) of the best one,
+because a smaller buffer needs less memory.
+
+Usage
+-----
+
+    python kernel_bench.py [-ncols 10,50,100,500,1000,5000] \\
+        [-blocksize 1,2,3,5,10,20,50] [-kernels tsqr,lapack,gram,ata] \\
+        [-ncompress 5 -chunk <int> -maxmem 1024 -tolerance 0.05] \\
+        [-output kernels.json]
+
+      Print a table of the throughput, and write the curves and the
+      recommended blocksizes as json to -output.
+
+    python kernel_bench.py -lookup kernels.json -ncols <int> [-kernel tsqr]
+
+      Print the recommended blocksize for ncols, from the nearest ncols
+      in the file on a log scale, e.g. for a driver
+
+        python tsqr.py -mat A.mseq \\
+            -blocksize `python kernel_bench.py -lookup kernels.json -ncols 100`
+
+History
+-------
+:2011-03-27: Initial coding
+"""
+
+import sys
+import os
+import time
+import json
+import math
+import socket
+
+import numpy
+import numpy.linalg
+
+# the kernels are shared with the dumbo code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..','..','dumbo'))
+import tsqrlib
+import local_util
+
+try:
+    import scipy.linalg.lapack
+    dgeqrf = scipy.linalg.lapack.dgeqrf
+except (ImportError,AttributeError):
+    dgeqrf = None
+
+class TSQRKernel:
+    """ tsqrlib.TSQR, which compresses after blocksize*ncols rows. """
+    def __init__(self,ncols,blocksize):
+        self.tsqr = tsqrlib.TSQR(blocksize=blocksize)
+
+    def absorb(self,chunks):
+        for chunk in chunks:
+            self.tsqr.add_block(chunk)
+
+class LapackKernel:
+    """ A QR factorization in place in a preallocated buffer. """
+    def __init__(self,ncols,blocksize):
+        self.ncols = ncols
+        self.buf = numpy.zeros((ncols+blocksize*ncols,ncols),order='F')
+        self.lower = numpy.tril_indices(ncols,-1)
+        self.lwork = None
+        if dgeqrf is not None:
+            # query the size of the workspace once
+            qr,tau,work,info = dgeqrf(self.buf,lwork=-1)
+            self.lwork = int(work[0])
+
+    def absorb(self,chunks):
+        # the rows below R are the new rows
+        start = self.ncols
+        for chunk in chunks:
+            self.buf[start:start+chunk.shape[0]] = chunk
+            start += chunk.shape[0]
+        if dgeqrf is not None:
+            qr,tau,work,info = dgeqrf(self.buf,lwork=self.lwork,overwrite_a=1)
+            if qr is not self.buf:
+                self.buf[:self.ncols] = qr[:self.ncols]
+        else:
+            h,tau = numpy.linalg.qr(self.buf,'raw')
+            self.buf[:self.ncols] = h.T[:self.ncols]
+        top = self.buf[:self.ncols]
+        top[self.lower] = 0.
+
+class GramKernel:
+    """ A'*A as in NormalEquations.AtA in hadoopy/normal.py. """
+    def __init__(self,ncols,blocksize):
+        self.accum = None
+
+    def absorb(self,chunks):
+        A = numpy.vstack(chunks)
+        if self.accum is None:
+            self.accum = A.T.dot(A)
+        else:
+            self.accum += A.T.dot(A)
+
+class AtAKernel:
+    """ A'*A with numpy.mat as in AtA.compress in dumbo/CholeskyQR.py. """
+    def __init__(self,ncols,blocksize):
+        self.A_curr = None
+
+    def absorb(self,chunks):
+        A_mat = numpy.mat(numpy.vstack(chunks))
+        A_flush = A_mat.T*A_mat
+        if self.A_curr is None:
+            self.A_curr = A_flush
+        else:
+            self.A_curr = self.A_curr + A_flush
+
+KERNELS = {'tsqr': TSQRKernel, 'lapack': LapackKernel, 'gram': GramKernel,
+    'ata': AtAKernel}
+
+def buffer_mb(ncols,blocksize):
+    """ The MB of a buffer of blocksize*ncols rows and R. """
+    return 8.*(blocksize+1)*ncols*ncols/(1024*1024)
+
+def time_kernel(kernel,ncols,blocksize,ncompress=5,chunk=None):
+    """ Time the reduction of buffers of blocksize*ncols rows.
+
+    @return the list of the times of each reduction in seconds
+    """
+    nrows = blocksize*ncols
+    if chunk is None or chunk <= 0:
+        chunk = nrows
+    A = numpy.random.randn(nrows,ncols)
+    chunks = [A[i:i+chunk] for i in xrange(0,nrows,chunk)]
+    k = KERNELS[kernel](ncols,blocksize)
+    # the first reduction starts without a factor, and then tsqrlib.TSQR
+    # carries over the rows after the limit
+    k.absorb(chunks)
+    k.absorb(chunks)
+    times = []
+    for i in xrange(ncompress):
+        t0 = time.time()
+        k.absorb(chunks)
+        times.append(time.time() - t0)
+    return times
+
+def recommend(blocksizes,throughput,tolerance=0.05):
+    """ The smallest blocksize within tolerance of the best throughput. """
+    best = max(throughput)
+    for bs,rate in zip(blocksizes,throughput):
+        if rate >= (1.-tolerance)*best:
+            return bs
+
+def run(ncols_list,blocksizes,kernels,ncompress=5,chunk=None,maxmem=1024,
+        tolerance=0.05,out=sys.stdout):
+    """ Time each kernel over the grid and return the results. """
+    results = {'host': socket.gethostname(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'numpy': numpy.__version__,
+        'lapack': 'dgeqrf' if dgeqrf is not None else 'numpy raw',
+        'ncompress': ncompress, 'chunk': chunk, 'tolerance': tolerance,
+        'kernels': {}, 'recommended': {}}
+    print >>out, "%8s %6s %9s %12s %12s"%(
+        'kernel','ncols','blocksize','rows/sec','ms/compress')
+    for kernel in kernels:
+        curves = {}
+        best = {}
+        for ncols in ncols_list:
+            curve = {'blocksize': [], 'rows per sec': [],
+                'secs per compress': [], 'skipped': []}
+            for bs in blocksizes:
+                if buffer_mb(ncols,bs) > maxmem:
+                    curve['skipped'].append(bs)
+                    continue
+                times = time_kernel(kernel,ncols,bs,ncompress,chunk)
+                secs = float(numpy.median(times))
+                rate = bs*ncols/max(secs,1e-9)
+                curve['blocksize'].append(bs)
+                curve['rows per sec'].append(rate)
+                curve['secs per compress'].append(secs)
+                print >>out, "%8s %6i %9i %12.0f %12.3f"%(
+                    kernel, ncols, bs, rate, 1000.*secs)
+                out.flush()
+            curves[str(ncols)] = curve
+            if curve['blocksize']:
+                best[str(ncols)] = recommend(curve['blocksize'],
+                    curve['rows per sec'],tolerance)
+        results['kernels'][kernel] = curves
+        results['recommended'][kernel] = best
+    return results
+
+def lookup(results,ncols,kernel='tsqr'):
+    """ The recommended blocksize for the nearest ncols on a log scale. """
+    best = results['recommended'][kernel]
+    if len(best) == 0:
+        raise ValueError("there are no results for the kernel %s"%(kernel))
+    nearest = min(best,key=lambda n: abs(math.log(float(n)/ncols)))
+    return best[nearest]
+
+def _intlist(arg):
+    return [int(v) for v in arg.split(',')]
+
+def main(args):
+    if 'lookup' in args:
+        results = json.load(open(args['lookup']))
+        print lookup(results,int(args['ncols']),args.get('kernel','tsqr'))
+        return
+    kernels = args.get('kernels','tsqr,lapack,gram,ata').split(',')
+    for kernel in kernels:
+        if kernel not in KERNELS:
+            print >>sys.stderr, "Error: unknown kernel %s"%(kernel)
+            sys.exit(1)
+    chunk = args.get('chunk',None)
+    if chunk is not None:
+        chunk = int(chunk)
+    results = run(_intlist(args.get('ncols','10,50,100,500,1000,5000')),
+        _intlist(args.get('blocksize','1,2,3,5,10,20,50')),
+        kernels, ncompress=int(args.get('ncompress',5)), chunk=chunk,
+        maxmem=float(args.get('maxmem',1024)),
+        tolerance=float(args.get('tolerance',0.05)))
+    print
+    print "recommended blocksize"
+    for kernel in kernels:
+        best = results['recommended'][kernel]
+        print "%8s %s"%(kernel, ' '.join('%s:%i'%(n,best[n])
+            for n in sorted(best,key=int)))
+    output = args.get('output','kernels.json')
+    f = open(output,'w')
+    json.dump(results,f,indent=1,sort_keys=True)
+    f.close()
+    local_util.setstatus('wrote %s'%(output))
+
+if __name__=='__main__':
+    main(local_util.get_args(sys.argv[1:]))
@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+
+"""
+perf_track.py
+=============
+
+Track the rows/sec of the TSQR tasks against stored baselines, on one
+machine and without Hadoop.
+
+The program runs a fixed set of workloads.  Each one feeds the records
+of a synthetic matrix to a mapper or reducer of this repository, the
+way the streaming framework would, and measures the rows per second:
+
+  tsqrlib-rows : tsqrlib.TSQR.add_row, without any framework
+  tsqr-map-rows : the mapper tsqr.SerialTSQR on rows as lists of doubles
+  tsqr-map-blocks : the same on packed blocks of rows, see rowblock.py
+  tsqr-map-lines : the same on rows as lines of text
+  tsqr-reduce : the reducer tsqr.SerialTSQR on the R factors of mappers
+  normal-map-rows : the mapper NormalEquations in hadoopy/normal.py
+  cholesky-map-rows : the mapper AtA in CholeskyQR.py on packed doubles
+  svd-left-map-rows : the mapper ComputeSVDLeft in svd.py
+
+The tsqr, cholesky, and svd workloads need the dumbo module, and the
+normal workload needs hadoopy.  A workload whose module can't be
+imported is skipped.
+
+Each workload runs once without a timer, and then -repeat times
+(the default is 7).  The repetitions of the workloads are interleaved,
+so a change in the speed of the machine affects all of them alike.
+The default sizes take about a minute in total.
+
+The baseline file (the default is baselines.json next to this program)
+has a list of baselines.  Each one has a label, the git commit, the
+machine, and the rows/sec of each repetition of each workload.  The
+file has a format version, and each baseline has the version of the
+workloads, WORKLOADS_VERSION.  It changes when a workload changes, and
+a baseline with another version isn't compared.
+
+The comparison with a baseline uses the logs of the rates, so the
+change is a ratio.  The confidence interval of the ratio is from
+Welch's t-test on the logs at the level -confidence (0.95).  A change
+is significant if the interval doesn't contain 1 and the change is at
+least -min_change (0.02), i.e. 2%.
+
+Usage
+-----
+
+    python perf_track.py [-baseline <file>] [-against <label>] \\
+        [-save <label>] [-workloads <name>,...] [-repeat 7] \\
+        [-scale 1.0] [-confidence 0.95] [-min_change 0.02] \\
+        [-output <file.json>] [-fail_on_slowdown yes]
+
+      Run the workloads and compare them with the latest baseline with
+      the same workloads version, or the one with -against <label>.
+      With -save <label>, add the results to the baseline file.  With
+      -scale, the number of rows of each workload is multiplied by the
+      scale.  With -fail_on_slowdown yes, the exit status is 1 if a
+      workload is significantly slower.
+
+    python perf_track.py -list yes [-baseline <file>]
+
+      List the workloads and the baselines.
+
+History
+-------
+:2011-03-28: Initial coding
+"""
+
+import sys
+import os
+import time
+import json
+import math
+import socket
+import struct
+import atexit
+import tempfile
+import subprocess
+
+import numpy
+
+mydir = os.path.dirname(os.path.abspath(__file__))
+# the tasks are in the dumbo and hadoopy directories
+sys.path.append(os.path.join(mydir,'..','..','dumbo'))
+sys.path.append(os.path.join(mydir,'..','..','hadoopy'))
+import local_util
+
+FORMAT_VERSION = 1
+WORKLOADS_VERSION = 1
+
+def _matrix(nrows,ncols,seed=0):
+    return numpy.random.RandomState(seed).randn(nrows,ncols)
+
+def _rows(A):
+    return [(i,[float(v) for v in row]) for i,row in enumerate(A)]
+
+class Workload:
+    """ A task on the records of a synthetic matrix.
+
+    @param name the name of the workload
+    @param nrows the number of rows of the matrix
+    @param ncols the number of columns
+    @param prepare a function prepare(A) that returns a function that
+    runs the task once, and imports the modules of the task
+    """
+    def __init__(self,name,nrows,ncols,prepare):
+        self.name = name
+        self.nrows = nrows
+        self.ncols = ncols
+        self.prepare = prepare
+
+    def setup(self,scale=1.):
+        """ Build the records and return the function that runs the
+        task, or raise ImportError. """
+        self.nrows = max(int(self.nrows*scale),1)
+        return self.prepare(_matrix(self.nrows,self.ncols))
+
+def tsqrlib_rows(A):
+    import tsqrlib
+    rows = [row for key,row in _rows(A)]
+    def run():
+        t = tsqrlib.TSQR(blocksize=3)
+        for row in rows:
+            t.add_row(row)
+        t.result()
+    return run
+
+def tsqr_map(records):
+    import tsqr
+    def run():
+        mapper = tsqr.SerialTSQR(blocksize=3,isreducer=False)
+        for out in mapper(iter(records)):
+            pass
+    return run
+
+def tsqr_map_rows(A):
+    return tsqr_map(_rows(A))
+
+def tsqr_map_blocks(A):
+    import rowblock
+    return tsqr_map([(i,rowblock.pack(A[i:i+100]))
+        for i in xrange(0,A.shape[0],100)])
+
+def tsqr_map_lines(A):
+    return tsqr_map([(i,' '.join(repr(float(v)) for v in row))
+        for i,row in enumerate(A)])
+
+def tsqr_reduce(A):
+    import tsqr
+    # the R factors of the mappers of blocks of 10*ncols rows
+    nblock = 10*A.shape[1]
+    values = []
+    for i in xrange(0,A.shape[0],nblock):
+        R = numpy.linalg.qr(A[i:i+nblock],'r')
+        values.extend([float(v) for v in row] for row in R)
+    def run():
+        reducer = tsqr.SerialTSQR(blocksize=3,isreducer=True)
+        for out in reducer(iter([(0,iter(values))])):
+            pass
+    return run
+
+def normal_map_rows(A):
+    import normal
+    records = _rows(A)
+    def run():
+        mapper = normal.NormalEquations(blocksize=3,isreducer=False)
+        for key,value in records:
+            mapper(key,value)
+        for out in mapper.close():
+            pass
+    return run
+
+def cholesky_map_rows(A):
+    import CholeskyQR
+    ncols = A.shape[1]
+    fmt = 'd'*ncols
+    records = [(i,struct.pack(fmt,*row)) for i,row in enumerate(A)]
+    def run():
+        mapper = CholeskyQR.AtA(blocksize=3,isreducer=False,ncols=ncols)
+        for out in mapper(iter(records)):
+            pass
+    return run
+
+def svd_left_map_rows(A):
+    import svd
+    fd,Rfile = tempfile.mkstemp(suffix='.tmat')
+    os.close(fd)
+    atexit.register(os.remove,Rfile)
+    numpy.savetxt(Rfile,numpy.linalg.qr(A,'r'))
+    records = _rows(A)
+    def run():
+        mapper = svd.ComputeSVDLeft(Rfile,blocksize=3)
+        for out in mapper(iter(records)):
+            pass
+    return run
+
+WORKLOADS = [
+    Workload('tsqrlib-rows',100000,50,tsqrlib_rows),
+    Workload('tsqr-map-rows',100000,50,tsqr_map_rows),
+    Workload('tsqr-map-blocks',200000,50,tsqr_map_blocks),
+    Workload('tsqr-map-lines',30000,50,tsqr_map_lines),
+    Workload('tsqr-reduce',200000,50,tsqr_reduce),
+    Workload('normal-map-rows',100000,50,normal_map_rows),
+    Workload('cholesky-map-rows',100000,50,cholesky_map_rows),
+    Workload('svd-left-map-rows',50000,50,svd_left_map_rows),
+]
+
+def _quiet(func):
+    """ Run a function with stderr, for counters and status, sent to
+    /dev/null, and return its time in seconds. """
+    devnull = os.open(os.devnull,os.O_WRONLY)
+    saved = os.dup(2)
+    sys.stderr.flush()
+    os.dup2(devnull,2)
+    try:
+        t0 = time.time()
+        func()
+        return time.time() - t0
+    finally:
+        sys.stderr.flush()
+        os.dup2(saved,2)
+        os.close(saved)
+        os.close(devnull)
+
+def run_workloads(workloads,repeat=7,scale=1.,out=sys.stdout):
+    """ Run the workloads, interleaved, and return the rows/sec of each
+    repetition of each one. """
+    tasks = []
+    results = {}
+    for w in workloads:
+        try:
+            task = w.setup(scale)
+        except ImportError, msg:
+            print >>out, "skipping %s: %s"%(w.name,msg)
+            continue
+        # the first run is not timed
+        _quiet(task)
+        tasks.append((w,task))
+        results[w.name] = {'rows': w.nrows, 'ncols': w.ncols,
+            'rows per sec': []}
+    for r in xrange(repeat):
+        for w,task in tasks:
+            dt = _quiet(task)
+            results[w.name]['rows per sec'].append(w.nrows/max(dt,1e-9))
+        local_util.setstatus('finished repetition %i of %i'%(r+1,repeat))
+    return results
+
+def t_quantile(p,df):
+    """ The p quantile of Student's t distribution with df degrees of
+    freedom.
+
+    Without scipy, this is the Cornish-Fisher expansion around the
+    normal quantile, which is accurate to about 1% for df >= 3.
+    """
+    try:
+        import scipy.stats
+        return float(scipy.stats.t.ppf(p,df))
+    except ImportError:
+        pass
+    # the normal quantile by bisection on erf
+    lo,hi = -10.,10.
+    for i in xrange(100):
+        mid = (lo+hi)/2.
+        if 0.5*(1.+math.erf(mid/math.sqrt(2.))) < p:
+            lo = mid
+        else:
+            hi = mid
+    z = (lo+hi)/2.
+    df = max(df,1.)
+    return (z + (z**3+z)/(4.*df) + (5*z**5+16*z**3+3*z)/(96.*df**2)
+        + (3*z**7+19*z**5+17*z**3-15*z)/(384.*df**3))
+
+def compare(base,new,confidence=0.95,min_change=0.02):
+    """ Compare the rates of a workload with a baseline.
+
+    @return a dictionary with the ratio new/base of the geometric mean
+    rates, its confidence interval, and the verdict
+    """
+    lb = numpy.log(numpy.array(base,dtype=float))
+    ln = numpy.log(numpy.array(new,dtype=float))
+    d = ln.mean() - lb.mean()
+    nb,nn = len(lb),len(ln)
+    vb = lb.var(ddof=1)/nb if nb > 1 else 0.
+    vn = ln.var(ddof=1)/nn if nn > 1 else 0.
+    se = math.sqrt(vb+vn)
+    if se > 0. and nb > 1 and nn > 1:
+        # the Welch-Satterthwaite degrees of freedom
+        df = (vb+vn)**2/(vb**2/(nb-1) + vn**2/(nn-1))
+        half = t_quantile(0.5+confidence/2.,df)*se
+    else:
+        half = 0.
+    lo,hi = math.exp(d-half), math.exp(d+half)
+    ratio = math.exp(d)
+    if hi < 1. and ratio <= 1.-min_change:
+        verdict = 'SLOWER'
+    elif lo > 1. and ratio >= 1.+min_change:
+        verdict = 'faster'
+    else:
+        verdict = 'same'
+    return {'ratio': ratio, 'low': lo, 'high': hi, 'verdict': verdict}
+
+def machine():
+    """ Describe the processor of this machine. """
+    try:
+        for line in open('/proc/cpuinfo'):
+            if line.startswith('model name'):
+                return line.split(':',1)[1].strip()
+    except IOError:
+        pass
+    return os.uname()[4]
+
+def git_commit():
+    try:
+        p = subprocess.Popen(['git','rev-parse','--short','HEAD'],cwd=mydir,
+            stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        out,err = p.communicate()
+    except OSError:
+        return None
+    if p.returncode != 0:
+        return None
+    return out.strip()
+
+def load_baselines(filename):
+    if not os.path.exists(filename):
+        return {'format version': FORMAT_VERSION, 'baselines': []}
+    data = json.load(open(filename))
+    if data.get('format version') != FORMAT_VERSION:
+        raise ValueError("%s has format version %s, not %i"%(
+            filename, data.get('format version'), FORMAT_VERSION))
+    return data
+
+def save_baselines(filename,data):
+    tmpname = filename + '.tmp'
+    f = open(tmpname,'w')
+    json.dump(data,f,indent=1,sort_keys=True)
+    f.close()
+    os.rename(tmpname,filename)
+
+def find_baseline(data,label=None):
+    """ The baseline with a label, or the latest one for the current
+    workloads version. """
+    for b in reversed(data['baselines']):
+        if label is not None:
+            if b['label'] == label:
+                return b
+        elif b['workloads version'] == WORKLOADS_VERSION:
+            return b
+    return None
+
+def _summary(rates):
+    """ The geometric mean rate and the half width of its interval. """
+    logs = numpy.log(numpy.array(rates))
+    mean = math.exp(logs.mean())
+    if len(rates) < 2:
+        return mean, 0.
+    half = t_quantile(0.975,len(rates)-1)*logs.std(ddof=1)/math.sqrt(len(rates))
+    return mean, mean*(math.exp(half)-1.)
+
+def report(results,baseline,confidence=0.95,min_change=0.02,out=sys.stdout):
+    """ Print the rates and the comparison with the baseline.
+
+    @return the comparisons of each workload
+    """
+    comparisons = {}
+    if baseline is not None:
+        print >>out, "baseline %s (commit %s, %s)"%(baseline['label'],
+            baseline.get('commit'), baseline['time'])
+        if baseline['machine'] != machine():
+            print >>out, "Warning: the baseline is from another machine, %s"%(
+                baseline['machine'])
+    print >>out
+    print >>out, "%-20s %18s %12s %8s %18s %s"%('workload','rows/sec',
+        'baseline','change','interval','')
+    for name in [w.name for w in WORKLOADS]:
+        if name not in results:
+            continue
+        rates = results[name]['rows per sec']
+        mean,half = _summary(rates)
+        line = "%-20s %10.0f +-%6.0f"%(name,mean,half)
+        if baseline is not None and name in baseline['workloads']:
+            base = baseline['workloads'][name]
+            if base['rows'] != results[name]['rows']:
+                line += "  (the baseline has %i rows)"%(base['rows'])
+            else:
+                c = compare(base['rows per sec'],rates,confidence,min_change)
+                comparisons[name] = c
+                line += " %12.0f %+7.1f%% [%+6.1f%%,%+6.1f%%] %s"%(
+                    _summary(base['rows per sec'])[0], 100.*(c['ratio']-1.),
+                    100.*(c['low']-1.), 100.*(c['high']-1.), c['verdict'])
+        print >>out, line
+    return comparisons
+
+def main(args):
+    filename = args.get('baseline',os.path.join(mydir,'baselines.json'))
+    data = load_baselines(filename)
+    if 'list' in args:
+        for w in WORKLOADS:
+            print "%-20s %7i rows %4i cols"%(w.name,w.nrows,w.ncols)
+        print
+        for b in data['baselines']:
+            print "%-20s commit %s, %s, workloads version %i"%(
+                b['label'],b.get('commit'),b['time'],b['workloads version'])
+        return 0
+    names = args.get('workloads',None)
+    workloads = WORKLOADS
+    if names is not None:
+        names = names.split(',')
+        workloads = [w for w in WORKLOADS if w.name in names]
+        if len(workloads) != len(names):
+            print >>sys.stderr, "Error: unknown workloads in %s"%(
+                args['workloads'])
+            return 1
+    confidence = float(args.get('confidence',0.95))
+    min_change = float(args.get('min_change',0.02))
+
+    results = run_workloads(workloads,int(args.get('repeat',7)),
+        float(args.get('scale',1.)))
+    baseline = find_baseline(data,args.get('against',None))
+    if baseline is None and 'against' in args:
+        print >>sys.stderr, "Error: no baseline %s in %s"%(
+            args['against'],filename)
+        return 1
+    comparisons = report(results,baseline,confidence,min_change)
+
+    run = {'label': args.get('save',None), 'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'host': socket.gethostname(), 'machine': machine(),
+        'numpy': numpy.__version__,
+        'workloads version': WORKLOADS_VERSION, 'workloads': results}
+    if 'output' in args:
+        f = open(args['output'],'w')
+        json.dump({'run': run, 'comparisons': comparisons,
+            'baseline': baseline and baseline['label']},f,indent=1)
+        f.close()
+    if 'save' in args:
+        data['baselines'].append(run)
+        save_baselines(filename,data)
+        print
+        print "saved the baseline %s to %s"%(args['save'],filename)
+    slower = [n for n,c in comparisons.items() if c['verdict'] == 'SLOWER']
+    if slower and args.get('fail_on_slowdown','no') == 'yes':
+        return 1
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main(local_util.get_args(sys.argv[1:])))
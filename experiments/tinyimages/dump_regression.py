@@ -5,6 +5,9 @@ dump_regression.py
 ==========
 
 Write out the information from a regression problem for Matlab.
+
+If the output is a local copy, from hadoop fs -get, then it is read
+with dumbo/seqfile.py and Hadoop is not needed.
 """
 
 import sys
@@ -29,8 +32,7 @@ class Converter:
             
     
 if __name__ == '__main__':
-    import dumbo.cmd
-    import dumbo.util
-    dumbo.cmd.convert(__file__, sys.argv[1], dumbo.util.parseargs(sys.argv[2:]))
+    import seqfile
+    seqfile.convert(__file__, Converter, sys.argv[1], sys.argv[2:])
 
     
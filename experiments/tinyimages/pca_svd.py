@@ -6,6 +6,13 @@ pca_svd.py
 
 Take the output from a TSQR for a PCA problem, and output
 the actual principal components.
+
+If the PCA used column centering (ti_pca.py -center columns), then
+the output also has the column mean record, which is written to
+the file <base>-mean.tmat.
+
+If the output is a local copy, from hadoop fs -get, then it is read
+with dumbo/seqfile.py and Hadoop is not needed.
 """
 
 import sys
@@ -26,10 +33,15 @@ class Converter:
         print "Reading data..."
         item = 0
         mat = []
+        mean = None
         ncols = None
         nrows = 0
         t0 = time.time()
         for key,value in data:
+            if key == 'column mean':
+                count,mean = value
+                print "  column mean of %i rows"%(count)
+                continue
             if ncols is None:
                 ncols = len(value)
                 print "  ncols=%i"%(ncols)
@@ -66,7 +78,7 @@ class Converter:
             Vf.write("\n")
         Vf.close()
         
-        print "Writing S diagonal to %s"%(Vfilename)
+        print "Writing S diagonal to %s"%(Sfilename)
         Sf = open(Sfilename,'wt')
         for entry in S:
             Sf.write("%18.16e\n"%(entry))
@@ -79,12 +91,19 @@ class Converter:
                 Rf.write("%18.16e "%(entry))
             Rf.write("\n")
         Rf.close()
+        
+        if mean is not None:
+            Mfilename = base + "-mean.tmat"
+            print "Writing column mean to %s"%(Mfilename)
+            Mf = open(Mfilename, 'wt')
+            for entry in mean:
+                Mf.write("%18.16e\n"%(entry))
+            Mf.close()
     
         
     
 if __name__ == '__main__':
-    import dumbo.cmd
-    import dumbo.util
-    dumbo.cmd.convert(__file__, sys.argv[1], dumbo.util.parseargs(sys.argv[2:]))
+    import seqfile
+    seqfile.convert(__file__, Converter, sys.argv[1], sys.argv[2:])
 
     
@@ -6,6 +6,15 @@ regression_output.py
 
 Take the output from a TSQR Least Squares problem and output
 the regression coefficients.
+
+If the output is a local copy, from hadoop fs -get, then it is read
+with dumbo/seqfile.py and Hadoop is not needed.
+
+If R is rank deficient, the solution is the basic solution on the
+independent columns from a QR factorization with column pivoting, see
+dumbo/rrqr.py, and the other coefficients are zero.  The output only
+has R, not the number of rows of the data, so the rank tolerance is
+n*eps, which can miss a dependent column of a tall matrix.
 """
 
 import sys
@@ -15,6 +24,8 @@ import numpy
 import numpy.linalg
 import time
 
+import rrqr
+
 class Converter:
     def __init__(self,opts):
         pass
@@ -52,8 +63,11 @@ class Converter:
         print "Solving system"
         R = numpy.array(mat)
         y = numpy.array(b)
-        x = numpy.linalg.solve(R,y)
         t0 = time.time()
+        x,rank = rrqr.lstsq(R,y)
+        if rank < ncols:
+            print "  R has rank %i, so %i coefficients are zero"%(
+                rank, ncols-rank)
         
         dt = time.time() - t0
         print "  (done! %.1f sec)"%(dt)
@@ -88,8 +102,7 @@ class Converter:
         
     
 if __name__ == '__main__':
-    import dumbo.cmd
-    import dumbo.util
-    dumbo.cmd.convert(__file__, sys.argv[1], dumbo.util.parseargs(sys.argv[2:]))
+    import seqfile
+    seqfile.convert(__file__, Converter, sys.argv[1], sys.argv[2:])
 
     
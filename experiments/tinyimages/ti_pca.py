@@ -17,58 +17,35 @@ import time
 import numpy
 import numpy.linalg
 
-import array
-
 import util
 import tsqr
+import checkpoint
+import rcache
 
 import dumbo
 import dumbo.backends.common
 
-import struct
+import tinyimages
 
 
 # create the global options structure
 gopts = util.GlobalOptions()
 
-class TinyImages:
-    def unpack_key(self,key):
-        #keystr = key
-        #print >>sys.stderr,"keystr: ", repr(keystr)
-        key = struct.unpack('>q',key)[0]
-        if key%(3*1024) is not 0:
-            print >>sys.stderr,"Warning, unpacking invalid key %i\n"%(key)
-        #print >>sys.stderr,"key: ", key
-        key = key/(3*1024)
-        return key
-        
-    def unpack_value(self,value):
-        im = array.array('B',value)
-        red = im[0:1024]
-        green = im[1024:2048]
-        blue = im[2048:3072]
-        
-        return (red,green,blue)
-        
-    def sum_rgb(self,value):
-        (red,green,blue) = self.unpack_value(value)
-        return (sum(red),sum(green),sum(blue))
-        
-    def togray(self,value):
-        """ Convert an input value in bytes into a floating point grayscale array. """
-        (red,green,blue) = self.unpack_value(value)
-        
-        gray = []
-        for i in xrange(1024):
-            graypx = (0.299*float(red[i]) + 0.587*float(green[i]) +
-                0.114*float(blue[i]))/255.
-            gray.append(graypx)
-            
-        return gray
-        
-class TinyImagesPCA(tsqr.SerialTSQR, TinyImages):
-    def __init__(self,blocksize):
-        tsqr.SerialTSQR.__init__(self,blocksize=blocksize,isreducer=False)
+class TinyImagesPCA(tsqr.CenteredTSQR, tinyimages.TinyImages):
+    """ The mapper for the PCA of the tinyimages data.
+    
+    The center option determines how the grayscale images are centered:
+      'rows' : subtract the mean of each image (the default)
+      'columns' : subtract the mean of each pixel over all images, this
+        is computed in the same pass as the R factor (see CenteredTSQR)
+      'both' : first center each image, then each pixel
+      'none' : do not center the data.
+    """
+    def __init__(self,blocksize,batchsize=1024,center='rows'):
+        tsqr.CenteredTSQR.__init__(self,blocksize=blocksize,isreducer=False,
+            center=center in ('columns','both'))
+        self.batchsize = batchsize
+        self.rowcenter = center in ('rows','both')
         
     def __call__(self,data):
         """ 
@@ -76,58 +53,75 @@ class TinyImagesPCA(tsqr.SerialTSQR, TinyImages):
         @param value a byte-string for the current image.
         """
         
-        firstkey = True
-        
-        for key,value in data:
-            key = self.unpack_key(key)
-            
-
-            gray = self.togray(value)
-            
-            mean = sum(gray)/float(len(gray))
-            for i in xrange(len(gray)):
-                gray[i] -= mean # center the pixels
+        for keys,block in self.batches(data,self.batchsize):
+            gray = self.togray_block(block)
+            if self.rowcenter:
+                self.center_block(gray) # center the pixels
                 
             # supply to TSQR
-            self.collect(key,gray)
-            
-            #if firstkey:
-                #print >>sys.stderr, "key: %i, sumrgb="%(key), self.sum_rgb(value)
-                #print >>sys.stderr, "key: %i, sumgray=%18.16e"%(key,sum(gray)) 
-                #print >>sys.stderr, "key: %i, maxgray=%18.16e"%(key,max(gray))
-                #print >>sys.stderr, "key: %i, mingray=%18.16e"%(key,min(gray))  
-                #print >>sys.stderr, "key: %i, lengray=%18.16e"%(key,len(gray))
-                
-            firstkey = False
-                
-                #yield key, gray
+            self.collect_block(keys[0],gray)
                 
         # finally, output data
         for k,v in self.close():
             yield k,v
+
+def pca_arrays(pairs):
+    """ The R factor, and the column means, in the output pairs. """
+    meankey = tsqr.CenteredTSQR.meankey
+    arrays = {'R': rcache.matrix([(k,v) for k,v in pairs if k != meankey])}
+    for key,value in pairs:
+        if key == meankey:
+            arrays['count'] = numpy.array(value[0])
+            arrays['mean'] = numpy.array(value[1],dtype=float)
+    return arrays
+
+def store_R(backend,fs,opts):
+    """ Store the R factor in the cache when the driver exits, see
+    rcache.py.  This is the premapper of the last stage. """
+    hadoop = gopts.getstrkey('hadoop')
+    if hadoop:
+        fs = checkpoint.HadoopFS(os.path.join(hadoop,'bin','hadoop'))
+    else:
+        fs = checkpoint.LocalFS()
+    rcache.store_at_exit(gopts.getstrkey('rcache'),fs,
+        [gopts.getstrkey('input')],gopts.getstrkey('output'),
+        pca_arrays,kind='pca R',center=gopts.getstrkey('center'))
     
 def runner(job):
     #niter = int(os.getenv('niter'))
     
     blocksize = gopts.getintkey('blocksize')
+    batchsize = gopts.getintkey('batchsize')
+    nperval = gopts.getintkey('records_per_value')
+    center = gopts.getstrkey('center')
     schedule = gopts.getstrkey('reduce_schedule')
     
+    colcenter = center in ('columns','both')
+    
     schedule = schedule.split(',')
     for iter,part in enumerate(schedule):
+        kwargs = {}
+        if iter+1 == len(schedule):
+            kwargs['premapper'] = store_R
         if iter > 0:
             nreducers = int(part)
             job.additer(mapper='org.apache.hadoop.mapred.lib.IdentityMapper',
-                    reducer=tsqr.SerialTSQR(blocksize=blocksize,isreducer=True),
-                    opts=[('numreducetasks',str(nreducers))])
+                    reducer=tsqr.CenteredTSQR(blocksize=blocksize,isreducer=True,
+                        center=colcenter),
+                    opts=[('numreducetasks',str(nreducers))],**kwargs)
         else:
             nreducers = int(part)
-            job.additer(mapper=TinyImagesPCA(blocksize=blocksize),
-                    reducer=tsqr.SerialTSQR(blocksize=blocksize,isreducer=True),
+            job.additer(mapper=TinyImagesPCA(blocksize=blocksize,
+                        batchsize=batchsize,center=center),
+                    reducer=tsqr.CenteredTSQR(blocksize=blocksize,isreducer=True,
+                        center=colcenter),
                     #reducer = dumbo.lib.identityreducer,
                     opts=[('numreducetasks',str(nreducers)),
                           ('inputformat','org.apache.hadoop.mapred.lib.FixedLengthInputFormat'),
                           ('jobconf','mapreduce.input.fixedlengthinputformat.record.length=3072'),
-                          ('libjar','../../java/build/jar/hadoop-lib.jar')])
+                          ('jobconf','mapreduce.input.fixedlengthinputformat.records.per.value=%i'%(nperval)),
+                          ('libjar','../../java/build/jar/hadoop-lib.jar')],
+                    **kwargs)
 
 def starter(prog):
     
@@ -140,11 +134,28 @@ def starter(prog):
     prog.addopt('libegg','numpy')
     prog.addopt('file','../../dumbo/util.py')
     prog.addopt('file','../../dumbo/tsqr.py')
+    prog.addopt('file','../../dumbo/rowblock.py')
+    prog.addopt('file','../../dumbo/tsqrlib.py')
+    prog.addopt('file','../../dumbo/memstats.py')
+    prog.addopt('file','../../dumbo/tasktrace.py')
+    prog.addopt('file','../../dumbo/rrqr.py')
+    prog.addopt('file','../../dumbo/textrows.py')
+    prog.addopt('file','../../dumbo/tbio.py')
+    prog.addopt('file','../../dumbo/seqfile.py')
+    prog.addopt('file','../../dumbo/local_util.py')
+    prog.addopt('file','../../dumbo/checkpoint.py')
+    prog.addopt('file','../../dumbo/rcache.py')
+    prog.addopt('file','tinyimages.py')
     
     input = '/data/tinyimages/original/tiny_images.bin'
     output = 'tsqr-mr/ti/pca-R.mseq'
     
     gopts.getintkey('blocksize',3)
+    gopts.getintkey('batchsize',1024)
+    gopts.getintkey('records_per_value',1)
+    center = gopts.getstrkey('center','rows')
+    if center not in ('rows','columns','both','none'):
+        return "'center' must be one of rows, columns, both, or none"
     gopts.getstrkey('reduce_schedule','1')
     
     # determine the split size
@@ -153,6 +164,30 @@ def starter(prog):
         prog.addopt('jobconf',
             'mapreduce.input.fileinputformat.split.minsize='+str(splitsize))
     
+    # look up the R factor in the cache, see rcache.py
+    hadoop = prog.getopt('hadoop')
+    if hadoop:
+        fs = checkpoint.HadoopFS(os.path.join(hadoop,'bin','hadoop'))
+    else:
+        fs = checkpoint.LocalFS()
+    cache,key,arrays = rcache.lookup(prog.delopt('rcache'),fs,[input],
+        kind='pca R',center=center)
+    if cache is None:
+        gopts.setkey('rcache','no')
+    else:
+        gopts.setkey('rcache',cache.path)
+    gopts.setkey('hadoop',hadoop or '')
+    gopts.setkey('input',input)
+    gopts.setkey('output',output)
+    if arrays is not None:
+        print "Found the R factor of %s in %s"%(input,cache.path)
+        pairs = [(i,util.array2list(row)) for i,row in enumerate(arrays['R'])]
+        if 'mean' in arrays:
+            pairs.append((tsqr.CenteredTSQR.meankey,
+                (int(arrays['count']),util.array2list(arrays['mean']))))
+        rcache.write_output(fs,output,pairs)
+        sys.exit(0)
+    
     prog.addopt('input',input)
     prog.addopt('output',output)
     prog.addopt('overwrite','yes')
@@ -20,6 +20,10 @@ import numpy.linalg
 import array
 
 import util
+import tsqrlib
+import textrows
+import checkpoint
+import rcache
 
 import dumbo
 import dumbo.backends.common
@@ -32,9 +36,16 @@ import tinyimages
 # create the global options structure
 gopts = util.GlobalOptions()
 
-class TSQRLeastSquares(dumbo.backends.common.MapRedBase):
+class TSQRLeastSquares(tsqrlib.TSQR,dumbo.backends.common.MapRedBase):
+    """ The TSQR mapper and reducer for a least squares problem.
+
+    Each row is stored with its right hand side entry as one more
+    column, so tsqrlib.TSQR compresses [A b] into R and Q'*b at once,
+    like tsqrlib.tsqr with b.  The output has a record (c[i], R[i,:])
+    for each row of R.
+    """
     def __init__(self,blocksize=3,keytype='random',isreducer=False):
-        self.blocksize=blocksize
+        tsqrlib.TSQR.__init__(self,blocksize=blocksize)
         if keytype=='random':
             self.keyfunc = lambda x: random.randint(0, 4000000000)
         elif keytype=='first':
@@ -43,11 +54,6 @@ class TSQRLeastSquares(dumbo.backends.common.MapRedBase):
             raise Error("Unkonwn keytype %s"%(keytype))
         self.first_key = None
         self.isreducer=isreducer
-        self.nrows = 0
-        self.resid = 0.
-        self.data = []
-        self.rhs = []
-        self.ncols = None
     
     def _firstkey(self, i):
         if isinstance(self.first_key, (list,tuple)):
@@ -58,39 +64,11 @@ class TSQRLeastSquares(dumbo.backends.common.MapRedBase):
     def array2list(self,row):
         return [float(val) for val in row]
 
-    def QR(self):
-        A = numpy.array(self.data)
-        b = numpy.array(self.rhs)
-        Q, R = numpy.linalg.qr(A,'full')
-        c = numpy.dot(Q.T, b)
-        nb = numpy.linalg.norm(b)
-        nc = numpy.linalg.norm(c)
-        self.resid += nb - nc
-        return R, c
-        
-    def compress(self):
-        """ Compute a QR factorization on the data accumulated so far. """
-        
-        if self.ncols is None:
-            return
-        if len(self.data) < self.ncols:
-            return
-            
-        
-        t0 = time.time()
-        R, c = self.QR()
-        dt = time.time() - t0
-        self.counters['numpy time (millisecs)'] += int(1000*dt)
-        
-        # reset data and re-initialize to R
-        self.data = []
-        for row in R:
-            self.data.append(self.array2list(row))
-           
-        self.rhs = []
-        for entry in c:
-            self.rhs.append(entry)
-            
+    def counter(self,group,name,value):
+        self.counters[name] += value
+
+    def message(self,msg):
+        print >>sys.stderr, msg
             
     def collect(self,key,entry,row):
         """
@@ -98,39 +76,42 @@ class TSQRLeastSquares(dumbo.backends.common.MapRedBase):
         @param row the row of the matrix
         @param entry the right hand side entry for the least squares problem
         """
-        if len(self.data) == 0:
+        if self.first_key is None:
             self.first_key = key
-            
-        if self.ncols == None:
-            self.ncols = len(row)
-            print >>sys.stderr, "Matrix size: %i columns"%(self.ncols)
-        else:
-            # TODO should we warn and truncate here?
-            # No. that seems like something that will introduce
-            # bugs.  Maybe we could add a "liberal" flag
-            # for that.
-            assert(len(row) == self.ncols)
+        self.add_row(numpy.hstack((numpy.asarray(row,dtype=float),[entry])))
         
-        self.data.append(row)
-        self.rhs.append(entry)
-        self.nrows += 1
+    def collect_block(self,key,entries,block):
+        """
+        @param key the key for the first row of the block
+        @param block a 2d array with one row of the matrix per row
+        @param entries the array of right hand side entries for the block
+        """
+        if self.first_key is None:
+            self.first_key = key
+        assert(len(entries) == block.shape[0])
+        entries = numpy.asarray(entries,dtype=float).reshape(block.shape[0],1)
+        self.add_block(numpy.hstack((block,entries)))
         
-        if len(self.data)>self.blocksize*self.ncols:
-            self.counters['QR Compressions'] += 1
-            # compress the data
-            self.compress()
-            
-        # write status updates so Hadoop doesn't complain
-        if self.nrows%50000 == 0:
-            self.counters['rows processed'] += 50000
+    def collect_lines(self):
+        """ Parse the batch of lines of text and collect the rows.
+        
+        The first entry on each line is the right hand side entry.
+        """
+        keys,A,nbad = self.lines.parse(self.ncols)
+        if nbad > 0:
+            self.counters['malformed lines'] += nbad
+        if len(keys) > 0:
+            self.collect_block(keys[0],A[:,0],A[:,1:])
         
     def close(self):
-        self.counters['rows processed'] += self.nrows%50000
-        self.compress()
-        for i,row in enumerate(self.data):
+        self.collect_lines()
+        Rb = self.result()
+        if Rb.shape[0] == 0:
+            return
+        ncols = Rb.shape[1]-1
+        for i,row in enumerate(Rb[:ncols]):
             key = self.keyfunc(i)
-            rhs = self.rhs[i]
-            yield key, (rhs,row)
+            yield key, (float(row[ncols]),self.array2list(row[:ncols]))
         
     
     def __call__(self,data):
@@ -138,9 +119,10 @@ class TSQRLeastSquares(dumbo.backends.common.MapRedBase):
             # map job
             for key,value in data:
                 if isinstance(value, str):
-                    # handle conversion from string
-                    value = [float(p) for p in value.split()]
-                    value = [value[0], value[1:]]
+                    # parse lines of text in batches
+                    if self.lines.append(key,value):
+                        self.collect_lines()
+                    continue
                 self.collect(key,value[0],value[1])
                 
         else:
@@ -154,46 +136,69 @@ class TSQRLeastSquares(dumbo.backends.common.MapRedBase):
 class TinyImagesRegression(TSQRLeastSquares, tinyimages.TinyImages):
     """ This class is just a mapper to setup the TSQRLeastSquares problem.
     """
-    def __init__(self):
+    def __init__(self,batchsize=1024):
         TSQRLeastSquares.__init__(self)
+        self.batchsize = batchsize
         
     def __call__(self,data):
-        for key,val in data:
-            key = self.unpack_key(key)
+        for keys,block in self.batches(data,self.batchsize):
             # if enabled, stop early... (very helpful while debugging the reducer)
-            #if key > 40000:
+            #if keys[0] > 40000:
                 #continue
-            sums = self.sum_rgb(val)
-            row = self.togray(val)
+            sums = self.sum_rgb_block(block)
+            gray = self.togray_block(block)
             
-            self.collect(key,sums[0],row)
-            #yield key, 
+            self.collect_block(keys[0],sums[:,0],gray)
         for k,v in self.close():
             yield k,v
+
+def regression_arrays(pairs):
+    """ R and Q'*b in the output pairs. """
+    return {'R': rcache.matrix([(k,v[1]) for k,v in pairs]),
+        'QTb': numpy.array([v[0] for k,v in pairs],dtype=float)}
+
+def store_R(backend,fs,opts):
+    """ Store R and Q'*b in the cache when the driver exits, see
+    rcache.py.  This is the premapper of the last stage. """
+    hadoop = gopts.getstrkey('hadoop')
+    if hadoop:
+        fs = checkpoint.HadoopFS(os.path.join(hadoop,'bin','hadoop'))
+    else:
+        fs = checkpoint.LocalFS()
+    rcache.store_at_exit(gopts.getstrkey('rcache'),fs,
+        [gopts.getstrkey('input')],gopts.getstrkey('output'),
+        regression_arrays,kind='regression R QTb')
         
     
 def runner(job):
     #niter = int(os.getenv('niter'))
     
     blocksize = gopts.getintkey('blocksize')
+    batchsize = gopts.getintkey('batchsize')
+    nperval = gopts.getintkey('records_per_value')
     schedule = gopts.getstrkey('reduce_schedule')
     
     schedule = schedule.split(',')
     for iter,part in enumerate(schedule):
+        kwargs = {}
+        if iter+1 == len(schedule):
+            kwargs['premapper'] = store_R
         if iter > 0:
             nreducers = int(part)
             job.additer(mapper='org.apache.hadoop.mapred.lib.IdentityMapper',
                     reducer=TSQRLeastSquares(blocksize=blocksize,isreducer=True),
-                    opts=[('numreducetasks',str(nreducers))])
+                    opts=[('numreducetasks',str(nreducers))],**kwargs)
         else:
             nreducers = int(part)
-            job.additer(mapper=TinyImagesRegression,
+            job.additer(mapper=TinyImagesRegression(batchsize=batchsize),
                     reducer=TSQRLeastSquares(blocksize=blocksize,isreducer=True),
                     #reducer = dumbo.lib.identityreducer,
                     opts=[('numreducetasks',str(nreducers)),
                           ('inputformat','org.apache.hadoop.mapred.lib.FixedLengthInputFormat'),
                           ('jobconf','mapreduce.input.fixedlengthinputformat.record.length=3072'),
-                          ('libjar','../../java/build/jar/hadoop-lib.jar')])
+                          ('jobconf','mapreduce.input.fixedlengthinputformat.records.per.value=%i'%(nperval)),
+                          ('libjar','../../java/build/jar/hadoop-lib.jar')],
+                    **kwargs)
 
 def starter(prog):
     
@@ -205,14 +210,46 @@ def starter(prog):
     prog.addopt('memlimit','4g')
     prog.addopt('libegg','numpy')
     prog.addopt('file','../../dumbo/util.py')
+    prog.addopt('file','../../dumbo/tsqrlib.py')
+    prog.addopt('file','../../dumbo/memstats.py')
+    prog.addopt('file','../../dumbo/tasktrace.py')
+    prog.addopt('file','../../dumbo/textrows.py')
+    prog.addopt('file','../../dumbo/rowblock.py')
+    prog.addopt('file','../../dumbo/tbio.py')
+    prog.addopt('file','../../dumbo/seqfile.py')
+    prog.addopt('file','../../dumbo/local_util.py')
+    prog.addopt('file','../../dumbo/checkpoint.py')
+    prog.addopt('file','../../dumbo/rcache.py')
     prog.addopt('file','tinyimages.py')
     
     input = '/data/tinyimages/original/tiny_images.bin'
     output = 'tsqr-mr/ti/ti-regress.vseq'
     
     gopts.getintkey('blocksize',3)
+    gopts.getintkey('batchsize',1024)
+    gopts.getintkey('records_per_value',1)
     gopts.getstrkey('reduce_schedule','1')
     
+    # look up R and Q'*b in the cache, see rcache.py
+    hadoop = prog.getopt('hadoop')
+    if hadoop:
+        fs = checkpoint.HadoopFS(os.path.join(hadoop,'bin','hadoop'))
+    else:
+        fs = checkpoint.LocalFS()
+    cache,key,arrays = rcache.lookup(prog.delopt('rcache'),fs,[input],
+        kind='regression R QTb')
+    if cache is None:
+        gopts.setkey('rcache','no')
+    else:
+        gopts.setkey('rcache',cache.path)
+    gopts.setkey('hadoop',hadoop or '')
+    gopts.setkey('input',input)
+    gopts.setkey('output',output)
+    if arrays is not None:
+        print "Found R and Q'*b for %s in %s"%(input,cache.path)
+        rcache.write_output(fs,output,[(i,(float(c),util.array2list(row)))
+            for i,(c,row) in enumerate(zip(arrays['QTb'],arrays['R']))])
+        sys.exit(0)
     
     prog.addopt('input',input)
     prog.addopt('output',output)
@@ -15,6 +15,14 @@ import sys
 import array
 import struct
 
+import numpy
+
+# the number of bytes in each tinyimages record
+imsize = 3*1024
+
+# the weights for the grayscale conversion
+graywts = numpy.array([0.299, 0.587, 0.114])
+
 class TinyImages:
     def unpack_key(self,key):
         #keystr = key
@@ -49,3 +57,86 @@ class TinyImages:
             gray.append(graypx)
             
         return gray
+        
+    def unpack_keys(self,keys,nimages=None):
+        """ Convert a list of keys into an array of image indices. 
+        
+        @param keys a list of packed byte offsets into the tinyimages file
+        @param nimages if each value holds several consecutive images,
+        then nimages is an array with the number of images in each
+        value.  The keys for the later images in a value are computed
+        from the offset of the first one.
+        """
+        keys = numpy.frombuffer(''.join(keys),dtype='>i8')
+        invalid = keys%imsize != 0
+        if invalid.any():
+            for key in keys[invalid]:
+                print >>sys.stderr,"Warning, unpacking invalid key %i\n"%(key)
+        keys = keys/imsize
+        if nimages is not None:
+            # the index of each image is the index of the first image in 
+            # its value plus its position in the value
+            first = numpy.cumsum(nimages) - nimages
+            keys = numpy.repeat(keys - first, nimages)
+            keys += numpy.arange(len(keys))
+        return keys
+        
+    def unpack_block(self,values):
+        """ Convert a list of values into a nimages-by-3072 uint8 array. """
+        block = numpy.frombuffer(''.join(values),dtype=numpy.uint8)
+        return block.reshape(len(block)/imsize,imsize)
+        
+    def sum_rgb_block(self,block):
+        """ Return the sum of the red, green, and blue channels for 
+        each image in a block as a len(block)-by-3 array. """
+        return block.reshape(block.shape[0],3,1024).sum(axis=2)
+        
+    def togray_block(self,block):
+        """ Convert a block of images into a floating point grayscale array
+        with one image per row. """
+        gray = numpy.dot(graywts,block.reshape(block.shape[0],3,1024))
+        gray /= 255.
+        return gray
+        
+    def center_block(self,gray):
+        """ Center each row of a grayscale block by its mean, in place. """
+        gray -= gray.mean(axis=1)[:,numpy.newaxis]
+        return gray
+        
+    def batches(self,data,batchsize=1024):
+        """ Group the records in data into blocks of raw images.
+        
+        Each value may hold several consecutive images, which happens
+        when the FixedLengthInputFormat is used with more than one
+        record per value.
+        
+        @param data the iterator of key, value pairs from the input
+        @param batchsize the minimum number of images in each block
+        @return an iterator over (keys, block) pairs where keys is
+        an array of image indices and block is a uint8 array with
+        one 3072-byte image per row.
+        """
+        keys = []
+        values = []
+        nimages = []
+        nbatch = 0
+        for key,value in data:
+            n = len(value)/imsize
+            if n*imsize != len(value):
+                print >>sys.stderr,"Warning, truncating value with %i bytes"%(
+                    len(value))
+                value = value[:n*imsize]
+            keys.append(key)
+            values.append(value)
+            nimages.append(n)
+            nbatch += n
+            if nbatch >= batchsize:
+                yield (self.unpack_keys(keys,numpy.array(nimages)), 
+                    self.unpack_block(values))
+                keys = []
+                values = []
+                nimages = []
+                nbatch = 0
+        if len(values) > 0:
+            yield (self.unpack_keys(keys,numpy.array(nimages)), 
+                self.unpack_block(values))
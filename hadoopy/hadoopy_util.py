@@ -18,6 +18,49 @@ def setstatus(msg):
     print >>sys.stderr, "Status:", msg
     hadoopy.status(msg)    
 
+class ProfiledTask:
+    """ Run a hadoopy mapper or reducer under a taskprof.Profiler or a
+    tasktrace.Tracer.
+
+    The profile or the trace starts with the first record and is
+    saved after the output of close.
+    """
+    def __init__(self,task,profiler):
+        self.task = task
+        self.profiler = profiler
+
+    def __call__(self,*args):
+        self.profiler.start()
+        return self.task(*args)
+
+    def close(self):
+        self.profiler.start()
+        outputs = None
+        if hasattr(self.task,'close'):
+            outputs = self.task.close()
+        if outputs is None:
+            outputs = []
+        return self.profiler.run_iter(outputs)
+
+class MeasuredReducer:
+    """ Run a hadoopy reducer and measure its input with a
+    reducestats.ReduceStats, which is saved after the output of close.
+    """
+    def __init__(self,task,stats):
+        self.task = task
+        self.stats = stats
+
+    def __call__(self,key,values):
+        return self.task(key,self.stats.values(values))
+
+    def close(self):
+        outputs = None
+        if hasattr(self.task,'close'):
+            outputs = self.task.close()
+        if outputs is None:
+            outputs = []
+        return self.stats.run_iter(outputs,self.task,hadoopy.counter)
+
 class SavedOptions:
     """ Save options to pass to derivative hadoopy jobs. 
     
@@ -72,3 +115,94 @@ class SavedOptions:
         for key,value in self.cache.items():
             env.append(str(key)+'='+str(value))
         return env
+
+    def getprofile(self):
+        """ Get the options of the task profiler, see dumbo/taskprof.py.
+
+        @return a tuple (mode, dirname, interval) where mode is 'no',
+        'cprofile', or 'sample'
+        """
+        mode = self.getstrkey('profile','no')
+        dirname = self.getstrkey('profile_dir','')
+        interval = self.getintkey('profile_interval',5)
+        if mode not in ('no','cprofile','sample'):
+            raise ValueError(
+                "option 'profile' must be no, cprofile, or sample")
+        return mode, dirname, interval
+
+    def profiled(self,task,stage):
+        """ Wrap a mapper or reducer to run under the profiler from the
+        options, or return it if the profile is off.
+
+        @param stage the name of the task in the profile, e.g. tsqr-1-map
+        """
+        mode,dirname,interval = self.getprofile()
+        if mode == 'no':
+            return task
+        import taskprof
+        return ProfiledTask(task,taskprof.Profiler(stage,mode,dirname,interval))
+
+
+    def gettrace(self):
+        """ Get the option trace, see tasktrace.py.
+
+        @return 'no', 'yes', or a local directory
+        """
+        return self.getstrkey('trace','no')
+
+    def traced(self,task,stage):
+        """ Wrap a mapper or reducer to record its spans, see
+        tasktrace.py, or return it if the trace is off. """
+        trace = self.gettrace()
+        if trace == 'no':
+            return task
+        import tasktrace
+        if trace == 'yes':
+            trace = ''
+        return ProfiledTask(task,tasktrace.Tracer(stage,trace))
+
+    def getreducestats(self):
+        """ Get the option reducestats, see dumbo/reducestats.py.
+
+        @return 'yes', 'no' (the default), or a local directory
+        """
+        return self.getstrkey('reducestats','no')
+
+    def measured(self,task,stage):
+        """ Wrap a reducer to measure its input, see
+        dumbo/reducestats.py, or return it if the measurements are off.
+        """
+        mode = self.getreducestats()
+        if mode == 'no':
+            return task
+        import reducestats
+        if mode == 'yes':
+            mode = ''
+        return MeasuredReducer(task,reducestats.ReduceStats(stage,mode))
+
+    def instrument(self,task,stage):
+        """ Wrap a mapper or reducer with the profiler and the trace
+        from the options.  A stage whose name ends with reduce is also
+        measured, see measured. """
+        task = self.traced(self.profiled(task,stage),stage)
+        if stage.endswith('reduce'):
+            task = self.measured(task,stage)
+        return task
+
+    def report_reducers(self,fs,output,final=False):
+        """ Print the skew of the reducers after a job, see
+        dumbo/reducestats.py.
+
+        With -reducestats yes, this is the stage with the output in fs.
+        With a local directory, this is all the stages in the directory
+        after the final job.
+        """
+        mode = self.getreducestats()
+        if mode == 'no':
+            return
+        import reducestats
+        if mode == 'yes':
+            reducestats.report(fs,[output])
+        elif final:
+            import checkpoint
+            reducestats.report(checkpoint.LocalFS(),[mode])
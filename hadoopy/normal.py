@@ -12,7 +12,8 @@ Usage
     # ensure that the hadoop command executes the correct hadoop
     export HADOOP_HOME=/path/to/hadoop/dir
     python normal.py -mat <hdfspath> \
-        [-output <hdfspath> -blocksize <int> -reduce_schedule <string>]
+        [-output <hdfspath> -blocksize <int> -reduce_schedule <string> \
+         -checkpoint yes|no -reducestats yes|no|<dir>]
     
       -mat <path> : the path to a matrix stored in HDFS where the
         row is an array of values.  
@@ -44,6 +45,13 @@ Usage
         will first use an identity map-reduce operation to spread the
         data over the cluster.  This will increase the number of mappers
         at the next stage, which can dramatically increase speed.
+        
+      -checkpoint yes|no : With yes (the default), the stages whose
+        manifest still matches are skipped, see tsqr.py.
+
+      -reducestats yes|no|<dir> : each reducer measures its input, and
+        this driver prints the skew of the reducers of each stage, see
+        tsqr.py and dumbo/reducestats.py.  The default is no.
     
 History
 -------
@@ -63,6 +71,14 @@ import hadoopy
 
 import hadoopy_util
 
+# these modules are shared with the dumbo code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..','dumbo'))
+import rowblock
+import textrows
+import checkpoint
+import reducestats
+
 # the globally saved options.  The actual mapreduce jobs pickup 
 # their saved options from the command line environment.  The 
 # source job picks up its options from the command line arguments.
@@ -73,9 +89,13 @@ class NormalEquations():
         self.blocksize=blocksize
         self.first_key = None
         self.nrows = 0
+        self.nreported = 0
+        self.nbuffered = 0
         self.data = []
         self.ncols = None
         self.accum = None
+        self.ncompress = 0
+        self.lines = textrows.LineBatch()
         
         if isreducer:
             self.__call__ = self.reducer
@@ -88,52 +108,90 @@ class NormalEquations():
 
     def AtA(self):
         """ Compute the product A'*A with the local block of rows. """
-        A = numpy.array(self.data)
+        A = numpy.vstack(self.data)
         return A.T.dot(A)
         
     def compress(self):
         """ Compute a QR factorization on the data accumulated so far. """
+        if self.nbuffered == 0:
+            return
+        self.ncompress += 1
         if self.accum is None:
             self.accum = self.AtA()
         else:
             self.accum += self.AtA()
         self.data = []
+        self.nbuffered = 0
     
-    def collect(self,key,value):
-        if len(self.data) == 0:
-            self.first_key = key
-        
+    def _check_ncols(self,ncols):
         if self.ncols == None:
-            self.ncols = len(value)
+            self.ncols = ncols
             print >>sys.stderr, "Matrix size: %i columns"%(self.ncols)
         else:
             # TODO should we warn and truncate here?
             # No. that seems like something that will introduce
             # bugs.  Maybe we could add a "liberal" flag
             # for that.
-            assert(len(value) == self.ncols)
-        
-        self.data.append(value)
-        self.nrows += 1
+            assert(ncols == self.ncols)
+            
+    def _buffered(self,nrows):
+        """ Update the counts after nrows were added to the buffer. """
+        self.nbuffered += nrows
+        self.nrows += nrows
         
-        if len(self.data)>self.blocksize*self.ncols:
+        if self.nbuffered>self.blocksize*self.ncols:
             hadoopy.counter('Program','QR Compressions',1)
             # compress the data
             self.compress()
             
         # write status updates so Hadoop doesn't complain
-        if self.nrows%50000 == 0:
-            hadoopy.counter('Program','rows processed',50000)
+        if self.nrows - self.nreported >= 50000:
+            hadoopy.counter('Program','rows processed',
+                self.nrows - self.nreported)
+            self.nreported = self.nrows
+    
+    def collect(self,key,value):
+        if self.nbuffered == 0:
+            self.first_key = key
+        
+        self._check_ncols(len(value))
+        self.data.append(value)
+        self._buffered(1)
+        
+    def collect_block(self,key,block):
+        """ Collect a 2d array of rows at once, see rowblock.py """
+        if self.nbuffered == 0:
+            self.first_key = key
+        
+        self._check_ncols(block.shape[1])
+        self.data.append(block)
+        self._buffered(block.shape[0])
+        
+    def collect_lines(self):
+        """ Parse the batch of lines of text and collect the rows. """
+        keys,A,nbad = self.lines.parse(self.ncols)
+        if nbad > 0:
+            hadoopy.counter('Program','malformed lines',nbad)
+        if len(keys) > 0:
+            self.collect_block(keys[0],A)
             
     def mapper_close(self):
+        self.collect_lines()
         self.compress()
+        if self.accum is None:
+            return
         for i,row in enumerate(self.accum):
             yield i, self.array2list(row)
             
     def mapper(self,key,value):
+        if rowblock.isblock(value):
+            self.collect_block(key,rowblock.unpack(value))
+            return
         if isinstance(value, str):
-            # handle conversion from string
-            value = [float(p) for p in value.split()]
+            # parse lines of text in batches
+            if self.lines.append(key,value):
+                self.collect_lines()
+            return
         self.collect(key,value)
         
     def reducer(self,key,values):
@@ -159,12 +217,16 @@ def starter(args, launch=True):
     
     gopts.getintkey('blocksize',3)
     schedule = gopts.getstrkey('reduce_schedule','1')
+    gopts.getreducestats()
 
-    # clear the output
     output = args.get('output','%s-normal%s'%(matname,matext))
-    if hadoopy.exists(output):
-        print "Removing %s"%(output)
-        hadoopy.rm(output)
+    
+    # the stages whose manifest matches are skipped
+    fs = checkpoint.HadoopFS()
+    checkpoints = checkpoint.Checkpoints(fs,
+        {'script': 'normal.py', 'blocksize': gopts.getintkey('blocksize')},
+        enabled=args.get('checkpoint','yes') != 'no')
+    resume = True
     
     outputnamefunc = lambda x: output+"_iter%i"%(x)
     steps = schedule.split(',')
@@ -177,12 +239,20 @@ def starter(args, launch=True):
             curoutput = output
         else:
             curoutput = output+"_iter%i"%(i+1)
-            if hadoopy.exists(curoutput):
-                hadoopy.rm(curoutput)
             
         gopts.setkey('iter',i)
             
         if launch:
+            params = {'schedule': steps[:i+1]}
+            if resume and checkpoints.current(i,[input],curoutput,params):
+                print "Skipping stage %i, %s is current"%(i,curoutput)
+                continue
+            resume = False
+            
+            # clear the output
+            if hadoopy.exists(curoutput):
+                print "Removing %s"%(curoutput)
+                hadoopy.rm(curoutput)
             if i>0:
                 mapper="org.apache.hadoop.mapred.lib.IdentityMapper"
                 hadoopy.launch_frozen(input, curoutput, __file__, 
@@ -191,6 +261,8 @@ def starter(args, launch=True):
             else:
                 hadoopy.launch_frozen(input, curoutput, __file__, 
                     cmdenvs=gopts.cmdenv(), num_reducers=int(step))
+            gopts.report_reducers(fs,curoutput,final=i+1==len(steps))
+            checkpoints.save(i,[input],curoutput,params)
     
     
 def runner():
@@ -201,6 +273,7 @@ def runner():
     
     mapper = NormalEquations(blocksize=blocksize,isreducer=False)
     reducer =  NormalEquations(blocksize=blocksize,isreducer=True)
+    reducer = gopts.measured(reducer,'normal-%i-reduce'%(iter+1))
     
     
     hadoopy.run(mapper, reducer)
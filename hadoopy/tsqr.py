@@ -12,7 +12,12 @@ Usage
     # ensure that the hadoop command executes the correct hadoop
     export HADOOP_HOME=/path/to/hadoop/dir
     python tsqr.py -mat <hdfspath> \
-        [-output <hdfspath> -blocksize <int> -reduce_schedule <string>]
+        [-output <hdfspath> -blocksize <int> -reduce_schedule <string> \
+         -typedbytes hadoopy|tbio -checkpoint yes|no -panel <int> \
+         -memstats yes|<dir> -tracemalloc <int> \
+         -profile no|cprofile|sample -profile_dir <dir> \
+         -profile_interval <int> -trace yes|<dir> \
+         -reducestats yes|no|<dir>]
     
       -mat <path> : the path to a matrix stored in HDFS where the
         row is an array of values.  
@@ -49,6 +54,57 @@ Usage
         this value reduces the number of mappers launched for large 
         problems.  The default split_size is the HDFS block size 
         (dfs.block.size).  The size of the split is in bytes.
+        
+      -typedbytes <string> : the typed bytes reader for the map and
+        reduce tasks.  With 'hadoopy' (the default), hadoopy decodes each
+        row into a list.  With 'tbio', dumbo/tbio.py decodes each row
+        into a NumPy array, which is much faster for rows of doubles.
+        
+      -checkpoint yes|no : After each stage, a manifest with the
+        parameters and the fingerprints of the input and the output
+        is written to <stage output>/_manifest, see dumbo/checkpoint.py.
+        With yes (the default), the stages whose manifest still matches
+        are skipped and the job resumes from the first stale stage.
+        With no, all the stages run again.
+        
+      -rcache <dir> : the directory of the R factor cache, see
+        dumbo/rcache.py.  The default is ~/.mrtsqr/rcache.  If the R
+        factor of the matrix is in the cache, the output is written
+        from the cache and no job runs.  Otherwise, the R factor is
+        saved in the cache after the job.  Use -rcache no to disable
+        the cache.
+
+      -panel <int> : for a matrix with thousands of columns, read
+        blocksize*panel rows at a time and update R one panel of
+        columns at a time, see dumbo/tsqrlib.py.  The default is 0,
+        i.e. read blocksize*ncols rows at a time.
+
+      -memstats yes|<dir> : report the peak memory and the peak size of
+        the buffer of each task, see dumbo/memstats.py.  With a
+        directory, the report is also written there on each node.
+        -tracemalloc <n> adds the n largest allocation sites.
+
+      -profile no|cprofile|sample : run each task under cProfile or a
+        sampling profiler that records the stack every
+        -profile_interval milliseconds of CPU time (the default is 5).
+        Each task writes its profile to the output of its stage as
+        _profile.<stage>.<task>.prof or .json, or with -profile_dir
+        <dir>, to a local directory on each node, see
+        dumbo/taskprof.py.  Merge the profiles of the tasks with
+        dumbo/profile_report.py.
+
+      -trace yes|<dir> : each task records the spans of its reads,
+        compresses, and output, and this driver records the launch and
+        finish of each stage.  With yes, the files go to the output of
+        each stage, and with a directory, to a local directory.  Merge
+        them into one Chrome trace with dumbo/tasktrace.py.
+
+      -reducestats yes|no|<dir> : each reducer measures the keys, rows,
+        bytes, and R factors of its input, and this driver prints the
+        skew of the reducers of each stage after its job, see
+        dumbo/reducestats.py.  The default is no.  With a directory,
+        the reducers write to a local directory, and the driver reports
+        the directory after the final job.
     
 History
 -------
@@ -60,7 +116,6 @@ __author__ = 'David F. Gleich'
 import sys
 import os
 import random
-import time
 
 import numpy
 import numpy.linalg
@@ -69,14 +124,28 @@ import hadoopy
 
 import hadoopy_util
 
+# these modules are shared with the dumbo code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..','dumbo'))
+import tbio
+import rowblock
+import tsqrlib
+import checkpoint
+import rcache
+import taskprof
+import tasktrace
+import reducestats
+
 # the globally saved options.  The actual mapreduce jobs pickup 
 # their saved options from the command line environment.  The 
 # source job picks up its options from the command line arguments.
 gopts = hadoopy_util.SavedOptions()
 
-class SerialTSQR():
-    def __init__(self,blocksize=3,keytype='random',isreducer=False):
-        self.blocksize=blocksize
+class SerialTSQR(tsqrlib.TSQR):
+    """ The TSQR mapper and reducer, see dumbo/tsqrlib.py """
+    def __init__(self,blocksize=3,keytype='random',isreducer=False,
+            panel=None):
+        tsqrlib.TSQR.__init__(self,blocksize=blocksize,panel=panel)
         if keytype=='random':
             self.keyfunc = lambda x: random.randint(0, 4000000000)
         elif keytype=='first':
@@ -84,9 +153,6 @@ class SerialTSQR():
         else:
             raise Error("Unkonwn keytype %s"%(keytype))
         self.first_key = None
-        self.nrows = 0
-        self.data = []
-        self.ncols = None
         
         if isreducer:
             self.__call__ = self.reducer
@@ -101,61 +167,43 @@ class SerialTSQR():
     
     def array2list(self,row):
         return [float(val) for val in row]
-
-    def QR(self):
-        A = numpy.array(self.data)
-        return numpy.linalg.qr(A,'r')
         
-    def compress(self):
-        """ Compute a QR factorization on the data accumulated so far. """
-        t0 = time.time()
-        R = self.QR()
-        dt = time.time() - t0
-        hadoopy.counter('Timer','numpy time (millisecs)',int(1000*dt))
+    def counter(self,group,name,value):
+        hadoopy.counter(group,name,value)
         
-        # reset data and re-initialize to R
-        self.data = []
-        for row in R:
-            self.data.append(self.array2list(row))
-            
-            
+    def message(self,msg):
+        print >>sys.stderr, msg
     
     def collect(self,key,value):
-        if len(self.data) == 0:
+        if self.first_key is None:
             self.first_key = key
+        self.add_row(value)
         
-        if self.ncols == None:
-            self.ncols = len(value)
-            print >>sys.stderr, "Matrix size: %i columns"%(self.ncols)
-        else:
-            # TODO should we warn and truncate here?
-            # No. that seems like something that will introduce
-            # bugs.  Maybe we could add a "liberal" flag
-            # for that.
-            assert(len(value) == self.ncols)
-        
-        self.data.append(value)
-        self.nrows += 1
+    def collect_block(self,key,block):
+        """ Collect a 2d array of rows at once, see rowblock.py """
+        if self.first_key is None:
+            self.first_key = key
+        self.add_block(block)
         
-        if len(self.data)>self.blocksize*self.ncols:
-            hadoopy.counter('Program','QR Compressions',1)
-            # compress the data
-            self.compress()
-            
-        # write status updates so Hadoop doesn't complain
-        if self.nrows%50000 == 0:
-            hadoopy.counter('Program','rows processed',50000)
+    def collect_line(self,key,line):
+        """ Collect a row as a line of text, see tsqrlib.TSQR.add_line """
+        if self.first_key is None:
+            self.first_key = key
+        self.add_line(line)
             
     def close(self):
-        self.compress()
-        for i,row in enumerate(self.data):
+        for i,row in enumerate(self.result()):
             key = self.keyfunc(i)
-            yield key, row
+            yield key, self.array2list(row)
+        tasktrace.since('emit')
             
     def mapper(self,key,value):
+        if rowblock.isblock(value):
+            self.collect_block(key,rowblock.unpack(value))
+            return
         if isinstance(value, str):
-            # handle conversion from string
-            value = [float(p) for p in value.split()]
+            self.collect_line(key,value)
+            return
         self.collect(key,value)
         
     def reducer(self,key,values):
@@ -174,13 +222,37 @@ def starter(args, launch=True):
     matname,matext = os.path.splitext(mat)
     
     gopts.getintkey('blocksize',3)
+    gopts.getintkey('panel',0)
+    gopts.getstrkey('memstats','no')
+    gopts.getintkey('tracemalloc',0)
+    gopts.getprofile()
+    trace = gopts.gettrace()
+    gopts.getreducestats()
     schedule = gopts.getstrkey('reduce_schedule','1')
-
-    # clear the output
+    typedbytes = gopts.getstrkey('typedbytes','hadoopy')
+    if typedbytes not in ('hadoopy','tbio'):
+        raise NameError("'typedbytes' must be hadoopy or tbio")
+    
     output = args.get('output','%s-qrr%s'%(matname,matext))
-    if hadoopy.exists(output):
-        print "Removing %s"%(output)
-        hadoopy.rm(output)
+    
+    fs = checkpoint.HadoopFS()
+    timeline = None
+    if launch and trace != 'no':
+        timeline = tasktrace.timeline('tsqr')
+    if launch:
+        # look up the R factor in the cache
+        cache,key,arrays = rcache.lookup(args.get('rcache',None),fs,[mat])
+        if arrays is not None:
+            print "Found the R factor of %s in %s"%(mat,cache.path)
+            rcache.write_matrix(fs,output,arrays['R'])
+            return
+    
+    # the stages whose manifest matches are skipped
+    checkpoints = checkpoint.Checkpoints(fs,
+        {'script': 'tsqr.py', 'blocksize': gopts.getintkey('blocksize'),
+         'panel': gopts.getintkey('panel')},
+        enabled=args.get('checkpoint','yes') != 'no')
+    resume = True
     
     outputnamefunc = lambda x: output+"_iter%i"%(x)
     steps = schedule.split(',')
@@ -205,16 +277,38 @@ def starter(args, launch=True):
             curoutput = output
         else:
             curoutput = output+"_iter%i"%(i+1)
-            if hadoopy.exists(curoutput):
-                hadoopy.rm(curoutput)
             
         gopts.setkey('iter',i)
             
         if launch:
+            params = {'schedule': steps[:i+1]}
+            if resume and checkpoints.current(i,[input],curoutput,params):
+                print "Skipping stage %i, %s is current"%(i,curoutput)
+                continue
+            resume = False
+            
+            # clear the output
+            if hadoopy.exists(curoutput):
+                print "Removing %s"%(curoutput)
+                hadoopy.rm(curoutput)
+            if timeline is not None:
+                timeline.launch('%i (%s)'%(i+1,step))
             hadoopy.launch_frozen(input, curoutput, __file__, 
                 mapper=mapper,
                 cmdenvs=gopts.cmdenv(), num_reducers=int(step),
                 jobconfs=jobconfs)
+            if timeline is not None:
+                timeline.finish()
+            gopts.report_reducers(fs,curoutput,final=i+1==len(steps))
+            checkpoints.save(i,[input],curoutput,params)
+            
+    if launch and cache is not None:
+        cache.put(key,{'R': rcache.read_matrix(fs,output)},{'input': mat})
+    if timeline is not None:
+        if trace == 'yes':
+            timeline.save(fs,output)
+        else:
+            timeline.save(checkpoint.LocalFS(),trace)
     
     
 def runner():
@@ -222,11 +316,18 @@ def runner():
     iter = gopts.getintkey('iter')
     blocksize = gopts.getintkey('blocksize')
     reduce_schedule = gopts.getstrkey('reduce_schedule')
+    typedbytes = gopts.getstrkey('typedbytes')
+    panel = gopts.getintkey('panel') or None
     
-    mapper = SerialTSQR(blocksize=blocksize,isreducer=False)
-    reducer = SerialTSQR(blocksize=blocksize,isreducer=True)
+    mapper = SerialTSQR(blocksize=blocksize,isreducer=False,panel=panel)
+    reducer = SerialTSQR(blocksize=blocksize,isreducer=True,panel=panel)
+    mapper = gopts.instrument(mapper,'tsqr-%i-map'%(iter+1))
+    reducer = gopts.instrument(reducer,'tsqr-%i-reduce'%(iter+1))
     
-    hadoopy.run(mapper, reducer)
+    if typedbytes == 'tbio':
+        tbio.run(mapper, reducer)
+    else:
+        hadoopy.run(mapper, reducer)
             
 
 if __name__=='__main__':
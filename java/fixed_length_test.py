@@ -13,7 +13,9 @@ def mapper(data):
         if npairs>1:
             continue
         print >>sys.stderr, "key len = %i"%(len(key))
+        print >>sys.stderr, "key = %i"%(struct.unpack('>q',key)[0])
         print >>sys.stderr, "val len = %i"%(len(val))
+        print >>sys.stderr, "records in val = %i"%(len(val)/3072)
         
         im = array.array('B',val)
         
@@ -27,6 +29,10 @@ def mapper(data):
 def starter(prog):
     prog.addopt('inputformat','org.apache.hadoop.mapred.lib.FixedLengthInputFormat')
     prog.addopt('jobconf','mapreduce.input.fixedlengthinputformat.record.length=3072')
+    nperval = prog.delopt('records_per_value')
+    if nperval is not None:
+        prog.addopt('jobconf',
+            'mapreduce.input.fixedlengthinputformat.records.per.value='+nperval)
     prog.addopt('input','/data/tinyimages/original/tiny_images.bin')
     prog.addopt('output','tinyimages/test')
     prog.addopt('overwrite','yes')
@@ -7,6 +7,10 @@ Check that only one record comes out of the test.
 
 You can check that all records come out by making sure the number
 of mapped records is equal
+
+Use -records_per_value <int> to test the multi-record values from
+the FixedLengthInputFormat.  Each value then holds several images,
+and the keys for all but the first are computed from the offset.
 """
 
 
@@ -16,6 +20,8 @@ import dumbo
 import dumbo.lib
 import array
 
+reclen = 3*1024
+
 def unpack_key(key,reclen):
     key = struct.unpack('>q',key)[0]
     if key%(reclen) is not 0:
@@ -26,7 +32,10 @@ def unpack_key(key,reclen):
 def mapper(data):
     npairs = 0
     for key,val in data:
-        key = unpack_key(key,3*1024)
+        key = unpack_key(key,reclen)
+        if len(val)%reclen is not 0:
+            print >>sys.stderr,"Warning, value with %i bytes at key %i"%(
+                len(val), key)
             
         if npairs==0:
             im = array.array('B',val)
@@ -35,7 +44,9 @@ def mapper(data):
             for i in xrange(min(len(im),10)):
                 print >>sys.stderr, "val[%i] = %i"%(i, im[i])
         
-        yield key,1
+        # a value can hold many consecutive records
+        for i in xrange(len(val)/reclen):
+            yield key+i,1
         npairs += 1
         
 def reducer(key,values):
@@ -44,7 +55,7 @@ def reducer(key,values):
     for val in values:
         nval += 1
     if nval>1:
-        print >>sys.stderr,"key %i has %i values"%(key)
+        print >>sys.stderr,"key %i has %i values"%(key,nval)
         yield key, nval
     
                 
@@ -52,6 +63,10 @@ def reducer(key,values):
 def starter(prog):
     prog.addopt('inputformat','org.apache.hadoop.mapred.lib.FixedLengthInputFormat')
     prog.addopt('jobconf','mapreduce.input.fixedlengthinputformat.record.length=3072')
+    nperval = prog.delopt('records_per_value')
+    if nperval is not None:
+        prog.addopt('jobconf',
+            'mapreduce.input.fixedlengthinputformat.records.per.value='+nperval)
     prog.addopt('input','/data/tinyimages/original/tiny_images.bin')
     prog.addopt('output','tinyimages/test')
     prog.addopt('overwrite','yes')
@@ -70,6 +70,12 @@ import org.apache.hadoop.mapred.Reporter;
  * <code>(fileInputFormatsComputedSplitSize / fixedRecordLength) * fixedRecordLength</code>
  *
  * <BR><BR>
+ * To reduce the per-record overhead of very small records, users can 
+ * optionally ask for several consecutive records in each value.  In this 
+ * case, the key is the position of the first record in the value.<BR><BR>
+ * 
+ * FixedLengthInputFormat.setRecordsPerValue(myJob,[N]);<BR><BR>
+ * 
  * This InputFormat returns a FixedLengthRecordReader. <BR><BR>
  * 
  * Compressed files currently are not supported.
@@ -98,6 +104,24 @@ public class FixedLengthInputFormat
   public static final String FIXED_RECORD_LENGTH = 
     "mapreduce.input.fixedlengthinputformat.record.length"; 
   
+  /**
+   * When using FixedLengthInputFormat you can set this
+   * property in your job configuration to group N consecutive records
+   * into each value returned by FixedLengthRecordReader.  The KEY for 
+   * the value is then the position of its first record.  The default is 1.
+   * <BR><BR>
+   * 
+   * i.e. 
+   * myJobConf.setInt("mapreduce.input.fixedlengthinputformat.records.per.value",
+   *     [N]);
+   * <BR><BR>
+   * OR<BR><BR>
+   * FixedLengthInputFormat.setRecordsPerValue(myJob,[N]);
+   * 
+   */
+  public static final String FIXED_RECORDS_PER_VALUE = 
+    "mapreduce.input.fixedlengthinputformat.records.per.value";
+  
   /**
    * When using FixedLengthInputFormat you can set this
    * property in your job configuration to specify the byte position
@@ -173,6 +197,15 @@ public class FixedLengthInputFormat
     conf.setInt(FIXED_RECORD_LENGTH, recordLength);
   }
   
+  /**
+   * Set the number of records in each value
+   * @param job the job to modify
+   * @param recordsPerValue the number of consecutive records per value
+   */
+  public static void setRecordsPerValue(Configuration conf, int recordsPerValue) {
+    conf.setInt(FIXED_RECORDS_PER_VALUE, recordsPerValue);
+  }
+  
   /**
    * Set the ending position of a fixed record's key value
    * @param job the job to modify
@@ -214,6 +247,15 @@ public class FixedLengthInputFormat
     return conf.getInt(FIXED_RECORD_KEY_START_AT, -1);
   }
   
+  /**
+   * Get the number of records in each value
+   * @param conf  the Configuration
+   * return the number of records per value, at least 1
+   */
+  public static int getRecordsPerValue(Configuration conf) {
+    return Math.max(1, conf.getInt(FIXED_RECORDS_PER_VALUE, 1));
+  }
+  
   /**
    * Get record length value
    * @param conf  the Configuration
@@ -60,6 +60,13 @@ import org.apache.hadoop.io.BytesWritable;
  * by the caller when the job was configured.<BR><BR>
  * 
  * VALUE = the record itself (BytesWritable)
+ * <BR><BR>
+ * 
+ * If FixedLengthInputFormat.FIXED_RECORDS_PER_VALUE is set to N > 1, then 
+ * each VALUE holds up to N consecutive records from the InputSplit and the 
+ * KEY is the position of the first of them.  The last VALUE from each split
+ * may hold fewer than N records, but its length is always a multiple of 
+ * the record length.
  * 
  * @see FixedLengthInputFormat
  *
@@ -79,6 +86,7 @@ public class FixedLengthRecordReader
   private FSDataInputStream fileIn;
   private final Seekable filePosition;
   private int recordLength;
+  private int recordsPerValue;
   private int recordKeyStartAt;
   private int recordKeyEndAt;
   private int recordKeyLength;
@@ -98,6 +106,9 @@ public class FixedLengthRecordReader
     // the size of each fixed length record
     this.recordLength = FixedLengthInputFormat.getRecordLength(conf);
     
+    // the number of records to put into each value
+    this.recordsPerValue = FixedLengthInputFormat.getRecordsPerValue(conf);
+    
     // the start position for each key
     this.recordKeyStartAt = FixedLengthInputFormat.getRecordKeyStartAt(conf);
     
@@ -109,6 +120,7 @@ public class FixedLengthRecordReader
     
     // log some debug info
     LOG.info("FixedLengthRecordReader: recordLength="+this.recordLength);
+    LOG.info("FixedLengthRecordReader: recordsPerValue="+this.recordsPerValue);
     LOG.info("FixedLengthRecordReader: " + 
         (this.recordKeyStartAt != -1 ? 
         		(" KEY-START-AT=" + this.recordKeyStartAt + 
@@ -166,7 +178,7 @@ public class FixedLengthRecordReader
   }
   
   public BytesWritable createValue() {
-      return new BytesWritable(new byte[this.recordLength]);
+      return new BytesWritable(new byte[this.recordLength*this.recordsPerValue]);
   }
   
   private boolean isCompressedInput() {
@@ -212,16 +224,17 @@ public class FixedLengthRecordReader
   
  
   /** Read the next record in the input stream. 
-   * @param record an array of recordLength bytes.
+   * @param record an array with at least offset+recordLength bytes.
+   * @param offset the position in record to store the next record.
    * */
-  private void readRecord(byte[] record) throws IOException {
+  private void readRecord(byte[] record, int offset) throws IOException {
     int totalRead = 0; // total bytes read
     int totalToRead = recordLength; // total bytes we need to read
 
     // while we still have record bytes to read
     while(totalRead != recordLength) {
       // read in what we need
-      int read = this.in.read(record, totalRead, totalToRead);
+      int read = this.in.read(record, offset+totalRead, totalToRead);
 
       /* EOF? this is an error because each 
        * split calculated by FixedLengthInputFormat
@@ -249,20 +262,33 @@ public class FixedLengthRecordReader
     throws IOException {
     
     while (getFilePosition() < end) {
-      this.readRecord(value.getBytes());
+      // make sure value can hold all the records
+      value.setSize(recordLength*recordsPerValue);
+      byte[] valueBytes = value.getBytes();
       
       if (recordKeyStartAt != -1 && recordKeyEndAt != -1) {
-      	key.set(recordValue.getBytes(), this.recordKeyStartAt, this.recordKeyLength);
+        this.readRecord(valueBytes, 0);
+      	key.set(valueBytes, this.recordKeyStartAt, this.recordKeyLength);
       	
       // otherwise do the default action, (key is record position in the split)
       } else {
       	// default is that the the Key is the position the record started at
         byte[] posKey = toBytes(pos);
       	key.set(posKey,0,posKey.length);
+        this.readRecord(valueBytes, 0);
       }
       
       pos += recordLength;
       
+      // read the rest of the records for this value
+      int nrecords = 1;
+      while (nrecords < recordsPerValue && getFilePosition() < end) {
+        this.readRecord(valueBytes, nrecords*recordLength);
+        pos += recordLength;
+        nrecords += 1;
+      }
+      value.setSize(nrecords*recordLength);
+      
       return true;
     }
     